@@ -0,0 +1,84 @@
+"""Cold start of the bot: time and memory to import bot.py, and optionally to build the app.
+
+Usage:
+    python benchmarks/cold_start.py            # measure src/ as it is now
+    python benchmarks/cold_start.py --ref REV  # also measure src/ at a git revision, e.g. HEAD~1
+    python benchmarks/cold_start.py --app      # also time create_app() and warm_up() (needs credentials)
+
+Each measurement runs in a fresh interpreter so nothing is cached between them.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = r"""
+import json, resource, sys, time, tracemalloc
+tracemalloc.start()
+start = time.perf_counter()
+result = {}
+try:
+    import bot
+    result['import_s'] = time.perf_counter() - start
+    result['import_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+    result['pandas_loaded'] = 'pandas' in sys.modules
+    if APP and hasattr(bot, 'create_app'):
+        start = time.perf_counter()
+        bot.create_app()
+        result['create_app_s'] = time.perf_counter() - start
+        start = time.perf_counter()
+        bot.warm_up()
+        result['warm_up_s'] = time.perf_counter() - start
+except BaseException as e:
+    result['error'] = f"{type(e).__name__}: {e}"
+result['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print('RESULT ' + json.dumps(result))
+"""
+
+
+def measure(src_dir, app):
+    output = subprocess.run(
+        [sys.executable, '-c', f"APP = {app!r}\n" + MEASURE],
+        cwd=src_dir, capture_output=True, text=True
+    ).stdout
+    for line in output.splitlines():
+        if line.startswith('RESULT '):
+            return json.loads(line[len('RESULT '):])
+    return {'error': 'no result'}
+
+
+def extract(ref, target):
+    archive = subprocess.run(['git', 'archive', ref, 'src'], cwd=REPO, capture_output=True, check=True).stdout
+    path = os.path.join(target, 'src.tar')
+    with open(path, 'wb') as f:
+        f.write(archive)
+    with tarfile.open(path) as tar:
+        tar.extractall(target)
+    return os.path.join(target, 'src')
+
+
+def report(label, result):
+    print(f"{label}:")
+    for key, value in result.items():
+        print(f"  {key}: {value:.3f}" if isinstance(value, float) else f"  {key}: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ref', help="git revision to compare against")
+    parser.add_argument('--app', action='store_true', help="also build the app and warm it up")
+    args = parser.parse_args()
+
+    report("current", measure(os.path.join(REPO, 'src'), args.app))
+    if args.ref:
+        with tempfile.TemporaryDirectory() as target:
+            report(args.ref, measure(extract(args.ref, target), args.app))
+
+
+if __name__ == '__main__':
+    main()
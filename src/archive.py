@@ -0,0 +1,142 @@
+import base64
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+import pytz
+from sheet_cache import row_key
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_HEADERS = ['User ID', 'User Name', 'Archived At', 'Rows']
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS") or 180)
+ARCHIVE_BATCH_SIZE = 500  # Users moved per run, to keep each request and cell write bounded
+
+
+def encode_rows(rows):
+    """Packs a user's sheet rows into one compact cell value (zlib-compressed JSON, base64)."""
+    return base64.b64encode(zlib.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'), 9)).decode('ascii')
+
+
+def decode_rows(value):
+    return json.loads(zlib.decompress(base64.b64decode(value)).decode('utf-8'))
+
+
+class Archive:
+    """Cold store for users who stopped using the bot.
+
+    All sheet rows of an archived user are packed into a single row of the
+    'Archive' worksheet and removed from the main sheet with one batched delete,
+    so full-sheet reads only pay for active users. The ids of archived users are
+    kept in memory, so checking whether a returning user needs a restore costs no
+    request; the restore itself reads the archive.
+    """
+    def __init__(self, google_sheets):
+        self.google_sheets = google_sheets
+        self.worksheet = google_sheets.get_or_create_worksheet('Archive', ARCHIVE_HEADERS)
+        self.lock = threading.Lock()
+        self.user_ids = set()
+
+    def load(self):
+        """Loads the ids of archived users (only the first column is read)."""
+        user_ids = {str(value).strip() for value in self.worksheet.col_values(1)[1:] if str(value).strip()}
+        with self.lock:
+            self.user_ids = user_ids
+        logger.info(f"{len(user_ids)} users in the archive")
+
+    def is_archived(self, user_id):
+        return str(user_id).strip() in self.user_ids
+
+    def mark(self, user_ids, archived=True):
+        """Updates the in-memory ids after an archive or restore done elsewhere, e.g. by another worker."""
+        with self.lock:
+            if archived:
+                self.user_ids.update(str(user_id).strip() for user_id in user_ids)
+            else:
+                self.user_ids.difference_update(str(user_id).strip() for user_id in user_ids)
+
+    def archive_users(self, user_ids):
+        """Moves every row of the given users to the archive; returns {user id: rows moved}.
+
+        The archive rows are written before the main sheet rows are deleted, so a
+        failure in between leaves a duplicate rather than losing data. A user who
+        already has an archive row, e.g. from such a failure, gets the rows merged
+        into it instead of a second one.
+        """
+        user_ids = {str(user_id).strip() for user_id in user_ids}
+        # Lookup, archive ids, archive write and delete; merging into an existing archive row reads it too
+        with self.google_sheets.rows_for_write(user_ids=user_ids, requests=4) as positions:
+            moved = OrderedDict()
+            for row in positions.values():
+                moved.setdefault(str(row['User ID']).strip(), []).append(row)
+            if not moved:
+                return {}
+
+            existing = {}
+            for row_index, value in enumerate(self.worksheet.col_values(1)[1:], start=2):
+                if str(value).strip() in moved:
+                    existing.setdefault(str(value).strip(), row_index)
+            for user_id, row_index in existing.items():
+                # Keep archived courses that are no longer in the main sheet; the main sheet wins for the rest
+                record = dict(zip(ARCHIVE_HEADERS, self.worksheet.row_values(row_index)))
+                rows = OrderedDict((row_key(row), row) for row in decode_rows(record['Rows']))
+                rows.update((row_key(row), row) for row in moved[user_id])
+                moved[user_id] = list(rows.values())
+
+            archived_at = datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S')
+            records = {
+                user_id: [user_id, str(rows[0].get('User Name', '')), archived_at, encode_rows(rows)]
+                for user_id, rows in moved.items()
+            }
+            if existing:
+                self.worksheet.batch_update([
+                    {'range': f"A{row_index}:D{row_index}", 'values': [records[user_id]]}
+                    for user_id, row_index in existing.items()
+                ])
+            new_records = [record for user_id, record in records.items() if user_id not in existing]
+            if new_records:
+                self.worksheet.append_rows(new_records)
+            self.google_sheets.delete_rows(positions)
+        self.mark(moved)
+        logger.info(f"Archived {len(moved)} users ({len(positions)} rows, {len(existing)} already in the archive)")
+        return moved
+
+    def restore(self, user_id):
+        """Moves an archived user's rows back to the main sheet; returns the rows added, or [] if not archived.
+
+        Rows whose (User ID, Course Code) is already in the main sheet are not
+        added again, and every archive row of the user is deleted, so a restore
+        that failed halfway can simply be repeated.
+        """
+        user_id = str(user_id).strip()
+        # Lookup, archive id column, archive row, append and archive delete
+        with self.google_sheets.rows_for_write(user_ids=[user_id], requests=5) as data:
+            archive_ids = [str(value).strip() for value in self.worksheet.col_values(1)]
+            row_indexes = [i + 1 for i, value in enumerate(archive_ids) if i > 0 and value == user_id]
+            if not row_indexes:
+                self.mark([user_id], archived=False)
+                return []
+            # Later archive rows are newer and win for the same course
+            rows = OrderedDict()
+            for row_index in row_indexes:
+                record = dict(zip(ARCHIVE_HEADERS, self.worksheet.row_values(row_index)))
+                for row in decode_rows(record['Rows']):
+                    rows[row_key(row)] = row
+
+            present = {row_key(row) for row in data.values()}
+            headers = self.google_sheets.headers
+            added = [row for key, row in rows.items() if key not in present]
+            if added:
+                self.google_sheets.add_rows([[row.get(name, '') for name in headers] for row in added])
+            self.google_sheets.spreadsheet.batch_update({'requests': [
+                {'deleteDimension': {'range': {
+                    'sheetId': self.worksheet.id, 'dimension': 'ROWS', 'startIndex': row_index - 1, 'endIndex': row_index,
+                }}}
+                for row_index in sorted(row_indexes, reverse=True)
+            ]})
+        self.mark([user_id], archived=False)
+        logger.info(f"Restored user {user_id} from the archive ({len(added)} of {len(rows)} rows added)")
+        return added
@@ -0,0 +1,243 @@
+from datetime import datetime, date
+from functools import lru_cache
+import pytz
+
+IST_TIMEZONE = pytz.timezone('Asia/Kolkata')
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+try:
+    popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def popcount(value):
+        return bin(value).count('1')
+
+
+def today_ist():
+    """Returns today's date in IST."""
+    return datetime.now(IST_TIMEZONE).date()
+
+
+def semester_for(day):
+    """Returns the (key, start date) of the semester containing the given day.
+
+    January-June is the first semester of a year and July-December the second.
+    """
+    if day.month <= 6:
+        return f"{day.year}H1", date(day.year, 1, 1)
+    return f"{day.year}H2", date(day.year, 7, 1)
+
+
+@lru_cache(maxsize=8)
+def weekday_mask(first_weekday, weekday, length=184):
+    """Bitmask of the day indexes falling on `weekday` for a semester starting on `first_weekday`."""
+    offset = (weekday - first_weekday) % 7
+    reps = (length - offset + 6) // 7
+    # (2^(7n) - 1) / (2^7 - 1) sets every 7th bit starting at bit 0
+    return (((1 << (7 * reps)) - 1) // 127) << offset
+
+
+class SemesterHistory:
+    """Per-day attendance of one course in one semester, one bit per class day.
+
+    Bit i stands for the i-th day of the semester. `present` and `absent` hold the
+    marks for each day and `held` is the mask of days on which a class took place.
+    """
+    def __init__(self, key, start, present=0, absent=0):
+        self.key = key
+        self.start = start
+        self.present = present
+        self.absent = absent
+
+    @property
+    def held(self):
+        return self.present | self.absent
+
+    def day_index(self, day):
+        return (day - self.start).days
+
+    def mark(self, day, present_today):
+        """Records a present or absent mark for the given day."""
+        bit = 1 << self.day_index(day)
+        if present_today == 1:
+            self.present |= bit
+        else:
+            self.absent |= bit
+
+    def set_day(self, day, present, absent):
+        """Sets whether the given day has any present and any absent mark."""
+        bit = 1 << self.day_index(day)
+        self.present = self.present | bit if present else self.present & ~bit
+        self.absent = self.absent | bit if absent else self.absent & ~bit
+
+    def window_mask(self, days, today):
+        """Mask covering the last `days` days up to and including `today`."""
+        end = self.day_index(today) + 1
+        begin = max(0, end - days)
+        if end <= 0:
+            return 0
+        return ((1 << (end - begin)) - 1) << begin
+
+    def last_n_days(self, days, today=None):
+        """Returns (classes attended, classes held) over the last `days` days."""
+        mask = self.window_mask(days, today or today_ist())
+        return popcount(self.present & ~self.absent & mask), popcount(self.held & mask)
+
+    def day_counts(self, days, today=None):
+        """Returns (days with a present mark, days with an absent mark, days with a class) over the last `days` days."""
+        mask = self.window_mask(days, today or today_ist())
+        return popcount(self.present & mask), popcount(self.absent & mask), popcount(self.held & mask)
+
+    def longest_streak(self):
+        """Longest run of attended class days; days without a class don't break a run."""
+        attended = self.present & ~self.absent
+        span = (1 << self.held.bit_length()) - 1
+        runs = attended | (span & ~self.held)
+        best = 0
+        while runs:
+            low = runs & -runs
+            run = runs & ~(runs + low)  # lowest block of consecutive set bits
+            best = max(best, popcount(run & attended))
+            runs &= ~run
+        return best
+
+    def weekday_absences(self):
+        """Returns the number of absences for each weekday, Monday first."""
+        first_weekday = self.start.weekday()
+        return [popcount(self.absent & weekday_mask(first_weekday, weekday)) for weekday in range(7)]
+
+    def encode(self):
+        return f"{self.key}:{self.present:x}:{self.absent:x}"
+
+    @classmethod
+    def decode(cls, text):
+        key, present, absent = text.split(':')
+        year, half = key.split('H')
+        start = date(int(year), 1 if half == '1' else 7, 1)
+        return cls(key, start, int(present or '0', 16), int(absent or '0', 16))
+
+
+class AttendanceHistory:
+    """All semesters of per-day history for one course, stored in the 'History' cell.
+
+    The cell holds `;`-separated semesters of the form `2025H2:<present hex>:<absent hex>`.
+    """
+    def __init__(self, semesters=None):
+        self.semesters = semesters or {}
+
+    @classmethod
+    def from_cell(cls, value):
+        semesters = {}
+        for part in str(value or '').split(';'):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                semester = SemesterHistory.decode(part)
+                semesters[semester.key] = semester
+            except ValueError:
+                continue
+        return cls(semesters)
+
+    def to_cell(self):
+        return ';'.join(self.semesters[key].encode() for key in sorted(self.semesters))
+
+    def semester(self, day=None):
+        """Returns the semester history for the given day, creating it if needed."""
+        key, start = semester_for(day or today_ist())
+        if key not in self.semesters:
+            self.semesters[key] = SemesterHistory(key, start)
+        return self.semesters[key]
+
+    def mark(self, present_today, day=None):
+        day = day or today_ist()
+        self.semester(day).mark(day, present_today)
+
+    def set_day(self, day, present, absent):
+        self.semester(day).set_day(day, present, absent)
+
+    def trends(self, today=None):
+        """Summarises the current semester for display."""
+        today = today or today_ist()
+        semester = self.semester(today)
+        attended_7, held_7 = semester.last_n_days(7, today)
+        attended_30, held_30 = semester.last_n_days(30, today)
+        absences = semester.weekday_absences()
+        worst_day = max(range(7), key=lambda weekday: absences[weekday])
+        return {
+            'last_7': (attended_7, held_7),
+            'last_30': (attended_30, held_30),
+            'longest_streak': semester.longest_streak(),
+            'most_missed_day': WEEKDAY_NAMES[worst_day] if absences[worst_day] else None,
+            'most_missed_count': absences[worst_day],
+        }
+
+
+class DaySessions:
+    """The marks of one course on its latest class day, one per session, stored in the 'Sessions' cell.
+
+    History keeps one present and one absent bit per day, which can't tell the
+    sessions of a day apart. This keeps them in order as `YYYYMMDD:<streak at
+    the start of the day>:<marks>`, one character per session: 'P'/'A' when the
+    class representative marked it, 'p'/'a' when the member marked it
+    themselves and '-' when the representative held a session the member had
+    already marked. The cell is replaced on the course's next class day.
+    """
+    REP_MARKS = 'PA-'
+
+    def __init__(self, day, start_streak, marks=''):
+        self.day = day
+        self.start_streak = start_streak
+        self.marks = marks
+
+    @classmethod
+    def from_cell(cls, value, day, streak):
+        """The sessions of `day`, or an empty day starting at `streak` if the cell holds another day."""
+        try:
+            stamp, start_streak, marks = str(value or '').split(':')
+            if stamp == day.strftime('%Y%m%d'):
+                return cls(day, int(start_streak), marks)
+        except ValueError:
+            pass
+        return cls(day, streak)
+
+    def to_cell(self):
+        return f"{self.day:%Y%m%d}:{self.start_streak}:{self.marks}"
+
+    def add(self, mark):
+        """Appends a session mark and returns its index."""
+        self.marks += mark
+        return len(self.marks) - 1
+
+    def count(self):
+        return len(self.marks)
+
+    def marked_since_session(self):
+        """True if the member marked the course themselves since the representative's last session."""
+        last = max(self.marks.rfind(mark) for mark in self.REP_MARKS)
+        return any(mark in 'pa' for mark in self.marks[last + 1:])
+
+    def correct(self, index, present_today):
+        """Turns the representative's mark of session `index` into `present_today`; False if it isn't the opposite one."""
+        if index is None:
+            # Buttons sent before sessions were numbered: take the latest opposite mark
+            index = self.marks.rfind('A' if present_today == 1 else 'P')
+        if not 0 <= index < len(self.marks) or self.marks[index] != ('A' if present_today == 1 else 'P'):
+            return False
+        self.marks = self.marks[:index] + ('P' if present_today == 1 else 'A') + self.marks[index + 1:]
+        return True
+
+    def has_present(self):
+        return any(mark in 'Pp' for mark in self.marks)
+
+    def has_absent(self):
+        return any(mark in 'Aa' for mark in self.marks)
+
+    def streak(self):
+        """Classes attended in a row up to the last session, counted the way marking counts them."""
+        run = 0
+        for mark in reversed(self.marks):
+            if mark in 'Pp':
+                run += 1
+            elif mark in 'Aa':
+                return run
+        return self.start_streak + run
@@ -3,13 +3,37 @@ import json
 from datetime import datetime
 import pytz
 import math
+from attendance_history import AttendanceHistory, DaySessions, today_ist
+from metrics import metrics
+from thresholds import THRESHOLD_COLUMN, Verdicts
+
+logger = logging.getLogger(__name__)
+
+# Columns written when a class is marked, in sheet order
+MARK_COLUMNS = ['Present', 'Absent', 'Chat ID', 'Last Updated', 'Streak', 'Phone Number', 'History', 'Sessions']
 
 
 class AttendanceTracker:
     def __init__(self, google_sheets, attendance_threshold):
         self.google_sheets = google_sheets
         self.attendance_threshold = attendance_threshold
+        self.google_sheets.ensure_column('History')
+        self.google_sheets.ensure_column(THRESHOLD_COLUMN)
+        self.google_sheets.ensure_column('Sessions')
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """Registers a callable notified as listener(event, row) after every successful change."""
+        self.listeners.append(listener)
+
+    def notify_listeners(self, event, row):
+        for listener in self.listeners:
+            try:
+                listener(event, row)
+            except Exception as e:
+                logger.error("Error in attendance listener for %s: %s", event, e)
 
+    @metrics.timed('tracker.get_user_data')
     def get_user_data(self, user_id):
         """Retrieves user data from the Google Sheet."""
         try:
@@ -19,46 +43,50 @@ class AttendanceTracker:
                     return row
             return None  # User not found
         except Exception as e:
-            print(f"Error retrieving user data: {e}")
+            logger.error("Error retrieving user data: %s", e)
 
+    @metrics.timed('tracker.update_user_chat_id')
     def update_user_chat_id(self, user_id, chat_id):
         """Updates the chat ID for a specific user in the Google Sheet."""
         try:
-            data = self.google_sheets.get_all_data()
-            for i, row in enumerate(data):
-                if str(row['User ID']).strip() == str(user_id).strip():
-                    row_index = i + 2  # Add 2 to account for header row and 0-based indexing
-                    self.google_sheets.update_cell(row_index, 'Chat ID', chat_id)
-                    print(f"Chat ID updated for user {user_id} to {chat_id}")
+            with self.google_sheets.rows_for_write(user_ids=[user_id]) as rows:
+                for row_index, row in rows.items():
+                    self.google_sheets.update_cell(row_index, 'Chat ID', chat_id, row)
+                    logger.debug("Chat ID updated for user %s", user_id)
                     return
-            print(f"User {user_id} not found.")
+            logger.warning("User %s not found.", user_id)
         except Exception as e:
-            print(f"Error updating chat ID: {e}")
+            logger.error("Error updating chat ID: %s", e)
 
+    @metrics.timed('tracker.update_user_phone')
     def update_user_phone(self, user_id, phone_number):
         """Updates a user's phone number in the Google Sheet."""
         try:
-            data = self.google_sheets.get_all_data()
-            for i, row in enumerate(data):
-                if str(row['User ID']).strip() == str(user_id).strip():
-                    row_index = i + 2  # Add 2 to account for header row and 0-based indexing
-                    self.google_sheets.update_cell(row_index, 'Phone Number', phone_number)
-                    print(f"Phone number updated for user {user_id}: {phone_number}")
+            with self.google_sheets.rows_for_write(user_ids=[user_id]) as rows:
+                for row_index, row in rows.items():
+                    self.google_sheets.update_cell(row_index, 'Phone Number', phone_number, row)
+                    logger.debug("Phone number updated for user %s", user_id)
                     return True
             return False
         except Exception as e:
-            print(f"Error updating phone number: {e}")
+            logger.error("Error updating phone number: %s", e)
             return False
 
+    @metrics.timed('tracker.add_new_user')
     def add_new_user(self, user_id, user_name, phone_number):
         """Adds a new user to the Google Sheet."""
         try:
             # Add a new row with phone number (add an extra empty field for Streak)
-            self.google_sheets.add_row([user_id, user_name, '', '', '', '', user_id, datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S') , '', phone_number])
-            print(f"New user added: {user_id, user_name, phone_number}")
+            timestamp = datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S')
+            self.google_sheets.add_row([user_id, user_name, '', '', '', '', user_id, timestamp, '', phone_number])
+            logger.info("New user added: %s", user_id)
+            self.notify_listeners('register', {
+                'User ID': user_id, 'User Name': user_name, 'Chat ID': user_id, 'Last Updated': timestamp,
+            })
         except Exception as e:
-            print(f"Error adding new user: {e}")
+            logger.error("Error adding new user: %s", e)
 
+    @metrics.timed('tracker.get_user_courses')
     def get_user_courses(self, user_id):
         """Retrieves all courses for a specific user from the Google Sheet."""
         try:
@@ -74,138 +102,290 @@ class AttendanceTracker:
                     
             return user_courses
         except Exception as e:
-            print(f"Error retrieving user courses: {e}")
+            logger.error("Error retrieving user courses: %s", e)
             return []
 
+    @metrics.timed('tracker.add_new_course')
     def add_new_course(self, user_id, user_name, course_code, course_nickname, present, absent, phone_number,streak=0):
         """Adds a new course for a user to the Google Sheet."""
         try:
             now = datetime.now(pytz.timezone('Asia/Kolkata'))
             timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
             self.google_sheets.add_row([user_id, user_name, course_code, course_nickname, present, absent, user_id, timestamp, streak, phone_number])
-            print(f"New course added for user {user_id}: Course Code={course_code}, Nickname={course_nickname}")
+            logger.info("New course added for user %s: Course Code=%s, Nickname=%s", user_id, course_code, course_nickname)
+            self.notify_listeners('add', {
+                'User ID': user_id, 'User Name': user_name, 'Course Code': course_code,
+                'Course Nickname': course_nickname, 'Present': present, 'Absent': absent,
+                'Chat ID': user_id, 'Last Updated': timestamp, 'Streak': streak,
+            })
             return True
         except Exception as e:
-            print(f"Error adding new course: {e}")
+            logger.error("Error adding new course: %s", e)
 
+    @metrics.timed('tracker.delete_course')
     def delete_course(self, user_id, course_code):
         """Deletes a course for a user from the Google Sheet."""
         try:
-            data = self.google_sheets.get_all_data()
-            for i, row in enumerate(data):
-                if str(row['User ID']).strip() == str(user_id).strip() and str(row['Course Code']).strip() == str(course_code).strip():
-                    row_index = i + 2  # Add 2 to account for header row and 0-based indexing
-                    self.google_sheets.delete_row(row_index)
-                    print(f"Course deleted for user {user_id}: Course Code={course_code}")
+            with self.google_sheets.rows_for_write(user_ids=[user_id], course_code=course_code) as rows:
+                for row_index, row in rows.items():
+                    self.google_sheets.delete_row(row_index, row)
+                    logger.info("Course deleted for user %s: Course Code=%s", user_id, course_code)
+                    self.notify_listeners('delete', row)
                     return
-            print(f"Course not found for user {user_id}: Course Code={course_code}")
+            logger.warning("Course not found for user %s: Course Code=%s", user_id, course_code)
         except Exception as e:
-            print(f"Error deleting course: {e}")
+            logger.error("Error deleting course: %s", e)
+
+    def apply_mark(self, data, row, present_today, timestamp, by_rep=False):
+        """Returns a copy of a course row with one more present or absent mark applied.
+
+        Blank phone numbers and chat IDs are filled in from the user's rows in
+        `data`. `by_rep` marks a session recorded by a shared course's
+        representative rather than by the member.
+        """
+        present = int(row.get('Present', 0) or 0)
+        absent = int(row.get('Absent', 0) or 0)
+        streak_val = row.get('Streak', '0')
+        streak = 0 if streak_val == '' or streak_val is None else int(streak_val)
+        history = AttendanceHistory.from_cell(row.get('History', ''))
+        history.mark(present_today)
+        sessions = DaySessions.from_cell(row.get('Sessions', ''), today_ist(), streak)
+        mark = 'P' if present_today == 1 else 'A'
+        sessions.add(mark if by_rep else mark.lower())
+
+        # Update Present or Absent count
+        if present_today == 1:
+            present += 1
+            streak += 1  # Increment streak for attendance
+        else:
+            absent += 1
+            streak = 0   # Reset streak for absence
+
+        # Fill in phone number and chat ID from the user's other rows if they are blank
+        phone_number = row.get('Phone Number', '')
+        chat_id = row.get('Chat ID', '')
+        if not phone_number or not chat_id:
+            user_id = str(row['User ID']).strip()
+            for other in data:
+                if str(other['User ID']).strip() == user_id:
+                    phone_number = phone_number or other.get('Phone Number', '')
+                    chat_id = chat_id or other.get('Chat ID', '')
+
+        return dict(row, **{
+            'Present': present, 'Absent': absent, 'Last Updated': timestamp, 'Streak': streak,
+            'Phone Number': phone_number, 'Chat ID': chat_id, 'History': history.to_cell(),
+            'Sessions': sessions.to_cell(),
+        })
 
+    def mark_columns(self):
+        """Columns written when attendance is marked."""
+        return [column for column in MARK_COLUMNS if column in self.google_sheets.headers]
+
+    @metrics.timed('tracker.update_attendance')
     def update_attendance(self, user_id, user_name, course_code, course_nickname, present_today):
         """Update attendance for a user."""
         try:
-            data = self.google_sheets.get_all_data()
-            timestamp = datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S')
-            
-            for i, row in enumerate(data):
-                if str(row['User ID']).strip() == str(user_id).strip() and str(row['Course Code']).strip() == str(course_code).strip():
-                    row_index = i+2
-                    present = int(row.get('Present', 0))
-                    absent = int(row.get('Absent', 0))
-                    streak_val = row.get('Streak', '0')
-                    streak = 0 if streak_val == '' or streak_val is None else int(streak_val)
-                    
-                    # Update Present or Absent count
+            with self.google_sheets.rows_for_write(user_ids=[user_id]) as rows:
+                timestamp = datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S')
+
+                for row_index, row in rows.items():
+                    if str(row['Course Code']).strip() == str(course_code).strip():
+                        updated = self.apply_mark(rows.values(), row, present_today, timestamp)
+                        self.google_sheets.update_row(row_index, updated, self.mark_columns())
+
+                        logger.debug("Attendance updated for user %s and %s: Present=%s, Absent=%s", user_id, course_nickname, updated['Present'], updated['Absent'])
+                        self.notify_listeners('mark', dict(updated, present_today=present_today))
+                        return True
+
+                logger.warning("No matching course found for user %s and course %s", user_id, course_code)
+                return False
+        except Exception as e:
+            logger.error("Error updating attendance: %s", e)
+            return False  # Return False instead of raising
+
+    @metrics.timed('tracker.update_attendance_bulk')
+    def update_attendance_bulk(self, user_id, marks):
+        """Marks several courses at once with one read and one batched write.
+
+        `marks` maps course code -> 1 (present) or 0 (absent). Returns a dict of
+        course code -> (row before, row after) for the courses that were updated.
+        """
+        try:
+            with self.google_sheets.rows_for_write(user_ids=[user_id]) as rows:
+                timestamp = datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S')
+
+                updated_rows = {}
+                results = {}
+                for row_index, row in rows.items():
+                    course_code = str(row['Course Code']).strip()
+                    if course_code in marks:
+                        updated = self.apply_mark(rows.values(), row, marks[course_code], timestamp)
+                        updated_rows[row_index] = updated
+                        results[course_code] = (row, updated)
+
+                if updated_rows:
+                    self.google_sheets.update_rows(updated_rows, self.mark_columns())
+                    logger.debug("Attendance updated for user %s in %d courses", user_id, len(updated_rows))
+                    for course_code, (row, updated) in results.items():
+                        self.notify_listeners('mark', dict(updated, present_today=marks[course_code]))
+                return results
+        except Exception as e:
+            logger.error("Error updating attendance in bulk: %s", e)
+            return {}
+
+    @metrics.timed('tracker.mark_course_members')
+    def mark_course_members(self, course_code, present_today):
+        """Marks every member row of a shared course with one read and one batched write.
+
+        Members who marked the course themselves since the representative's
+        previous session today are left as they are, and the session is noted
+        in their 'Sessions' cell so their mark only counts for this one. Returns
+        (updated rows, skipped rows).
+        """
+        try:
+            with self.google_sheets.rows_for_write(course_code=course_code) as rows:
+                timestamp = datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S')
+                today = today_ist()
+                course_code = str(course_code).strip()
+                # Members' other courses aren't read under the lock; the cache has their contact details
+                contacts = list(rows.values()) + (self.google_sheets.cache.snapshot() or [])
+
+                updated_rows = {}
+                skipped_rows = {}
+                for row_index, row in rows.items():
+                    sessions = DaySessions.from_cell(row.get('Sessions', ''), today, 0)
+                    if sessions.marked_since_session():
+                        sessions.add('-')
+                        skipped_rows[row_index] = dict(row, Sessions=sessions.to_cell())
+                        continue
+                    updated_rows[row_index] = self.apply_mark(contacts, row, present_today, timestamp, by_rep=True)
+
+                if updated_rows or skipped_rows:
+                    self.google_sheets.update_rows({**updated_rows, **skipped_rows}, self.mark_columns())
+                    logger.info("Shared course %s marked for %d members, %d skipped", course_code, len(updated_rows), len(skipped_rows))
+                    for updated in updated_rows.values():
+                        self.notify_listeners('mark', dict(updated, present_today=present_today))
+                return list(updated_rows.values()), list(skipped_rows.values())
+        except Exception as e:
+            logger.error("Error marking shared course %s: %s", course_code, e)
+            return [], []
+
+    @metrics.timed('tracker.override_mark')
+    def override_mark(self, user_id, course_code, day, present_today, session=None):
+        """Changes the representative's mark of one session on `day` to `present_today`.
+
+        `session` is the index of the session in the member's 'Sessions' cell;
+        None picks the latest opposite mark. Only the course's latest class day
+        can be changed. Returns the updated row, or None if that session has no
+        opposite mark.
+        """
+        try:
+            with self.google_sheets.rows_for_write(user_ids=[user_id], course_code=course_code) as rows:
+                timestamp = datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S')
+                for row_index, row in rows.items():
+                    sessions = DaySessions.from_cell(row.get('Sessions', ''), day, 0)
+                    if not sessions.correct(session, present_today):
+                        return None
+                    history = AttendanceHistory.from_cell(row.get('History', ''))
+                    history.set_day(day, sessions.has_present(), sessions.has_absent())
+                    present = int(row.get('Present', 0) or 0)
+                    absent = int(row.get('Absent', 0) or 0)
                     if present_today == 1:
-                        present += 1
-                        streak += 1  # Increment streak for attendance
+                        present, absent = present + 1, max(0, absent - 1)
                     else:
-                        absent += 1
-                        streak = 0   # Reset streak for absence
-                    
-                    # Check and update phone number and chat ID if they are blank
-                    phone_number = row.get('Phone Number', '')
-                    chat_id = row.get('Chat ID', '')
-                    if not phone_number or not chat_id:
-                        user_data = self.get_user_data(user_id)
-                        phone_number = user_data.get('Phone Number', phone_number)
-                        chat_id = user_data.get('Chat ID', chat_id)
-                    
-                    # Update the values in the Google Sheet
-                    self.google_sheets.update_cell(row_index, 'Present', present)
-                    self.google_sheets.update_cell(row_index, 'Absent', absent)
-                    self.google_sheets.update_cell(row_index, 'Last Updated', timestamp)
-                    self.google_sheets.update_cell(row_index, 'Streak', streak)
-                    self.google_sheets.update_cell(row_index, 'Phone Number', phone_number)
-                    self.google_sheets.update_cell(row_index, 'Chat ID', chat_id)
-                    
-                    print(f"Attendance updated for user {user_id} and {course_nickname}: Present={present}, Absent={absent}")
-                    return True
-            
-            print(f"No matching course found for user {user_id} and course {course_code}")
-            return False
+                        present, absent = max(0, present - 1), absent + 1
+                    # The day is the course's latest, so its sessions give the streak in classes
+                    updated = dict(row, **{
+                        'Present': present, 'Absent': absent, 'Last Updated': timestamp,
+                        'Streak': sessions.streak(), 'History': history.to_cell(), 'Sessions': sessions.to_cell(),
+                    })
+                    self.google_sheets.update_row(row_index, updated, self.mark_columns())
+                    logger.debug("Session %s of user %s for %s on %s changed to %s", session, user_id, course_code, day, present_today)
+                    self.notify_listeners('edit', updated)
+                    return updated
+                return None
         except Exception as e:
-            print(f"Error updating attendance: {e}")
-            return False  # Return False instead of raising
+            logger.error("Error overriding mark: %s", e)
+            return None
+
+    @metrics.timed('tracker.set_threshold')
+    def set_threshold(self, course_code, threshold, user_id=None):
+        """Sets the threshold of a course, or clears it with '' to use the global one.
+
+        Without `user_id` every row of the course is updated, as for the members of
+        a shared course, in one batched write. Returns the number of rows updated.
+        """
+        try:
+            user_ids = None if user_id is None else [user_id]
+            with self.google_sheets.rows_for_write(user_ids=user_ids, course_code=course_code) as rows:
+                course_code = str(course_code).strip()
+                updated_rows = {
+                    row_index: dict(row, **{THRESHOLD_COLUMN: threshold}) for row_index, row in rows.items()
+                }
 
+                if updated_rows:
+                    self.google_sheets.update_rows(updated_rows, [THRESHOLD_COLUMN])
+                    logger.info("Threshold of %s set to %s in %d rows", course_code, threshold or 'default', len(updated_rows))
+                    for updated in updated_rows.values():
+                        self.notify_listeners('edit', updated)
+                return len(updated_rows)
+        except Exception as e:
+            logger.error("Error setting threshold: %s", e)
+            return 0
+
+    @metrics.timed('tracker.update_attendance_manual')
     def update_attendance_manual(self, user_id, course_code, present, absent):
         """Updates the attendance for a specific course in the Google Sheet manually."""
         try:
-            data = self.google_sheets.get_all_data()
-            now = datetime.now(pytz.timezone('Asia/Kolkata'))
-            timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
-            for i, row in enumerate(data):
-                row_user_id = str(row['User ID']).strip()
-                user_id_str = str(user_id).strip()
-
-                if row_user_id == user_id_str and str(row['Course Code']).strip() == str(course_code).strip():
-                    row_index = i + 2
-
-                    phone_number = row.get('Phone Number', '')
-                    chat_id = row.get('Chat ID', '')
-                    if not phone_number or not chat_id:
-                        user_data = self.get_user_data(user_id)
-                        phone_number = user_data.get('Phone Number', phone_number)
-                        chat_id = user_data.get('Chat ID', chat_id)
-
-                    self.google_sheets.update_cell(row_index, 'Present', present)
-                    self.google_sheets.update_cell(row_index, 'Absent', absent)
-                    self.google_sheets.update_cell(row_index, 'Last Updated', timestamp)
-                    self.google_sheets.update_cell(row_index, 'Phone Number', phone_number)
-                    self.google_sheets.update_cell(row_index, 'Chat ID', chat_id)
-                    print(f"Attendance updated manually for user {user_id}, course {course_code}, present={present}, absent={absent}")
-                    return True
+            with self.google_sheets.rows_for_write(user_ids=[user_id]) as rows:
+                now = datetime.now(pytz.timezone('Asia/Kolkata'))
+                timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
+                for row_index, row in rows.items():
+                    if str(row['Course Code']).strip() == str(course_code).strip():
+                        phone_number = row.get('Phone Number', '')
+                        chat_id = row.get('Chat ID', '')
+                        if not phone_number or not chat_id:
+                            user_data = next(iter(rows.values()))
+                            phone_number = user_data.get('Phone Number', phone_number)
+                            chat_id = user_data.get('Chat ID', chat_id)
 
-            print(f"No matching course found for user {user_id} and course {course_code}")
-            return False
+                        updated = dict(row, **{
+                            'Present': present, 'Absent': absent, 'Chat ID': chat_id, 'Last Updated': timestamp,
+                            'Phone Number': phone_number,
+                        })
+                        self.google_sheets.update_row(row_index, updated, ['Present', 'Absent', 'Last Updated', 'Phone Number', 'Chat ID'])
+                        logger.debug("Attendance updated manually for user %s, course %s, present=%s, absent=%s", user_id, course_code, present, absent)
+                        self.notify_listeners('edit', updated)
+                        return True
+
+                logger.warning("No matching course found for user %s and course %s", user_id, course_code)
+                return False
         except Exception as e:
-            print(f"Error updating attendance manually: {e}")
+            logger.error("Error updating attendance manually: %s", e)
 
+    def get_course_trends(self, course):
+        """Computes recent attendance trends from a course row's per-day history."""
+        return AttendanceHistory.from_cell(course.get('History', '')).trends()
+
+    @metrics.timed('tracker.calculate_safe_skip')
     def calculate_safe_skip(self, user_id):
         """Calculates which course can be skipped safely."""
         try:
             user_courses = self.get_user_courses(user_id)
+            verdicts = Verdicts(user_courses, self.attendance_threshold)
             safe_courses = []
 
-            for course in user_courses:
-                present = int(course['Present'])
-                absent = int(course['Absent'])
-                total_classes = present + absent
-
-                if total_classes > 0:
-                    attendance_percentage = (present / total_classes) * 100
-                else:
-                    attendance_percentage = 100.0
-
-                # Check if skipping this course would bring attendance below the threshold
-                if (present) / (total_classes+1) * 100 >= self.attendance_threshold:
+            for i, course in enumerate(user_courses):
+                # Skipping is safe if at least one more class can be missed without falling below the course's threshold
+                if verdicts.left[i] >= 1:
                     safe_courses.append({
                         'Course Nickname': course['Course Nickname'],
-                        'Attendance': attendance_percentage
+                        'Course Code': course['Course Code'],
+                        'Attendance': verdicts.percentage[i],
+                        'Threshold': verdicts.threshold[i],
                     })
 
             return safe_courses
         except Exception as e:
-            print(f"Error calculating safe skip: {e}")
+            logger.error("Error calculating safe skip: %s", e)
             return []
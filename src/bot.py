@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 import os
 import sys
+import functools
+import html
+import threading
 
 # SURVIVAL MODE FOR BUILD PHASE
 # Check if this is running in a build environment
@@ -15,17 +18,35 @@ if len(sys.argv) > 1 and sys.argv[1] == "--validate-install":
     
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, ReplyKeyboardRemove, KeyboardButton, ReplyKeyboardMarkup
-from telegram.ext import Updater, CommandHandler, CallbackContext, CallbackQueryHandler, ConversationHandler, MessageHandler, Filters
-from google_sheets import GoogleSheets
+from telegram.ext import CommandHandler, CallbackContext, CallbackQueryHandler, ConversationHandler, MessageHandler, Filters, DispatcherHandlerStop, TypeHandler
+from google_sheets import GoogleSheets, QuotaBucket, SHEETS_QUOTA_PER_MINUTE
 from attendance_tracker import AttendanceTracker
+from attendance_history import DaySessions
+from archive import Archive, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
 import json
-from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
 import pytz
-import math
 import telegram
 from collections import defaultdict, Counter
-from logger_config import setup_logging, send_logs_to_admin, schedule_daily_logs
+from logger_config import LOG_FILE, setup_logging, send_logs_to_admin, set_log_level, get_log_levels, RUNTIME_LOGGERS
+from reports import ReportGenerator
+from metrics import metrics, instrument_handlers, format_stats, render_prometheus
+from health import attach_health_endpoints
+from tracing import tracer, create_updater, format_waterfall
+from profiling import profiler
+from bunk_planner import BunkPlanner
+from dedup import CallbackDeduplicator
+from leaderboard import Leaderboard, MIN_CLASSES_FOR_ATTENDANCE
+from delivery import DeliveryTracker, SENT, SKIPPED
+from notifier import AdminNotifier
+from outbox import Outbox
+from snapshot import SnapshotKeeper
+from shared_courses import SharedCourseStore
+from segments import AudienceIndex
+from scheduler import AppScheduler, JobSpec, exclusive_lock
+from workers import Front, create_bus, report_status, serve_inbox
+from thresholds import Verdicts, format_threshold, parse_threshold
+from timetable import TimetableStore, ReminderWheel, DAYS, parse_day, parse_time
 
 
 def load_config():
@@ -60,7 +81,7 @@ def load_config():
                 "telegram_bot_token": telegram_token,
                 "google_sheets_credentials": google_creds,
                 "spreadsheet_id": spreadsheet,
-                "attendance_threshold": float(threshold or "75.0"),
+                "attendance_threshold": parse_threshold(threshold or "75.0"),
                 "admin_telegram_id": admin_id or ""
             }
         else:
@@ -78,26 +99,37 @@ def load_config():
         print(f"Error loading config: {e}")
         raise
 
-# Load configuration
-config = load_config()
-
-# Initialize the updater after we have the config
-updater = Updater(config['telegram_bot_token'])
-
-logger, telegram_handler = setup_logging()
-
-# Initialize Google Sheets and Attendance Tracker
-google_sheets = GoogleSheets(config['google_sheets_credentials'], config['spreadsheet_id'], config)
-attendance_tracker = AttendanceTracker(google_sheets, config['attendance_threshold'])
+# Application components, built by create_app() so that importing this module has no side effects
+config = None
+updater = None
+google_sheets = None
+attendance_tracker = None
+report_generator = None
+bunk_planner = None
+outbox = None
+admin_notifier = None
+timetable_store = None
+shared_courses = None
+leaderboard = None
+audience = None
+archive = None
+reminder_wheel = None
+snapshot_keeper = None
+app_scheduler = None
+event_bus = None  # Set in multi-worker mode to share state changes between worker processes
+
+logger = logging.getLogger()
 
 # Define states for conversation handlers
-SELECT_COURSE, MARK_ATTENDANCE, ADD_COURSE_NAME, GET_CHAT_ID, DELETE_COURSE_CONFIRM, EDIT_ATTENDANCE_DISPLAY,FEEDBACK_TEXT, PHONE_VERIFICATION, ANNOUNCEMENT_TEXT = range(9)
+SELECT_COURSE, MARK_ATTENDANCE, ADD_COURSE_NAME, GET_CHAT_ID, DELETE_COURSE_CONFIRM, EDIT_ATTENDANCE_DISPLAY,FEEDBACK_TEXT, PHONE_VERIFICATION, ANNOUNCEMENT_TEXT, MARK_ALL = range(10)
 
 # Update these variables under your other constants
 RATE_LIMIT_COMMANDS = 15  # Auto-block after this many commands per minute
 RATE_LIMIT_PERIOD = 60  # Seconds
 command_history = defaultdict(list)  # Track user command history
 blocked_users = set()  # Store blocked user IDs
+callback_dedup = CallbackDeduplicator()  # Recently handled attendance buttons
+delivery_tracker = DeliveryTracker()  # Chats that stopped accepting bulk messages
 
 class User:
     def __init__(self, user_id, user_name, chat_id, phone_number):
@@ -137,6 +169,19 @@ def get_or_create_user(user_id, user_name, chat_id, phone_number):
     return user
 
 
+def publish(event) -> None:
+    """Shares a state change with the other worker processes; does nothing in single-process mode."""
+    if event_bus is not None:
+        event_bus.publish(event)
+
+def block(user_id) -> None:
+    blocked_users.add(user_id)
+    publish({'type': 'block', 'user_id': user_id})
+
+def unblock(user_id) -> None:
+    blocked_users.discard(user_id)
+    publish({'type': 'unblock', 'user_id': user_id})
+
 # Update the check rate limit function to auto-block users
 def check_rate_limit(update: Update) -> bool:
     """Check if a user has exceeded rate limits."""
@@ -159,30 +204,21 @@ def check_rate_limit(update: Update) -> bool:
     # Check if rate limited and auto-block at 33 commands per minute
     if len(command_history[user_id]) > RATE_LIMIT_COMMANDS:
         # Auto-block the user
-        blocked_users.add(user_id)
+        block(user_id)
         
         update.message.reply_text(
             "⚠️ You have been automatically blocked due to sending too many commands in a short period. " +
             "To appeal this block, please use the /feedback command to contact our admin."
         )
         
-        # Notify admin about the auto-block
-        if 'admin_telegram_id' in config:
-            user = update.effective_user
-            user_mention = f'<a href="tg://user?id={user.id}">{user.first_name}</a>'
-            
-            admin_message = f"🚫 <b>User Auto-Blocked:</b>\n\n" \
-                           f"👤 User: {user_mention} (ID: {user.id})\n" \
-                           f"📊 Commands in last minute: {len(command_history[user_id])}\n" \
-                           f"⏰ Time: {current_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n" \
-                           f"This user was automatically blocked for sending too many commands.\n" \
-                           f"Use <code>/unblock {user.id}</code> to unblock this user if needed."
-                           
-            updater.bot.send_message(
-                chat_id=config['admin_telegram_id'],
-                text=admin_message,
-                parse_mode=ParseMode.HTML
-            )
+        # Auto-blocks go into the admin digest; the user can appeal through /feedback
+        user = update.effective_user
+        user_mention = f'<a href="tg://user?id={user.id}">{html.escape(user.first_name)}</a>'
+        admin_notifier.notify(
+            'auto_block',
+            f"{user_mention} (ID: {user.id}) · {len(command_history[user_id])} commands/min · "
+            f"{current_time.strftime('%H:%M:%S')} · <code>/unblock {user.id}</code>"
+        )
         
         return True
     
@@ -192,6 +228,7 @@ def check_rate_limit(update: Update) -> bool:
 # Update the rate_limit_decorator to also check phone verification
 def rate_limit_decorator(func):
     """Decorator to apply rate limiting, block checking, and phone verification to command handlers."""
+    @functools.wraps(func)
     def wrapper(update: Update, context: CallbackContext, *args, **kwargs):
         user_id = update.effective_user.id
         
@@ -202,8 +239,10 @@ def rate_limit_decorator(func):
             )
             return
         
-        # Next check if user has verified their phone
+        # Next check if user has verified their phone, bringing back archived users first
         user_data = attendance_tracker.get_user_data(user_id)
+        if user_data is None and restore_archived_user(user_id):
+            user_data = attendance_tracker.get_user_data(user_id)
         has_phone = user_data and 'Phone Number' in user_data and user_data['Phone Number']
         
         # Get command name for allowing exceptions
@@ -226,12 +265,55 @@ def rate_limit_decorator(func):
         return func(update, context, *args, **kwargs)
     return wrapper
 
+def dedup_callback(func):
+    """Decorator for attendance buttons: repeated taps and redelivered queries are answered without running again.
+
+    A callback is a duplicate if its query id was seen before, or if the same user
+    pressed the same button (course and action) on the same message within the TTL.
+    """
+    @functools.wraps(func)
+    def wrapper(update: Update, context: CallbackContext, *args, **kwargs):
+        query = update.callback_query
+        message_id = query.message.message_id if query.message else query.inline_message_id
+        if not callback_dedup.first(('id', query.id), ('tap', query.from_user.id, query.data, message_id)):
+            metrics.incr('duplicate_callbacks')
+            query.answer("Already recorded ✅")
+            # Keep conversations in their current state and stop other handlers from seeing it
+            raise DispatcherHandlerStop
+        return func(update, context, *args, **kwargs)
+    return wrapper
+
+def restore_archived_user(user_id) -> bool:
+    """Moves an archived user's rows back into the main sheet; True if the user was archived."""
+    if not archive.is_archived(user_id):
+        return False
+    rows = archive.restore(user_id)
+    for row in rows:
+        attendance_tracker.notify_listeners('add', row)
+    suspend_reminders([user_id], suspended=False)
+    publish({'type': 'unarchive', 'user_ids': [str(user_id)]})
+    return bool(rows)
+
+def suspend_reminders(user_ids, suspended=True) -> None:
+    """Takes archived users' timetable slots off the reminder wheel, or puts them back when they return.
+
+    Only the process running the wheel holds the timetable, so elsewhere this does nothing.
+    """
+    for user_id in user_ids:
+        for slot in timetable_store.user_slots(user_id):
+            if suspended:
+                reminder_wheel.remove(slot)
+            else:
+                reminder_wheel.add(slot)
+
 def start(update: Update, context: CallbackContext) -> int:
     user = update.message.from_user
     chat_id = user.id
     update.message.reply_text(f'Welcome to Attendio Bot, {user.first_name}!')
 
     try:
+        if restore_archived_user(user.id):
+            update.message.reply_text("Good to see you again! Your courses and attendance have been restored.")
         user_data = attendance_tracker.get_user_data(user.id)
         
         # Check if user has verified phone
@@ -273,10 +355,21 @@ def help_command(update: Update, context: CallbackContext) -> None:
         "/start - Start your journey with Attendio Bot\n"
         "/check_attendance - Get a list of attendance in all courses you have registered for\n"
         "/mark_attendance - Mark attendance for a course\n"
+        "/mark_all - Mark attendance for several courses at once\n"
         "/edit_attendance - Edit a mistake done while marking attendance for a course\n"
         "/add_course - Add a new course which you have registered for\n"
         "/delete_course - Delete a course which you have dropped\n"
         "/manage_absences - Get suggestions for safe classes to skip\n"
+        "/plan_bunks - Plan how many upcoming classes you can skip in each course\n"
+        "/set_threshold - Set the minimum attendance a course needs, e.g. 85% for a clinical\n"
+        "/add_class - Add a class to your weekly timetable to get reminders after it\n"
+        "/remove_class - Remove a class from your timetable\n"
+        "/timetable - Show your weekly timetable\n"
+        "/create_class - Create a shared class course that students join with a code\n"
+        "/join_class - Join a shared class course with its code\n"
+        "/mark_class - Mark a session of a shared class you run for all its members\n"
+        "/classes - List your shared class courses\n"
+        "/leaderboard - Top streaks and attendance, overall or in one of your shared classes\n"
         "/feedback - Provide feedback to help us improve Attendio\n"
         "/help - Check out all the commands which Attendio can help you into\n"
     )
@@ -288,9 +381,14 @@ def help_command(update: Update, context: CallbackContext) -> None:
             "<code>/block [user_id]</code> - Block a user from using the bot\n"
             "<code>/unblock [user_id]</code> - Unblock a previously blocked user\n"
             "<code>/send_reminders</code> - Manually send reminders to all users\n"
+            "<code>/jobs [pause|resume|run] [job]</code> - List scheduled jobs or pause, resume and run one\n"
+            "<code>/stats [minutes]</code> - Handler latency and Sheets usage for the last N minutes (default: 15)\n"
+            "<code>/trace [update_id | sample rate]</code> - Show a traced update's waterfall or set the sampling rate\n"
+            "<code>/profile [n | job name | off]</code> - Profile the next N updates or the next run of a job and get the .prof file\n"
             "<code>/reply [user_id] [message]</code> - Reply directly to a user\n"
-            "<code>/announce</code> - Send an announcement to all users\n"
-            "<code>/logs [hours]</code> - Get logs for the last N hours (default: 24)\n"
+            "<code>/announce [all|below|inactive|new|course] [days|code]</code> - Send an announcement to everyone or to one segment of users\n"
+            "<code>/logs [hours] [level] [file] [text]</code> - Get logs for the last N hours (default: 24), optionally filtered by level and text; <code>file</code> sends one .gz document\n"
+            "<code>/loglevel [logger] [level]</code> - Show or change logger levels, e.g. <code>/loglevel google_sheets debug</code>\n"
         )
         help_text += admin_text
         update.message.reply_text(help_text, parse_mode=ParseMode.HTML)
@@ -326,7 +424,126 @@ def course_selected(update: Update, context: CallbackContext) -> int:
     query.edit_message_text(text=f"Mark attendance for {query.data}:", reply_markup=reply_markup)
     return MARK_ATTENDANCE
 
+# Multi-course marking flow
+MARK_ALL_LABELS = {None: "⬜", 1: "✅ Present", 0: "❌ Absent"}
+
+def mark_all_keyboard(courses, marks):
+    keyboard = [
+        [InlineKeyboardButton(f"{course['Course Nickname']}: {MARK_ALL_LABELS[marks.get(course['Course Code'])]}",
+                              callback_data=f"ma_toggle:{i}")]
+        for i, course in enumerate(courses)
+    ]
+    keyboard.append([InlineKeyboardButton("✔️ Submit", callback_data="ma_submit"),
+                     InlineKeyboardButton("✖️ Cancel", callback_data="ma_cancel")])
+    return InlineKeyboardMarkup(keyboard)
+
+def mark_all_start(update: Update, context: CallbackContext) -> int:
+    user_id = update.message.from_user.id
+    valid_courses = [course for course in attendance_tracker.get_user_courses(user_id) if is_valid_course(course)]
+
+    if not valid_courses:
+        update.message.reply_text('No courses found. Please add a new course first using /add_course command.')
+        return ConversationHandler.END
+
+    courses = [{'Course Code': course['Course Code'], 'Course Nickname': course['Course Nickname']} for course in valid_courses]
+    context.user_data['mark_all'] = {'courses': courses, 'marks': {}}
+    update.message.reply_text(
+        'Tap each course to toggle Present / Absent / unmarked, then press Submit:',
+        reply_markup=mark_all_keyboard(courses, {})
+    )
+    return MARK_ALL
+
+def mark_all_toggle(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    query.answer()
+    state = context.user_data.get('mark_all')
+    if not state:
+        query.edit_message_text(text="This session has expired. Please use /mark_all again.")
+        return ConversationHandler.END
+
+    index = int(query.data.split(':')[1])
+    course_code = state['courses'][index]['Course Code']
+    # Cycle unmarked -> present -> absent -> unmarked
+    current = state['marks'].get(course_code)
+    if current is None:
+        state['marks'][course_code] = 1
+    elif current == 1:
+        state['marks'][course_code] = 0
+    else:
+        del state['marks'][course_code]
+
+    query.edit_message_reply_markup(reply_markup=mark_all_keyboard(state['courses'], state['marks']))
+    return MARK_ALL
+
+@dedup_callback
+def mark_all_submit(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    query.answer()
+    state = context.user_data.pop('mark_all', None)
+    if not state or not state['marks']:
+        query.edit_message_text(text="Nothing was marked.")
+        return ConversationHandler.END
+
+    try:
+        results = attendance_tracker.update_attendance_bulk(query.from_user.id, state['marks'])
+        if not results:
+            query.edit_message_text(text="Couldn't mark attendance. Please try again.")
+            return ConversationHandler.END
+
+        response_text = f"✅ *Attendance marked for {len(results)} course(s)*\n\n"
+        for course in state['courses']:
+            if course['Course Code'] not in results:
+                continue
+            _, after = results[course['Course Code']]
+            present = int(after['Present'])
+            absent = int(after['Absent'])
+            total_classes = present + absent
+            attendance_percentage = (present / total_classes) * 100 if total_classes > 0 else 100.0
+            status = "Present ✅" if state['marks'][course['Course Code']] == 1 else "Absent ❌"
+            response_text += f"*{course['Course Nickname']}:* {status} — {attendance_percentage:.2f}%\n"
+
+        query.edit_message_text(text=response_text, parse_mode=ParseMode.MARKDOWN)
+    except Exception as e:
+        query.edit_message_text(text=f"Error marking attendance: {str(e)}")
+        logger.error(f"Error in mark_all_submit: {str(e)}")
+    return ConversationHandler.END
+
+def mark_all_cancel(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    query.answer()
+    context.user_data.pop('mark_all', None)
+    query.edit_message_text(text="Marking cancelled.")
+    return ConversationHandler.END
+
 # functions for the announcement feature
+ANNOUNCE_USAGE = (
+    "Usage: <code>/announce [segment]</code>, where the segment is one of\n"
+    "• <code>all</code> (default) - everyone\n"
+    "• <code>below</code> - users below the attendance threshold in any course\n"
+    "• <code>inactive [days]</code> - users inactive for that many days (default: 7)\n"
+    "• <code>new [days]</code> - users who registered in the last that many days (default: 7)\n"
+    "• <code>course [join code]</code> - members of a shared class"
+)
+
+def announcement_segment(args):
+    """Returns (description, {user id: chat id}) for the segment named in /announce arguments."""
+    segment = args[0].lower() if args else 'all'
+    if segment == 'all':
+        return "users", audience.everyone()
+    if segment == 'below':
+        return "users below the attendance threshold", audience.below_threshold()
+    if segment in ('inactive', 'new'):
+        days = int(args[1]) if len(args) > 1 and args[1].isdigit() else 7
+        if segment == 'inactive':
+            return f"users inactive for {days}+ days", audience.inactive(days)
+        return f"users who registered in the last {days} days", audience.new_users(days)
+    if segment == 'course':
+        course = shared_courses.by_join_code(args[1]) if len(args) > 1 else None
+        if not course:
+            raise ValueError("No shared class found with that join code.")
+        return f"members of {course['Course Nickname']}", audience.members(shared_courses.member_ids(course['Course Code']))
+    raise ValueError(f"Unknown segment '{segment}'.")
+
 def announce_start(update: Update, context: CallbackContext) -> int:
     """Starts the announcement conversation for admin."""
     user = update.effective_user
@@ -336,14 +553,26 @@ def announce_start(update: Update, context: CallbackContext) -> int:
         update.message.reply_text("⚠️ You don't have permission to use this command.")
         return ConversationHandler.END
     
+    try:
+        label, recipients = announcement_segment(context.args)
+    except ValueError as e:
+        update.message.reply_text(f"❌ {str(e)}\n\n{ANNOUNCE_USAGE}", parse_mode=ParseMode.HTML)
+        return ConversationHandler.END
+
+    if not recipients:
+        update.message.reply_text(f"No users are in this segment ({label}), so there is nobody to send to.")
+        return ConversationHandler.END
+
+    context.user_data['announcement'] = {'label': label, 'recipients': recipients}
     update.message.reply_text(
-        "📣 Please enter the announcement message you want to send to all users.\n\n"
-        "This will be sent to everyone using the bot. Use /cancel to abort."
+        f"📣 This announcement will go to <b>{len(recipients)}</b> {html.escape(label)}.\n\n"
+        f"Please enter the announcement message, or use /cancel to abort.",
+        parse_mode=ParseMode.HTML
     )
     return ANNOUNCEMENT_TEXT
 
 def send_announcement(update: Update, context: CallbackContext) -> int:
-    """Sends the announcement to all users."""
+    """Sends the announcement to the segment chosen in announce_start()."""
     announcement_text = update.message.text
     user = update.effective_user
     
@@ -351,19 +580,15 @@ def send_announcement(update: Update, context: CallbackContext) -> int:
         update.message.reply_text("⚠️ You don't have permission to complete this action.")
         return ConversationHandler.END
     
+    announcement = context.user_data.pop('announcement', None)
+    if not announcement:
+        update.message.reply_text("Start the announcement again with /announce.")
+        return ConversationHandler.END
+
     try:
-        # Get all unique users
-        data = attendance_tracker.google_sheets.get_all_data()
-        unique_users = {}
-        
-        # First, collect unique users and their chat IDs
-        for row in data:
-            user_id = str(row['User ID']).strip()
-            chat_id = str(row['Chat ID']).strip()
-            
-            if user_id and chat_id and user_id not in unique_users:
-                unique_users[user_id] = chat_id
-        
+        # Recipients were picked from the audience index when the segment was chosen
+        unique_users = announcement['recipients']
+
         # Format the announcement
         formatted_announcement = (
             f"📣 <b>ANNOUNCEMENT FROM ADMIN</b> 📣\n\n"
@@ -374,27 +599,27 @@ def send_announcement(update: Update, context: CallbackContext) -> int:
         # Send to each user
         success_count = 0
         failed_count = 0
+        skipped_count = 0
         
         update.message.reply_text(f"Sending announcement to {len(unique_users)} users...")
         
         for user_id, chat_id in unique_users.items():
-            try:
-                context.bot.send_message(
-                    chat_id=chat_id,
-                    text=formatted_announcement,
-                    parse_mode=ParseMode.HTML
-                )
+            outcome = delivery_tracker.send(context.bot, chat_id, formatted_announcement, parse_mode=ParseMode.HTML)
+            if outcome == SENT:
                 success_count += 1
-            except Exception:
+            elif outcome == SKIPPED:
+                skipped_count += 1
+            else:
                 failed_count += 1
         
         # Report results
         results_message = (
             f"✅ Announcement sent successfully!\n\n"
             f"📊 <b>Statistics:</b>\n"
-            f"• Total users: {len(unique_users)}\n"
+            f"• Recipients: {len(unique_users)} {html.escape(announcement['label'])}\n"
             f"• Successfully delivered: {success_count}\n"
-            f"• Failed to deliver: {failed_count}"
+            f"• Failed to deliver: {failed_count}\n"
+            f"• Skipped (blocked the bot or chat gone): {skipped_count}"
         )
         
         update.message.reply_text(results_message, parse_mode=ParseMode.HTML)
@@ -406,6 +631,7 @@ def send_announcement(update: Update, context: CallbackContext) -> int:
     return ConversationHandler.END
 
 
+@dedup_callback
 def attendance_response(update: Update, context: CallbackContext) -> int:
     query = update.callback_query
     query.answer()
@@ -466,14 +692,15 @@ def attendance_response(update: Update, context: CallbackContext) -> int:
         if streak > 0:
             response_text += f"🔥 You're on a {streak}-day streak for this course! Keep it up!\n"
             
-        # Add advice based on attendance percentage
-        if attendance_percentage < 80:
-            classes_needed = max(0, 4*absent_after - present_after)
-            response_text += f"\nYou need to attend *at least {classes_needed} more* classes to cross the 80% threshold."
+        # Add advice based on the course's threshold
+        verdict = Verdicts([course_after], attendance_tracker.attendance_threshold)
+        threshold_text = format_threshold(verdict.threshold[0])
+        if verdict.below[0]:
+            response_text += f"\nYou need to attend *at least {verdict.needed[0]} more* classes to cross the {threshold_text} threshold."
         else:
-            classes_left = max(0, math.floor((present_after - 4*absent_after)/4))
+            classes_left = verdict.left[0]
             if classes_left >= 1:
-                response_text += f"\nYou can leave *{classes_left} more* classes & still cross the 80% threshold."
+                response_text += f"\nYou can leave *{classes_left} more* classes & still cross the {threshold_text} threshold."
             else:
                 response_text += "\nBe careful: Leaving even 1 more class can put you in low attendance."
         
@@ -888,6 +1115,7 @@ def edit_attendance_update(update: Update, context: CallbackContext) -> int:
 #             import traceback
 #             logging.error(traceback.format_exc())
 
+@profiler.profiled_job('reminders')
 def send_reminders():
     """Sends reminders to all users."""
     try:
@@ -899,41 +1127,47 @@ def send_reminders():
         users_count = 0
         successful_reminders = 0
         failed_reminders = 0
+        skipped_reminders = 0
         
-        for row in all_data:
+        for row_index, row in enumerate(all_data):
             user_id = str(row['User ID']).strip()
             if user_id not in user_courses:
                 user_courses[user_id] = []
                 users_count += 1
-            user_courses[user_id].append(row)
+            user_courses[user_id].append(row_index)
         
+        # Verdicts for every row at once, each against its own course's threshold
+        verdicts = Verdicts(all_data, attendance_tracker.attendance_threshold)
         logging.info(f"Found {users_count} users to send reminders to")
         
-        for user_id, courses in user_courses.items():
+        for user_id, row_indexes in user_courses.items():
+            courses = [all_data[row_index] for row_index in row_indexes]
+            # Users who blocked the bot are left out until they come back
+            if courses[0].get('Chat ID') and delivery_tracker.is_dead(courses[0]['Chat ID']):
+                skipped_reminders += 1
+                continue
             try:
                 attendance_status = "<b>Attendance Status:</b>\n"
                 valid_courses = 0
                 
-                for i, course in enumerate(courses):
+                for row_index in row_indexes:
                     try:
+                        course = all_data[row_index]
                         course_nickname = course.get('Course Nickname', 'Unknown')
-                        present = int(course.get('Present', 0) or 0)
-                        absent = int(course.get('Absent', 0) or 0)
-                        
-                        total_classes = present + absent
-                        attendance_percentage = (present / total_classes) * 100 if total_classes > 0 else 100.0
+                        attendance_percentage = verdicts.percentage[row_index]
+                        threshold_text = format_threshold(verdicts.threshold[row_index])
                         
-                        if attendance_percentage < attendance_tracker.attendance_threshold:
+                        if verdicts.below[row_index]:
                             attendance_status += f"<b>{valid_courses + 1}. {course_nickname}:</b> ⚠️\n"
                             attendance_status += f"  <b>Attendance:</b> {attendance_percentage:.2f}%\n"
-                            attendance_status += f"  You need to attend <b>at least {4*absent - present} more</b> classes to cross the 80% threshold.\n"
+                            attendance_status += f"  You need to attend <b>at least {verdicts.needed[row_index]} more</b> classes to cross the {threshold_text} threshold.\n"
                             attendance_status += "\n"
                         else:
                             attendance_status += f"<b>{valid_courses + 1}. {course_nickname}:</b> ✅\n"
                             attendance_status += f"  <b>Attendance:</b> {attendance_percentage:.2f}%\n"
-                            classes_left = max(0, math.floor((present - 4*absent)/4))
+                            classes_left = verdicts.left[row_index]
                             if classes_left >= 1:
-                                attendance_status += f"  You can leave <b>{classes_left} more</b> classes & still cross the 80% threshold.\n"
+                                attendance_status += f"  You can leave <b>{classes_left} more</b> classes & still cross the {threshold_text} threshold.\n"
                             else:
                                 attendance_status += f"  You are in the safe zone. Keep up the good work! ✅\n"
                                 attendance_status += f"  <i>Be Alert:</i> Leaving even 1 class can put you in low attendance.\n"
@@ -948,31 +1182,73 @@ def send_reminders():
                     
                     chat_id = courses[0].get('Chat ID')
                     if chat_id:
-                        try:
-                            attendance_tracker.google_sheets.send_message(chat_id, attendance_status, parse_mode=ParseMode.HTML)
+                        if delivery_tracker.send(updater.bot, chat_id, attendance_status, parse_mode=ParseMode.HTML) == SENT:
                             successful_reminders += 1
                             logging.info(f"Sent reminder to user {user_id}")
-                        except Exception as e:
+                        else:
                             failed_reminders += 1
-                            logging.error(f"Error sending reminder to user {user_id}: {str(e)}")
+                            logging.error(f"Error sending reminder to user {user_id}")
                     else:
                         logging.warning(f"No chat ID found for user {user_id}. Skipping reminder.")
             except Exception as e:
                 failed_reminders += 1
                 logging.error(f"Error processing user {user_id}: {str(e)}")
         
-        logging.info(f"🏁 SENDING REMINDERS COMPLETED: {successful_reminders} successful, {failed_reminders} failed")
+        logging.info(f"🏁 SENDING REMINDERS COMPLETED: {successful_reminders} successful, {failed_reminders} failed, "
+                     f"{skipped_reminders} skipped (chats not accepting messages)")
     
     except Exception as e:
         logging.error(f"❌ ERROR SENDING REMINDERS: {str(e)}")
         import traceback
         logging.error(traceback.format_exc())
         
-def calculate_classes_needed(present, absent, safe_zone_attendance):
-    total_classes = present + absent
-    classes_needed = max(0,4*absent - present)
-    classes_left = max(0,math.floor((present- 4*absent)/4))
-    return classes_needed, classes_left
+@profiler.profiled_job('daily_reports')
+def send_daily_reports() -> None:
+    """Job that sends each user a summary of today's marked classes."""
+    report_generator.send_reports(updater.bot, weekly=False, delivery=delivery_tracker)
+
+@profiler.profiled_job('weekly_reports')
+def send_weekly_reports() -> None:
+    """Job that sends each user a summary of the week."""
+    report_generator.send_reports(updater.bot, weekly=True, delivery=delivery_tracker)
+
+def send_daily_logs() -> None:
+    """Job that sends the admin the last 24 hours of logs as a compressed document."""
+    send_logs_to_admin(updater.bot, config['admin_telegram_id'], 24, as_document=True)
+
+def archive_inactive_users() -> None:
+    """Job that moves users inactive for ARCHIVE_AFTER_DAYS days out of the main sheet."""
+    admin_id = str(config.get('admin_telegram_id'))
+    user_ids = [user_id for user_id in audience.inactive_ids(ARCHIVE_AFTER_DAYS) if user_id != admin_id]
+    if not user_ids:
+        logger.info("No inactive users to archive")
+        return
+    moved = archive.archive_users(user_ids[:ARCHIVE_BATCH_SIZE])
+    for user_id, rows in moved.items():
+        for row in rows:
+            attendance_tracker.notify_listeners('delete', row)
+        audience.remove_user(user_id)
+    suspend_reminders(moved)
+    publish({'type': 'archive', 'user_ids': list(moved)})
+    admin_notifier.notify('archived', f"{len(moved)} users inactive for {ARCHIVE_AFTER_DAYS}+ days "
+                                      f"({sum(len(rows) for rows in moved.values())} rows)")
+
+def scheduled_jobs():
+    """Every recurring job of the bot; times are IST."""
+    jobs = [
+        JobSpec('reminders', send_reminders, {'hour': 20, 'minute': 15}, jitter=120, exclusive=True,
+                min_interval=20 * 3600, description="Attendance reminders"),
+        JobSpec('daily_reports', send_daily_reports, {'hour': 21, 'minute': 0}, jitter=120, exclusive=True,
+                min_interval=20 * 3600, description="Daily reports"),
+        JobSpec('weekly_reports', send_weekly_reports, {'day_of_week': 'sun', 'hour': 20, 'minute': 0}, jitter=120,
+                exclusive=True, min_interval=6 * 24 * 3600, description="Weekly reports"),
+        JobSpec('archive', archive_inactive_users, {'hour': 3, 'minute': 30}, jitter=300, exclusive=True,
+                min_interval=20 * 3600, description="Archive inactive users"),
+    ]
+    if config.get('admin_telegram_id'):
+        jobs.append(JobSpec('daily_logs', send_daily_logs, {'hour': 17, 'minute': 30}, jitter=60,
+                            min_interval=20 * 3600, description="Daily logs to admin"))
+    return jobs
 
 def is_valid_course(course):
     return (course.get('Course Nickname') and 
@@ -993,6 +1269,7 @@ def check_attendance(update: Update, context: CallbackContext) -> None:
             update.message.reply_text("No courses found. Please add a course first using /add_course.")
             return
 
+        verdicts = Verdicts(user_courses, attendance_tracker.attendance_threshold)
         attendance_status = "*Attendance Status:*\n"
         for i, course in enumerate(user_courses):
             course_nickname = course['Course Nickname']
@@ -1014,26 +1291,37 @@ def check_attendance(update: Update, context: CallbackContext) -> None:
             total_classes = present + absent
             attendance_percentage = (present / total_classes) * 100 if total_classes > 0 else 100.0
 
-            classes_needed, classes_left = calculate_classes_needed(present, absent, 80)
-            status_emoji = "⚠️" if attendance_percentage < 80 else "✅"
+            classes_needed, classes_left = verdicts.needed[i], verdicts.left[i]
+            threshold_text = format_threshold(verdicts.threshold[i])
+            status_emoji = "⚠️" if verdicts.below[i] else "✅"
 
             attendance_status += f"*{i + 1}. {course_nickname}:* {status_emoji}\n"
             attendance_status += f"  *Present:* {present} ✅\n"
             attendance_status += f"  *Absent:* {absent} ❌\n"
             attendance_status += f"  *Total Classes:* {total_classes}\n"
-            attendance_status += f"  *Attendance:* {attendance_percentage:.2f}%\n"
+            attendance_status += f"  *Attendance:* {attendance_percentage:.2f}% (needs {threshold_text})\n"
             attendance_status += f"  *Last Updated:* {last_updated}\n"
 
             # Streak System
             if streak > 0:
                 attendance_status += f"  🔥 You're on a {streak}-class streak! Keep it up!\n"
 
-            if classes_needed > 0:
-                attendance_status += f"  *Classes Needed:* You need to be present in at least {classes_needed} more classes to cross the 80% threshold.\n"
+            # Trends from the per-day history
+            trends = attendance_tracker.get_course_trends(course)
+            attended_7, held_7 = trends['last_7']
+            if held_7 > 0:
+                attendance_status += f"  📅 *Last 7 days:* {attended_7}/{held_7} classes attended\n"
+            if trends['longest_streak'] > 1:
+                attendance_status += f"  🏆 *Best streak this semester:* {trends['longest_streak']} classes\n"
+            if trends['most_missed_day']:
+                attendance_status += f"  📉 *Most missed on:* {trends['most_missed_day']}s ({trends['most_missed_count']} absences)\n"
+
+            if verdicts.below[i]:
+                attendance_status += f"  *Classes Needed:* You need to be present in at least {classes_needed} more classes to cross the {threshold_text} threshold.\n"
             else:
                 attendance_status += "  You are in the safe zone. Keep up the good work! ✅\n"
                 if classes_left >= 1:
-                    attendance_status += f"  You can leave {classes_left} more classes & still cross the 80% threshold.\n"
+                    attendance_status += f"  You can leave {classes_left} more classes & still cross the {threshold_text} threshold.\n"
                 else:
                     attendance_status += f"  Be Careful: Leaving even 1 more class can put you in low attendance.\n"
 
@@ -1113,16 +1401,9 @@ def save_feedback(update: Update, context: CallbackContext) -> int:
                                f" Reply {user.name} using <code>/reply {user_id} [message]</code>\n\n"
                 user_reply = "Your feedback has been recorded! We appreciate your help in making Attendio better."
             
-            # Send to admin
-            try:
-                context.bot.send_message(
-                    chat_id=config['admin_telegram_id'],
-                    text=admin_message,
-                    parse_mode=ParseMode.HTML
-                )
-                logger.info(f"Feedback from user {user_id} forwarded to admin")
-            except Exception as e:
-                logger.error(f"Error sending feedback to admin: {str(e)}")
+            # Feedback and block appeals need a reply, so they skip the digest
+            admin_notifier.notify('feedback', admin_message, urgent=True)
+            logger.info(f"Feedback from user {user_id} queued for admin")
             
             # Reply to user - try both methods
             try:
@@ -1159,10 +1440,15 @@ def handle_invalid_input(update: Update, context: CallbackContext) -> None:
         "/start - Start your journey with Attendio Bot\n"
         "/check_attendance - Get a list of attendance in all courses\n"
         "/mark_attendance - Mark attendance for a course\n"
+        "/mark_all - Mark attendance for several courses at once\n"
         "/edit_attendance - Edit a mistake done while marking attendance\n"
         "/add_course - Add a new course\n"
         "/delete_course - Delete a course\n"
         "/manage_absences - Get suggestions for safe classes to skip\n"
+        "/plan_bunks - Plan how many upcoming classes you can skip\n"
+        "/add_class - Add a class to your weekly timetable\n"
+        "/timetable - Show your weekly timetable\n"
+        "/join_class - Join a shared class course with its code\n"
         "/feedback - Provide feedback about the bot\n"
         "/help - Check out all the commands Attendio can help you with"
     )
@@ -1182,7 +1468,7 @@ def manage_absences(update: Update, context: CallbackContext) -> None:
 
         message = "You can afford to skip these classes today:\n"
         for course in valid_courses:
-            message += f"- {course['Course Nickname']} ({course['Attendance']:.0f}%)\n"
+            message += f"- {course['Course Nickname']} ({course['Attendance']:.0f}%, needs {format_threshold(course['Threshold'])})\n"
 
         update.message.reply_text(message)
 
@@ -1190,6 +1476,443 @@ def manage_absences(update: Update, context: CallbackContext) -> None:
         update.message.reply_text(f"Error managing absences: {str(e)}")
         logger.error(f"Error in manage_absences: {str(e)}")
 
+def parse_upcoming_classes(text):
+    """Parses 'DSA=3, DBMS 2' style input into a dict of nickname -> class count."""
+    upcoming = {}
+    for part in text.replace('\n', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, count = part.replace('=', ' ').rpartition(' ')
+        if not name.strip() or not count.isdigit():
+            raise ValueError(part)
+        upcoming[name.strip()] = int(count)
+    return upcoming
+
+def plan_bunks(update: Update, context: CallbackContext) -> None:
+    """Plans how many of the upcoming classes in each course can be skipped."""
+    user_id = update.effective_user.id
+    usage = (
+        "Usage: <code>/plan_bunks DSA=3, DBMS=2</code>\n\n"
+        "List each course nickname with the number of classes it has coming up (e.g. next week)."
+    )
+
+    try:
+        upcoming = parse_upcoming_classes(' '.join(context.args))
+    except ValueError as e:
+        update.message.reply_text(f"Couldn't understand '{e}'.\n\n{usage}", parse_mode=ParseMode.HTML)
+        return
+    if not upcoming:
+        # Default to one week of classes from the user's timetable
+        for slot in timetable_store.user_slots(user_id):
+            upcoming[slot['Course Nickname']] = upcoming.get(slot['Course Nickname'], 0) + 1
+    if not upcoming:
+        update.message.reply_text(usage + "\n\nOr register your timetable with /add_class to plan the next week automatically.", parse_mode=ParseMode.HTML)
+        return
+
+    try:
+        plan, unknown = bunk_planner.plan(user_id, upcoming)
+        if not plan:
+            update.message.reply_text("None of those courses were found. Check your course nicknames with /check_attendance.")
+            return
+
+        message = "<b>🗓 Bunk Plan:</b>\n\n"
+        total_skippable = 0
+        for course in plan:
+            total_skippable += course['Skippable']
+            emoji = "✅" if course['Skippable'] > 0 else "⚠️"
+            message += f"{emoji} <b>{html.escape(str(course['Course Nickname']))}:</b> skip up to {course['Skippable']} of {course['Upcoming']} classes "
+            message += f"({course['Attendance After']:.1f}% after, needs {format_threshold(course['Threshold'])})\n"
+        message += f"\nYou can skip <b>{total_skippable}</b> classes in total and stay at or above every course's threshold."
+        if unknown:
+            message += f"\n\n❓ Unknown courses: {html.escape(', '.join(unknown))}"
+        update.message.reply_text(message, parse_mode=ParseMode.HTML)
+
+    except Exception as e:
+        update.message.reply_text(f"Error planning bunks: {str(e)}")
+        logger.error(f"Error in plan_bunks: {str(e)}")
+
+def threshold_command(update: Update, context: CallbackContext) -> None:
+    """Sets the minimum attendance of one of the user's courses, or resets it to the global threshold."""
+    user = update.effective_user
+    default_text = format_threshold(attendance_tracker.attendance_threshold)
+    usage = (
+        "Usage: <code>/set_threshold [course nickname] [percent|default]</code>\n"
+        f"For example: <code>/set_threshold Anatomy Lab 85</code>. Courses without one use {default_text}."
+    )
+    if len(context.args) < 2:
+        update.message.reply_text(usage, parse_mode=ParseMode.HTML)
+        return
+
+    nickname = ' '.join(context.args[:-1]).strip()
+    try:
+        threshold = '' if context.args[-1].lower() == 'default' else parse_threshold(context.args[-1])
+    except ValueError as e:
+        message = str(e) if 'between' in str(e) else f"'{context.args[-1]}' is not a percentage"
+        update.message.reply_text(f"❌ {message}.\n\n{usage}", parse_mode=ParseMode.HTML)
+        return
+
+    try:
+        course = next((course for course in attendance_tracker.get_user_courses(user.id)
+                       if str(course['Course Nickname']).strip().lower() == nickname.lower()), None)
+        if not course:
+            update.message.reply_text(f"Course '{nickname}' not found. Check your course nicknames with /check_attendance.")
+            return
+
+        shared = shared_courses.get(course['Course Code'])
+        if shared:
+            if shared['Owner ID'] != str(user.id):
+                update.message.reply_text("Only the class representative can change the threshold of a shared class.")
+                return
+            updated = attendance_tracker.set_threshold(course['Course Code'], threshold)
+        else:
+            updated = attendance_tracker.set_threshold(course['Course Code'], threshold, user_id=user.id)
+
+        if not updated:
+            update.message.reply_text("Couldn't update the threshold. Please try again.")
+            return
+        threshold_text = format_threshold(threshold) if threshold != '' else f"the default {default_text}"
+        members = f" for all {updated} members" if shared else ""
+        update.message.reply_text(f"✅ {course['Course Nickname']} now needs {threshold_text}{members}.")
+    except Exception as e:
+        update.message.reply_text(f"Error setting threshold: {str(e)}")
+        logger.error(f"Error in threshold_command: {str(e)}")
+
+def format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def add_class(update: Update, context: CallbackContext) -> None:
+    """Adds a weekly class slot to the user's timetable."""
+    user_id = update.effective_user.id
+    usage = "Usage: <code>/add_class [course nickname] [day] [HH:MM-HH:MM]</code>\nFor example: <code>/add_class DSA Mon 10:00-11:00</code>"
+
+    if len(context.args) < 3:
+        update.message.reply_text(usage, parse_mode=ParseMode.HTML)
+        return
+
+    try:
+        nickname = ' '.join(context.args[:-2])
+        day = parse_day(context.args[-2])
+        start_text, end_text = context.args[-1].split('-')
+        start, end = parse_time(start_text), parse_time(end_text)
+        if end <= start:
+            raise ValueError("The class must end after it starts")
+    except ValueError as e:
+        update.message.reply_text(f"❌ {str(e)}\n\n{usage}", parse_mode=ParseMode.HTML)
+        return
+
+    try:
+        course = next((course for course in attendance_tracker.get_user_courses(user_id)
+                       if str(course['Course Nickname']).strip().lower() == nickname.strip().lower()), None)
+        if not course:
+            update.message.reply_text(f"Course '{nickname}' not found. Add it first using /add_course.")
+            return
+
+        slot = timetable_store.add_slot(user_id, update.effective_chat.id, course['Course Code'],
+                                        course['Course Nickname'], day, start, end)
+        reminder_wheel.add(slot)
+        publish({'type': 'slot_add', 'slot': slot})
+        update.message.reply_text(
+            f"✅ Added {course['Course Nickname']} on {DAYS[day]} {format_minutes(start)}-{format_minutes(end)}.\n"
+            f"I'll ask you to mark attendance right after it ends."
+        )
+    except Exception as e:
+        update.message.reply_text(f"Error adding class: {str(e)}")
+        logger.error(f"Error in add_class: {str(e)}")
+
+def remove_class(update: Update, context: CallbackContext) -> None:
+    """Removes a weekly class slot from the user's timetable."""
+    user_id = update.effective_user.id
+    usage = "Usage: <code>/remove_class [course nickname] [day] [HH:MM]</code>\nFor example: <code>/remove_class DSA Mon 10:00</code>"
+
+    if len(context.args) < 3:
+        update.message.reply_text(usage, parse_mode=ParseMode.HTML)
+        return
+
+    try:
+        nickname = ' '.join(context.args[:-2])
+        day = parse_day(context.args[-2])
+        start = parse_time(context.args[-1].split('-')[0])
+    except ValueError as e:
+        update.message.reply_text(f"❌ {str(e)}\n\n{usage}", parse_mode=ParseMode.HTML)
+        return
+
+    try:
+        slot = timetable_store.remove_slot(user_id, nickname, day, start)
+        if not slot:
+            update.message.reply_text("No such class found in your timetable. Check it with /timetable.")
+            return
+        reminder_wheel.remove(slot)
+        publish({'type': 'slot_remove', 'slot': slot})
+        update.message.reply_text(f"🗑 Removed {slot['Course Nickname']} on {DAYS[day]} {format_minutes(start)}.")
+    except Exception as e:
+        update.message.reply_text(f"Error removing class: {str(e)}")
+        logger.error(f"Error in remove_class: {str(e)}")
+
+def show_timetable(update: Update, context: CallbackContext) -> None:
+    """Shows the user's weekly timetable."""
+    user_id = update.effective_user.id
+    slots = timetable_store.user_slots(user_id)
+
+    if not slots:
+        update.message.reply_text("Your timetable is empty. Add classes using /add_class, e.g. /add_class DSA Mon 10:00-11:00")
+        return
+
+    message = "<b>🗓 Your Timetable:</b>\n"
+    current_day = None
+    for slot in slots:
+        if slot['Day'] != current_day:
+            current_day = slot['Day']
+            message += f"\n<b>{DAYS[current_day]}</b>\n"
+        message += f"  {format_minutes(slot['Start'])}-{format_minutes(slot['End'])} {html.escape(slot['Course Nickname'])}\n"
+    update.message.reply_text(message, parse_mode=ParseMode.HTML)
+
+def join_shared_course(user, course) -> bool:
+    """Adds the member row of a shared course for `user`."""
+    user_data = attendance_tracker.get_user_data(user.id)
+    phone_number = user_data.get('Phone Number', '') if user_data else ''
+    added = attendance_tracker.add_new_course(
+        user.id, user.first_name, course['Course Code'], course['Course Nickname'], 0, 0, phone_number
+    )
+    # New members take over the threshold the representative set for the class
+    owner_row = next((row for row in attendance_tracker.get_user_courses(course['Owner ID'])
+                      if row['Course Code'] == course['Course Code']), None)
+    if added and owner_row and owner_row.get('Threshold') not in ('', None):
+        attendance_tracker.set_threshold(course['Course Code'], owner_row['Threshold'], user_id=user.id)
+    return added
+
+def create_class(update: Update, context: CallbackContext) -> None:
+    """Creates a shared class course run by the user, who becomes its first member."""
+    user = update.effective_user
+    nickname = ' '.join(context.args).strip()
+    if not nickname:
+        update.message.reply_text(
+            "Usage: <code>/create_class [course nickname]</code>\nFor example: <code>/create_class DSA</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    try:
+        if any(str(course['Course Nickname']).strip().lower() == nickname.lower()
+               for course in attendance_tracker.get_user_courses(user.id)):
+            update.message.reply_text(f"You already have a course called '{nickname}'. Pick another nickname.")
+            return
+
+        course = shared_courses.create(user.id, nickname)
+        publish({'type': 'shared_course', 'course': course})
+        join_shared_course(user, course)
+        update.message.reply_text(
+            f"✅ Created the shared class <b>{html.escape(nickname)}</b>.\n\n"
+            f"Students join it with <code>/join_class {course['Join Code']}</code>.\n"
+            f"Mark a session for everyone with <code>/mark_class {html.escape(nickname)} present</code> "
+            f"or <code>absent</code>; each student can still change their own entry.",
+            parse_mode=ParseMode.HTML
+        )
+    except Exception as e:
+        update.message.reply_text(f"Error creating class: {str(e)}")
+        logger.error(f"Error in create_class: {str(e)}")
+
+def join_class(update: Update, context: CallbackContext) -> None:
+    """Joins a shared class course by its join code."""
+    user = update.effective_user
+    if len(context.args) != 1:
+        update.message.reply_text(
+            "Usage: <code>/join_class [code]</code>\nAsk your class representative for the code.",
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    course = shared_courses.by_join_code(context.args[0])
+    if not course:
+        update.message.reply_text("No class found with that code. Check it with your class representative.")
+        return
+    if shared_courses.is_member(course['Course Code'], user.id):
+        update.message.reply_text(f"You are already in {course['Course Nickname']}.")
+        return
+
+    try:
+        if any(str(existing['Course Nickname']).strip().lower() == course['Course Nickname'].lower()
+               for existing in attendance_tracker.get_user_courses(user.id)):
+            update.message.reply_text(
+                f"You already have your own course called '{course['Course Nickname']}'. "
+                f"Delete it with /delete_course first if you want to use the shared class instead."
+            )
+            return
+
+        join_shared_course(user, course)
+        update.message.reply_text(
+            f"✅ You joined {course['Course Nickname']}. Your class representative's marks now count for you too; "
+            f"you can change your own entry from the message you get after each session."
+        )
+    except Exception as e:
+        update.message.reply_text(f"Error joining class: {str(e)}")
+        logger.error(f"Error in join_class: {str(e)}")
+
+def mark_class(update: Update, context: CallbackContext) -> None:
+    """Marks a session of a shared class for all of its members at once."""
+    user = update.effective_user
+    usage = "Usage: <code>/mark_class [course nickname] [present|absent]</code>\nFor example: <code>/mark_class DSA present</code>"
+    owned = shared_courses.owned_by(user.id)
+    if not owned:
+        update.message.reply_text("You don't run any shared class. Create one with /create_class.")
+        return
+    if not context.args or context.args[-1].lower() not in ('present', 'absent', 'p', 'a'):
+        update.message.reply_text(usage, parse_mode=ParseMode.HTML)
+        return
+
+    present_today = 1 if context.args[-1].lower() in ('present', 'p') else 0
+    nickname = ' '.join(context.args[:-1]).strip().lower()
+    matches = [course for course in owned if not nickname or course['Course Nickname'].lower() == nickname]
+    if len(matches) != 1:
+        names = ', '.join(html.escape(course['Course Nickname']) for course in owned)
+        update.message.reply_text(f"Say which class to mark; you run: {names}\n\n{usage}", parse_mode=ParseMode.HTML)
+        return
+    course = matches[0]
+
+    try:
+        updated, skipped = attendance_tracker.mark_course_members(course['Course Code'], present_today)
+        status = "Present ✅" if present_today == 1 else "Absent ❌"
+        today = datetime.now(pytz.timezone('Asia/Kolkata'))
+        # Members hear about it through the rate-limited outbox; the rep gets the summary below
+        for row in updated:
+            if str(row['User ID']).strip() != str(user.id) and row.get('Chat ID'):
+                # The button names this session, so a change only applies to it
+                session = DaySessions.from_cell(row.get('Sessions', ''), today.date(), 0).count() - 1
+                keyboard = InlineKeyboardMarkup([[InlineKeyboardButton(
+                    "I was absent ❌" if present_today == 1 else "I was present ✅",
+                    callback_data=f"so:{course['Course Code']}:{today:%Y%m%d}:{session}:{1 - present_today}"
+                )]])
+                outbox.send_message(
+                    row['Chat ID'],
+                    f"📢 {course['Course Nickname']} on {today:%d %b} was marked {status} for the class. "
+                    f"If that's wrong for you, change your own entry below.",
+                    reply_markup=keyboard
+                )
+        members = shared_courses.member_count(course['Course Code'])
+        message = f"Marked {status} for {len(updated)} of {members} members of {course['Course Nickname']}."
+        if skipped:
+            names = ', '.join(str(row.get('User Name') or row['User ID']) for row in skipped)
+            message += (f"\nLeft as they were, because they had already marked this session themselves "
+                        f"({len(skipped)}): {names}")
+        update.message.reply_text(message)
+    except Exception as e:
+        update.message.reply_text(f"Error marking class: {str(e)}")
+        logger.error(f"Error in mark_class: {str(e)}")
+
+def list_classes(update: Update, context: CallbackContext) -> None:
+    """Lists the shared class courses the user belongs to."""
+    user = update.effective_user
+    courses = [shared_courses.get(course['Course Code']) for course in attendance_tracker.get_user_courses(user.id)
+               if shared_courses.is_shared(course['Course Code'])]
+    if not courses:
+        update.message.reply_text("You are not in any shared class. Join one with /join_class or create one with /create_class.")
+        return
+
+    message = "<b>👥 Your shared classes:</b>\n"
+    for course in courses:
+        role = " (you run it)" if course['Owner ID'] == str(user.id) else ""
+        message += (f"\n• {html.escape(course['Course Nickname'])}{role}: "
+                    f"{shared_courses.member_count(course['Course Code'])} members, code <code>{course['Join Code']}</code>")
+    update.message.reply_text(message, parse_mode=ParseMode.HTML)
+
+LEADERBOARD_SIZE = 10
+
+def format_ranking(title, entries, unit):
+    if not entries:
+        return f"<b>{title}</b>\nNobody ranked yet.\n"
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = [f"<b>{title}</b>"]
+    for position, (user_id, name, score) in enumerate(entries, start=1):
+        score_text = f"{score:.1f}%" if unit == '%' else f"{score} {unit}"
+        lines.append(f"{medals.get(position, f'{position}.')} {html.escape(name or 'Anonymous')} - {score_text}")
+    return '\n'.join(lines) + "\n"
+
+def show_leaderboard(update: Update, context: CallbackContext) -> None:
+    """Shows the top streaks and attendance overall, or within one of the user's shared classes."""
+    user = update.effective_user
+    nickname = ' '.join(context.args).strip().lower()
+    course_code = None
+    scope = "Overall"
+
+    if nickname:
+        course = next((course for course in attendance_tracker.get_user_courses(user.id)
+                       if shared_courses.is_shared(course['Course Code'])
+                       and str(course['Course Nickname']).strip().lower() == nickname), None)
+        if not course:
+            update.message.reply_text(
+                "That isn't one of your shared classes. See them with /classes, "
+                "or use /leaderboard without a name for the overall ranking."
+            )
+            return
+        course_code = course['Course Code']
+        scope = html.escape(course['Course Nickname'])
+
+    top_streaks, top_attendance = leaderboard.top(LEADERBOARD_SIZE, course_code)
+    streak_rank, attendance_rank, ranked = leaderboard.position(user.id, course_code)
+
+    message = f"🏆 <b>Leaderboard: {scope}</b>\n\n"
+    message += format_ranking("🔥 Longest current streaks", top_streaks, "classes") + "\n"
+    message += format_ranking("📈 Best attendance", top_attendance, '%') + "\n"
+    message += (f"You: streak #{streak_rank or '-'}, attendance #{attendance_rank or '-'} of {ranked}.\n"
+                f"<i>Attendance ranks need at least {MIN_CLASSES_FOR_ATTENDANCE} classes.</i>")
+    update.message.reply_text(message, parse_mode=ParseMode.HTML)
+
+@dedup_callback
+def shared_override_response(update: Update, context: CallbackContext) -> None:
+    """Handles a member changing their own entry after their shared class was marked for them."""
+    query = update.callback_query
+    query.answer()
+    parts = query.data[len('so:'):].split(':')
+    # Buttons sent before sessions were numbered carry no session index
+    course_code, day, session, present_today = parts if len(parts) == 4 else (parts[0], parts[1], None, parts[2])
+    session = None if session is None else int(session)
+    present_today = int(present_today)
+    user = query.from_user
+
+    try:
+        day = datetime.strptime(day, '%Y%m%d').date()
+        restore_archived_user(user.id)
+        updated = attendance_tracker.override_mark(user.id, course_code, day, present_today, session)
+        if updated:
+            status = "Present ✅" if present_today == 1 else "Absent ❌"
+            query.edit_message_text(text=f"Changed your entry for {updated['Course Nickname']} on {day:%d %b} to {status}.")
+        else:
+            query.edit_message_text(text="Your entry for that session was already changed, or a later class day was marked since. "
+                                         "Use /edit_attendance to fix older entries.")
+    except Exception as e:
+        query.edit_message_text(text=f"Error changing your entry: {str(e)}")
+        logger.error(f"Error in shared_override_response: {str(e)}")
+    # Keep open conversations from also handling this button
+    raise DispatcherHandlerStop
+
+@dedup_callback
+def reminder_response(update: Update, context: CallbackContext) -> None:
+    """Handles the Present/Absent buttons of a post-class reminder."""
+    query = update.callback_query
+    query.answer()
+    course_code, present_today = query.data[len('rm:'):].rsplit(':', 1)
+    present_today = int(present_today)
+    user = query.from_user
+
+    try:
+        restore_archived_user(user.id)
+        course = next((course for course in attendance_tracker.get_user_courses(user.id)
+                       if course['Course Code'] == course_code), None)
+        if not course:
+            query.edit_message_text(text="Course not found. It may have been deleted.")
+            return
+
+        if attendance_tracker.update_attendance(user.id, user.first_name, course_code, course['Course Nickname'], present_today):
+            status = "Present ✅" if present_today == 1 else "Absent ❌"
+            query.edit_message_text(text=f"Marked {status} for {course['Course Nickname']}. Use /check_attendance to see your stats.")
+        else:
+            query.edit_message_text(text="Couldn't mark attendance. Please try /mark_attendance.")
+    except Exception as e:
+        query.edit_message_text(text=f"Error marking attendance: {str(e)}")
+        logger.error(f"Error in reminder_response: {str(e)}")
+    # Keep open conversations from also handling this button
+    raise DispatcherHandlerStop
+
 def cancel(update: Update, context: CallbackContext) -> int:
     user = update.message.from_user
     logger.info("User %s canceled the conversation.", user.first_name)
@@ -1218,7 +1941,9 @@ def send_reminders_command(update: Update, context: CallbackContext) -> None:
     
     update.message.reply_text("Manually sending reminders to all users...")
     try:
-        send_reminders()
+        # Wait for any scheduled bulk job in progress instead of sending alongside it
+        with exclusive_lock:
+            send_reminders()
         update.message.reply_text("✅ Reminders sent successfully!")
     except Exception as e:
         update.message.reply_text(f"❌ Error sending reminders: {str(e)}")
@@ -1248,22 +1973,14 @@ def handle_phone_number(update: Update, context: CallbackContext) -> int:
                 reply_markup=ReplyKeyboardRemove()
             )
         
-        # Notify admin about new user verification
-        if 'admin_telegram_id' in config:
-
-            user_mention = f'<a href="tg://user?id={user.id}">{user.first_name}</a>'
+        # New verifications are routine and go into the admin digest
+        user_mention = f'<a href="tg://user?id={user.id}">{html.escape(user.first_name)}</a>'
+        admin_notifier.notify(
+            'verified',
+            f"{user_mention} (ID: {user.id}) · 📞 {phone_number} · "
+            f"{datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%H:%M:%S')}"
+        )
 
-            admin_message = f"✅ New User Verified:\n\n" \
-                           f"👤 User: {user_mention} (ID:{user.id})\n" \
-                           f"⏰ Time: {datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S')}\n\n" \
-                           f"📞 Phone: {phone_number}\n"
-            
-            context.bot.send_message(
-                chat_id=config['admin_telegram_id'],
-                text=admin_message,
-                parse_mode=ParseMode.HTML
-            )
-            
         return ConversationHandler.END
     except Exception as e:
         update.message.reply_text(f"❌ Error verifying phone: {str(e)}", reply_markup=ReplyKeyboardRemove())
@@ -1274,10 +1991,6 @@ def verify_command(update: Update, context: CallbackContext) -> int:
     return request_phone_number(update, context)
 
 
-# Schedule daily logs to admin
-if 'admin_telegram_id' in config:
-    schedule_daily_logs(updater.bot, config['admin_telegram_id'])
-
 # Add this function for the admin to get logs
 def get_logs(update: Update, context: CallbackContext) -> None:
     """Admin command to get logs."""
@@ -1288,13 +2001,72 @@ def get_logs(update: Update, context: CallbackContext) -> None:
         update.message.reply_text("⚠️ You don't have permission to use this command.")
         return
     
-    # Get hours parameter (default 24)
+    # Usage: /logs [hours] [level] [file] [text] - e.g. /logs 2 error sheets
     hours = 24
-    if context.args and context.args[0].isdigit():
-        hours = int(context.args[0])
+    level = None
+    as_document = False
+    words = []
+    for arg in context.args:
+        if arg.lower() == 'file' and not words:
+            as_document = True
+        elif arg.isdigit() and not words:
+            hours = int(arg)
+        elif level is None and isinstance(logging.getLevelName(arg.upper()), int):
+            level = logging.getLevelName(arg.upper())
+        else:
+            words.append(arg)
+    contains = ' '.join(words) or None
+    
+    description = f"the last {hours} hours"
+    if level is not None:
+        description += f", level {logging.getLevelName(level)} and above"
+    if contains:
+        description += f", containing '{contains}'"
+    update.message.reply_text(f"Fetching logs from {description}...")
+    send_logs_to_admin(context.bot, user.id, hours, level=level, contains=contains, as_document=as_document)
+
+def log_level_command(update: Update, context: CallbackContext) -> None:
+    """Admin command to show or change logger levels at runtime."""
+    user = update.effective_user
+    
+    # Check if admin
+    if str(user.id) != str(config.get('admin_telegram_id')):
+        update.message.reply_text("⚠️ You don't have permission to use this command.")
+        return
+
+    # Usage: /loglevel [logger] [level] - e.g. /loglevel google_sheets debug
+    args = context.args
+    if args:
+        name = args[0] if len(args) > 1 else 'root'
+        level = logging.getLevelName(args[-1].upper())
+        if not isinstance(level, int) or name not in RUNTIME_LOGGERS:
+            update.message.reply_text(
+                f"Usage: <code>/loglevel [{'|'.join(RUNTIME_LOGGERS)}] [debug|info|warning|error]</code>",
+                parse_mode=ParseMode.HTML
+            )
+            return
+        set_log_level(name, level)
+        logging.info(f"Log level of {name} set to {logging.getLevelName(level)} by admin")
+
+    message = "<b>Log levels:</b>\n"
+    for name, level in get_log_levels().items():
+        message += f"<code>{name}</code>: {level}\n"
+    update.message.reply_text(message, parse_mode=ParseMode.HTML)
+
+
+def get_stats(update: Update, context: CallbackContext) -> None:
+    """Admin command to show handler latency and storage call metrics."""
+    user = update.effective_user
     
-    update.message.reply_text(f"Fetching logs from the last {hours} hours...")
-    send_logs_to_admin(context.bot, user.id, hours)
+    # Check if admin
+    if str(user.id) != str(config.get('admin_telegram_id')):
+        update.message.reply_text("⚠️ You don't have permission to use this command.")
+        return
+    
+    minutes = 15
+    if context.args and context.args[0].isdigit():
+        minutes = max(1, min(60, int(context.args[0])))
+    update.message.reply_text(format_stats(minutes), parse_mode=ParseMode.HTML)
 
 
 # Block user function
@@ -1310,7 +2082,7 @@ def block_user(update: Update, context: CallbackContext) -> None:
     # Get user ID to block
     try:
         user_id = int(context.args[0])
-        blocked_users.add(user_id)
+        block(user_id)
         update.message.reply_text(f"User {user_id} has been blocked.")
         
         # Try to notify the user they've been blocked
@@ -1339,7 +2111,7 @@ def unblock_user(update: Update, context: CallbackContext) -> None:
     try:
         user_id = int(context.args[0])
         if user_id in blocked_users:
-            blocked_users.remove(user_id)
+            unblock(user_id)
             update.message.reply_text(f"User {user_id} has been unblocked.")
             
             # Try to notify the user they've been unblocked
@@ -1412,9 +2184,149 @@ def reply_to_user(update: Update, context: CallbackContext) -> None:
         logger.error(f"Error in reply_to_user: {str(e)}")
 
 
-def main() -> None:
-    updater = Updater(config['telegram_bot_token'])
-    dispatcher = updater.dispatcher
+def count_update(update: Update, context: CallbackContext) -> None:
+    """Counts every incoming update for throughput metrics and revives chats that came back."""
+    metrics.incr('updates')
+    if update.effective_chat:
+        delivery_tracker.revive(update.effective_chat.id)
+
+def health_gauges():
+    """Values sampled on every /metrics scrape."""
+    hits = metrics.counters.get('cache_hits', 0)
+    misses = metrics.counters.get('cache_misses', 0)
+    return {
+        'attendio_cache_hit_ratio': ("Share of sheet reads served from the snapshot cache.", hits / (hits + misses) if hits + misses else 0.0),
+        'attendio_sheets_quota_tokens': ("Sheets API requests left in the current quota window.", round(google_sheets.quota.remaining(), 2)),
+        'attendio_outbox_queue_depth': ("Messages waiting in the outbound queue.", outbox.qsize()),
+        'attendio_admin_notifications_pending': ("Admin notifications waiting for the next send or digest.", admin_notifier.pending_count()),
+        'attendio_dead_chats': ("Chats skipped by bulk sends until their user interacts again.", delivery_tracker.dead_count()),
+        'attendio_callback_dedup_entries': ("Callback keys remembered for deduplication.", len(callback_dedup)),
+        'attendio_ready': ("1 once the storage snapshot is warm.", 1 if google_sheets.is_warm else 0),
+    }
+
+def trace_command(update: Update, context: CallbackContext) -> None:
+    """Admin command to inspect per-update traces and set the sampling rate."""
+    user = update.effective_user
+    
+    # Check if admin
+    if str(user.id) != str(config.get('admin_telegram_id')):
+        update.message.reply_text("⚠️ You don't have permission to use this command.")
+        return
+
+    args = context.args
+    if args and args[0] == 'sample':
+        try:
+            tracer.sample_rate = max(0.0, min(1.0, float(args[1])))
+            update.message.reply_text(f"Trace sampling set to {tracer.sample_rate:.0%}.")
+        except (IndexError, ValueError):
+            update.message.reply_text("Usage: <code>/trace sample [0-1]</code>", parse_mode=ParseMode.HTML)
+        return
+
+    if args and args[0].isdigit():
+        trace = tracer.get(int(args[0]))
+        if not trace:
+            update.message.reply_text(f"No trace recorded for update {args[0]}.")
+            return
+        update.message.reply_text(f"<pre>{html.escape(format_waterfall(trace))}</pre>", parse_mode=ParseMode.HTML)
+        return
+
+    traces = tracer.recent()
+    if not traces:
+        update.message.reply_text(
+            f"No traces recorded. Sampling is at {tracer.sample_rate:.0%}; enable it with <code>/trace sample 1</code>.",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    message = f"<b>Recent traces</b> (sampling {tracer.sample_rate:.0%}):\n"
+    for trace in reversed(traces):
+        message += f"<code>{trace.update_id}</code> {html.escape(trace.description)} {trace.duration * 1000:.0f}ms\n"
+    message += "\nUse <code>/trace [update_id]</code> to see the waterfall."
+    update.message.reply_text(message, parse_mode=ParseMode.HTML)
+
+def jobs_command(update: Update, context: CallbackContext) -> None:
+    """Admin command to list scheduled jobs and pause, resume or run them."""
+    user = update.effective_user
+    
+    # Check if admin
+    if str(user.id) != str(config.get('admin_telegram_id')):
+        update.message.reply_text("⚠️ You don't have permission to use this command.")
+        return
+
+    args = context.args
+    if args:
+        actions = {'pause': app_scheduler.pause, 'resume': app_scheduler.resume, 'run': app_scheduler.run_now}
+        if len(args) != 2 or args[0] not in actions:
+            update.message.reply_text("Usage: <code>/jobs [pause|resume|run] [job]</code>", parse_mode=ParseMode.HTML)
+            return
+        try:
+            actions[args[0]](args[1])
+        except KeyError:
+            update.message.reply_text(f"No job named {args[1]}.")
+            return
+        except Exception as e:
+            update.message.reply_text(f"❌ Error: {str(e)}")
+            return
+        logger.info(f"Admin {args[0]} job {args[1]}")
+        update.message.reply_text(f"✅ {args[0].capitalize()} {args[1]}.")
+        return
+
+    last_runs = app_scheduler.last_runs()
+    asia_tz = pytz.timezone('Asia/Kolkata')
+    message = "<b>Scheduled jobs (IST):</b>\n"
+    for job in app_scheduler.jobs():
+        next_run = job.next_run_time.astimezone(asia_tz).strftime('%a %d %b %H:%M') if job.next_run_time else "paused"
+        last_run = datetime.fromtimestamp(last_runs[job.id], asia_tz).strftime('%a %d %b %H:%M') if job.id in last_runs else "never"
+        message += f"\n<code>{job.id}</code> – {html.escape(job.name)}\n  next: {next_run}, last: {last_run}\n"
+    message += "\nUse <code>/jobs [pause|resume|run] [job]</code> to control a job."
+    update.message.reply_text(message, parse_mode=ParseMode.HTML)
+
+PROFILED_JOBS = ('reminders', 'daily_reports', 'weekly_reports')
+
+def profile_command(update: Update, context: CallbackContext) -> None:
+    """Admin command to cProfile the next N updates or the next run of a job."""
+    user = update.effective_user
+    
+    # Check if admin
+    if str(user.id) != str(config.get('admin_telegram_id')):
+        update.message.reply_text("⚠️ You don't have permission to use this command.")
+        return
+
+    args = context.args
+    usage = (
+        "Usage:\n<code>/profile [n]</code> - profile the next N updates (1-500)\n"
+        f"<code>/profile job [{'|'.join(PROFILED_JOBS)}]</code> - profile the next run of a job\n"
+        "<code>/profile off</code> - cancel"
+    )
+    if not args:
+        update.message.reply_text(usage, parse_mode=ParseMode.HTML)
+        return
+
+    if args[0] == 'off':
+        profiler.disarm()
+        update.message.reply_text("Profiler disarmed.")
+        return
+
+    if args[0] == 'job':
+        if len(args) < 2 or args[1] not in PROFILED_JOBS:
+            update.message.reply_text(usage, parse_mode=ParseMode.HTML)
+            return
+        profiler.arm(context.bot, update.effective_chat.id, job_name=args[1])
+        update.message.reply_text(f"🔬 Profiler armed for the next run of <code>{args[1]}</code>.", parse_mode=ParseMode.HTML)
+        return
+
+    try:
+        count = int(args[0])
+        if not 1 <= count <= 500:
+            raise ValueError
+    except ValueError:
+        update.message.reply_text(usage, parse_mode=ParseMode.HTML)
+        return
+    profiler.arm(context.bot, update.effective_chat.id, updates=count)
+    update.message.reply_text(f"🔬 Profiler armed for the next {count} updates.")
+
+def register_handlers(dispatcher) -> None:
+    """Adds every command, conversation and callback handler to the dispatcher."""
+    dispatcher.add_handler(TypeHandler(Update, count_update), group=-2)
 
     # Start handler needs to be a conversation handler now
     start_handler = ConversationHandler(
@@ -1460,6 +2372,16 @@ def main() -> None:
         fallbacks=[CommandHandler('cancel', cancel)],
     )
 
+    mark_all_handler = ConversationHandler(
+        entry_points=[CommandHandler('mark_all', rate_limit_decorator(mark_all_start))],
+        states={
+            MARK_ALL: [CallbackQueryHandler(mark_all_toggle, pattern='^ma_toggle:[0-9]+$'),
+                       CallbackQueryHandler(mark_all_submit, pattern='^ma_submit$'),
+                       CallbackQueryHandler(mark_all_cancel, pattern='^ma_cancel$')]
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+    )
+
     add_course_handler = ConversationHandler(
         entry_points=[CommandHandler('add_course', rate_limit_decorator(add_course_start))],
         states={
@@ -1505,6 +2427,7 @@ def main() -> None:
     )
 
     dispatcher.add_handler(mark_attendance_handler)
+    dispatcher.add_handler(mark_all_handler)
     dispatcher.add_handler(add_course_handler)
     dispatcher.add_handler(delete_course_handler)
     dispatcher.add_handler(edit_attendance_handler)
@@ -1513,6 +2436,18 @@ def main() -> None:
     dispatcher.add_handler(CommandHandler("get_chat_id", rate_limit_decorator(get_chat_id)))
     dispatcher.add_handler(CommandHandler("help", rate_limit_decorator(help_command)))
     dispatcher.add_handler(CommandHandler("manage_absences", rate_limit_decorator(manage_absences)))
+    dispatcher.add_handler(CommandHandler("plan_bunks", rate_limit_decorator(plan_bunks)))
+    dispatcher.add_handler(CommandHandler("set_threshold", rate_limit_decorator(threshold_command)))
+    dispatcher.add_handler(CommandHandler("add_class", rate_limit_decorator(add_class)))
+    dispatcher.add_handler(CommandHandler("remove_class", rate_limit_decorator(remove_class)))
+    dispatcher.add_handler(CommandHandler("timetable", rate_limit_decorator(show_timetable)))
+    dispatcher.add_handler(CommandHandler("create_class", rate_limit_decorator(create_class)))
+    dispatcher.add_handler(CommandHandler("join_class", rate_limit_decorator(join_class)))
+    dispatcher.add_handler(CommandHandler("mark_class", rate_limit_decorator(mark_class)))
+    dispatcher.add_handler(CommandHandler("classes", rate_limit_decorator(list_classes)))
+    dispatcher.add_handler(CommandHandler("leaderboard", rate_limit_decorator(show_leaderboard)))
+    dispatcher.add_handler(CallbackQueryHandler(reminder_response, pattern='^rm:.+:[01]$'), group=-1)
+    dispatcher.add_handler(CallbackQueryHandler(shared_override_response, pattern='^so:[^:]+:[0-9]{8}(:[0-9]+)?:[01]$'), group=-1)
     
     # Add these handlers in the main() function
     dispatcher.add_handler(CommandHandler("block", block_user))
@@ -1521,8 +2456,248 @@ def main() -> None:
     dispatcher.add_handler(announce_handler)
     dispatcher.add_handler(CommandHandler("logs", get_logs))
     dispatcher.add_handler(CommandHandler("send_reminders", send_reminders_command))
+    dispatcher.add_handler(CommandHandler("stats", get_stats))
+    dispatcher.add_handler(CommandHandler("trace", trace_command))
+    dispatcher.add_handler(CommandHandler("profile", profile_command))
+    dispatcher.add_handler(CommandHandler("loglevel", log_level_command))
+    dispatcher.add_handler(CommandHandler("jobs", jobs_command))
     # Add handler for invalid inputs - this should be the last handler
     dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_invalid_input))
+
+    # Record latency and errors of every handler callback
+    for handlers in dispatcher.handlers.values():
+        instrument_handlers(handlers, expected=(DispatcherHandlerStop,))
+
+def create_app(app_config=None, worker_index=0, worker_count=1):
+    """Builds the bot's components from `app_config` (or the environment) and returns the Updater.
+
+    Only connects to Google and sets up handlers and jobs; loading data is left to warm_up().
+    In multi-worker mode each worker gets its share of the Sheets and Telegram rate limits.
+    """
+    global config, updater, google_sheets, attendance_tracker, report_generator
+    global bunk_planner, outbox, admin_notifier, timetable_store, shared_courses, leaderboard, audience, archive
+    global reminder_wheel, snapshot_keeper, app_scheduler
+
+    config = app_config or load_config()
+    setup_logging(LOG_FILE if worker_count == 1 else f"attendio_bot.worker{worker_index}.log")
+    updater = create_updater(config['telegram_bot_token'])
+
+    google_sheets = GoogleSheets(config['google_sheets_credentials'], config['spreadsheet_id'], config, bot=updater.bot)
+    google_sheets.quota = QuotaBucket(max(1, SHEETS_QUOTA_PER_MINUTE // worker_count))
+    attendance_tracker = AttendanceTracker(google_sheets, config['attendance_threshold'])
+    report_generator = ReportGenerator(config['attendance_threshold'])
+    attendance_tracker.add_listener(report_generator.on_attendance_event)
+    bunk_planner = BunkPlanner(attendance_tracker)
+    outbox = Outbox(updater.bot, rate=25 / worker_count, delivery=delivery_tracker)
+    admin_notifier = AdminNotifier(updater.bot, config.get('admin_telegram_id'))
+    timetable_store = TimetableStore(google_sheets)
+    shared_courses = SharedCourseStore(google_sheets)
+    attendance_tracker.add_listener(shared_courses.on_attendance_event)
+    leaderboard = Leaderboard(track_course=shared_courses.is_shared)
+    attendance_tracker.add_listener(leaderboard.on_attendance_event)
+    audience = AudienceIndex(config['attendance_threshold'])
+    attendance_tracker.add_listener(audience.on_attendance_event)
+    archive = Archive(google_sheets)
+    reminder_wheel = ReminderWheel(outbox)
+    snapshot_keeper = SnapshotKeeper(google_sheets, operational_state)
+    restore_snapshot()
+
+    register_handlers(updater.dispatcher)
+    app_scheduler = AppScheduler()
+
+    return updater
+
+def operational_state():
+    """In-memory state that should survive a restart, as JSON-serializable values."""
+    return {
+        'blocked_users': sorted(blocked_users),
+        'command_history': {
+            str(user_id): [timestamp.timestamp() for timestamp in timestamps]
+            for user_id, timestamps in list(command_history.items()) if timestamps
+        },
+        'chat_delivery': delivery_tracker.state(),
+    }
+
+def restore_snapshot() -> None:
+    """Serves the sheet and operational state saved before the last restart until warm_up() revalidates it."""
+    snapshot = snapshot_keeper.load()
+    if snapshot is None:
+        return
+    created, headers, rows, state = snapshot
+    if google_sheets.restore_cache(headers, rows):
+        report_generator.seed(rows)
+        leaderboard.seed(rows)
+        audience.seed(rows)
+    blocked_users.update(state.get('blocked_users', []))
+    for user_id, timestamps in state.get('command_history', {}).items():
+        command_history[int(user_id)] = [datetime.fromtimestamp(timestamp) for timestamp in timestamps]
+    delivery_tracker.restore(state.get('chat_delivery', {}))
+    logger.info(f"Restored snapshot from {datetime.fromtimestamp(created).strftime('%Y-%m-%d %H:%M:%S')} "
+                f"with {len(rows)} rows and {len(blocked_users)} blocked users")
+
+def warm_up(start_reminders=True) -> None:
+    """Loads the sheet snapshot, report aggregates and timetable; runs alongside webhook setup."""
+    start = datetime.now()
+
+    # Replace rows restored from the local snapshot with live data
+    if not google_sheets.revalidated.is_set():
+        google_sheets.revalidate()
+
+    # Daily and weekly reports are built from in-memory aggregates seeded once here
+    try:
+        report_generator.seed(google_sheets.get_all_data())
+    except Exception as e:
+        logger.error(f"Failed to seed reports: {str(e)}")
+
+    # Shared class courses and their member index, then the leaderboard that ranks their members
+    try:
+        shared_courses.load(google_sheets.get_all_data())
+    except Exception as e:
+        logger.error(f"Failed to load shared courses: {str(e)}")
+    try:
+        leaderboard.seed(google_sheets.get_all_data())
+    except Exception as e:
+        logger.error(f"Failed to seed leaderboard: {str(e)}")
+
+    # Announcement segments
+    try:
+        audience.seed(google_sheets.get_all_data())
+    except Exception as e:
+        logger.error(f"Failed to seed audience index: {str(e)}")
+
+    # Ids of archived users, so their next /start restores them
+    try:
+        archive.load()
+    except Exception as e:
+        logger.error(f"Failed to load archive: {str(e)}")
+
+    # Per-user post-class prompts from the timetable
+    try:
+        if start_reminders:
+            # Archived users get no prompts until they come back
+            reminder_wheel.load(slot for slot in timetable_store.load() if not archive.is_archived(slot['User ID']))
+            reminder_wheel.start()
+    except Exception as e:
+        logger.error(f"Failed to start timetable reminders: {str(e)}")
+
+    logger.info(f"Warm-up finished in {(datetime.now() - start).total_seconds():.1f}s")
+
+def handle_event(event) -> None:
+    """Applies a state change published by another worker process."""
+    kind = event.get('type')
+    if kind == 'block':
+        blocked_users.add(event['user_id'])
+    elif kind == 'unblock':
+        blocked_users.discard(event['user_id'])
+    elif kind == 'sheet':
+        google_sheets.apply_write(event['op'], event['data'])
+    elif kind == 'attendance':
+        report_generator.on_attendance_event(event['event'], event['row'])
+        shared_courses.on_attendance_event(event['event'], event['row'])
+        leaderboard.on_attendance_event(event['event'], event['row'])
+        audience.on_attendance_event(event['event'], event['row'])
+    elif kind == 'shared_course':
+        shared_courses.add(event['course'])
+    elif kind == 'archive':
+        archive.mark(event['user_ids'])
+        for user_id in event['user_ids']:
+            audience.remove_user(user_id)
+        suspend_reminders(event['user_ids'])
+    elif kind == 'unarchive':
+        archive.mark(event['user_ids'], archived=False)
+        suspend_reminders(event['user_ids'], suspended=False)
+    elif kind == 'slot_add':
+        reminder_wheel.add(event['slot'])
+    elif kind == 'slot_remove':
+        reminder_wheel.remove(event['slot'])
+    elif kind == 'chat_delivery':
+        delivery_tracker.mark(event['chat_id'], event['dead'])
+    elif kind == 'admin_notify':
+        if admin_notifier.forward is None:
+            admin_notifier.notify(event['kind'], event['text'], urgent=event['urgent'])
+
+def worker_status():
+    """Readiness and metrics of this worker, reported to the front for its /readyz and /metrics."""
+    return {'ready': google_sheets.is_warm, 'metrics': render_prometheus(health_gauges())}
+
+def run_worker(index, count, app_config, inbox, hub, row_lock) -> None:
+    """Runs one worker process of multi-worker mode; worker 0 also owns the scheduled jobs."""
+    global event_bus
+    updater = create_app(app_config, worker_index=index, worker_count=count)
+    event_bus = create_bus(index, hub, row_lock)
+    event_bus.start(handle_event)
+    google_sheets.row_lock = event_bus.row_lock
+    google_sheets.on_write = lambda op, data: publish({'type': 'sheet', 'op': op, 'data': data})
+    attendance_tracker.add_listener(lambda event, row: publish({'type': 'attendance', 'event': event, 'row': row}))
+    delivery_tracker.on_change = lambda chat_id, dead: publish({'type': 'chat_delivery', 'chat_id': chat_id, 'dead': dead})
+    if index != 0:
+        # Worker 0 builds the one admin digest and sends the urgent notifications
+        admin_notifier.forward = lambda kind, text, urgent: publish(
+            {'type': 'admin_notify', 'kind': kind, 'text': text, 'urgent': urgent}
+        )
+
+    outbox.start()
+    admin_notifier.start()
+    if index == 0:
+        snapshot_keeper.start()
+        try:
+            app_scheduler.start(scheduled_jobs())
+        except Exception as e:
+            logger.error(f"Failed to start scheduler: {str(e)}")
+    warm_up(start_reminders=index == 0)
+
+    threading.Thread(target=updater.dispatcher.start, name='dispatcher', daemon=True).start()
+    status_stop = threading.Event()
+    threading.Thread(
+        target=report_status, args=(index, hub, worker_status, status_stop), name='worker-status', daemon=True
+    ).start()
+    logger.info(f"Worker {index} of {count} ready")
+    serve_inbox(inbox, event_bus, updater.dispatcher, updater.bot)
+
+    status_stop.set()
+    updater.dispatcher.stop()
+    outbox.stop()
+    admin_notifier.stop()
+    if index == 0:
+        app_scheduler.shutdown()
+        snapshot_keeper.stop()
+
+def run_front(count) -> None:
+    """Runs the front process of multi-worker mode, which only routes updates to the workers."""
+    app_config = load_config()
+    setup_logging()
+    front = Front(app_config, count)
+    front.start()
+    bot = telegram.Bot(app_config['telegram_bot_token'])
+    try:
+        if os.getenv("RAILWAY_STATIC_URL"):
+            url_path = "bot" + app_config['telegram_bot_token']
+            front.serve_webhook(bot, int(os.getenv('PORT', '8080')), url_path, os.getenv('RAILWAY_STATIC_URL') + "/" + url_path)
+        else:
+            front.serve_polling(bot)
+    finally:
+        front.stop()
+
+def main() -> None:
+    # WORKERS > 1 shards users over that many processes behind a routing front process
+    worker_count = int(os.getenv("WORKERS", "1") or 1)
+    if worker_count > 1:
+        run_front(worker_count)
+        return
+
+    updater = create_app()
+    outbox.start()
+    admin_notifier.start()
+    snapshot_keeper.start()
+
+    # Reminders, reports and log delivery all run on the one persistent scheduler
+    try:
+        app_scheduler.start(scheduled_jobs())
+    except Exception as e:
+        logger.error(f"Failed to start scheduler: {str(e)}")
+
+    # Fetch data while the webhook is being registered instead of before it
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
     
     #try:
         # asia_tz = pytz.timezone('Asia/Kolkata')
@@ -1584,6 +2759,7 @@ def main() -> None:
             webhook_url=WEBHOOK_URL
         )
         print(f"Webhook set up on {WEBHOOK_URL}")
+        attach_health_endpoints(updater, lambda: google_sheets.is_warm, health_gauges)
     else:
         # Local development - use polling
         print("Starting bot with polling")
@@ -1592,6 +2768,9 @@ def main() -> None:
         
     # Only need one idle() call
     updater.idle()
+    app_scheduler.shutdown()
+    snapshot_keeper.stop()
+    admin_notifier.stop()
 
 # Remove the duplicate start_polling and idle calls
 
@@ -0,0 +1,76 @@
+import math
+import threading
+from thresholds import course_threshold
+
+
+def max_skips(present, absent, upcoming, threshold):
+    """Largest number of the upcoming classes that can be skipped while staying at or above threshold.
+
+    Skipping k of u classes leaves (p + u - k) / (p + a + u) >= t / 100, so
+    k <= p + u - t * (p + a + u) / 100.
+    """
+    limit = present + upcoming - threshold * (present + absent + upcoming) / 100
+    # Guard against float noise for thresholds like 75.0 that land exactly on an integer
+    return max(0, min(upcoming, math.floor(limit + 1e-9)))
+
+
+class BunkPlanner:
+    """Plans how many upcoming classes of each course a user can skip.
+
+    Each course's threshold constraint only depends on its own counters, so taking
+    the maximum for every course independently yields the largest skip set. The
+    latest plan of each user is cached and dropped whenever the tracker reports
+    a change.
+    """
+    def __init__(self, attendance_tracker):
+        self.attendance_tracker = attendance_tracker
+        self.cache = {}  # user id -> (request key, plan)
+        self.lock = threading.Lock()
+        attendance_tracker.add_listener(self.on_attendance_event)
+
+    def on_attendance_event(self, event, row):
+        with self.lock:
+            self.cache.pop(str(row.get('User ID', '')).strip(), None)
+
+    def plan(self, user_id, upcoming):
+        """Returns (plan, unknown) for a dict of course nickname -> upcoming class count.
+
+        `plan` lists one entry per matched course and `unknown` the nicknames that
+        did not match any of the user's courses.
+        """
+        user_key = str(user_id).strip()
+        request_key = tuple(sorted((nickname.lower(), count) for nickname, count in upcoming.items()))
+        with self.lock:
+            cached = self.cache.get(user_key)
+        if cached is not None and cached[0] == request_key:
+            return cached[1]
+
+        courses = {
+            str(course['Course Nickname']).strip().lower(): course
+            for course in self.attendance_tracker.get_user_courses(user_id)
+        }
+        default_threshold = self.attendance_tracker.attendance_threshold
+        plan = []
+        unknown = []
+        for nickname, count in upcoming.items():
+            course = courses.get(nickname.strip().lower())
+            if course is None:
+                unknown.append(nickname)
+                continue
+            present = int(course.get('Present', 0) or 0)
+            absent = int(course.get('Absent', 0) or 0)
+            threshold = course_threshold(course, default_threshold)
+            skippable = max_skips(present, absent, count, threshold)
+            total = present + absent + count
+            plan.append({
+                'Course Nickname': course['Course Nickname'],
+                'Upcoming': count,
+                'Skippable': skippable,
+                'Threshold': threshold,
+                'Attendance After': ((present + count - skippable) / total) * 100 if total > 0 else 100.0,
+            })
+
+        result = (plan, unknown)
+        with self.lock:
+            self.cache[user_key] = (request_key, result)
+        return result
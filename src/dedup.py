@@ -0,0 +1,40 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CallbackDeduplicator:
+    """Remembers recently handled callback keys for `ttl` seconds, holding at most `max_entries`.
+
+    Entries are kept in insertion order, which with a fixed TTL is also expiry
+    order, so expired keys are dropped from the front and the oldest ones are
+    evicted first when the cache is full.
+    """
+    def __init__(self, ttl=120.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _purge(self, now):
+        while self.entries:
+            key, expires = next(iter(self.entries.items()))
+            if expires > now:
+                break
+            self.entries.popitem(last=False)
+
+    def first(self, *keys):
+        """Returns True and remembers the keys unless any of them was seen within the TTL."""
+        now = time.monotonic()
+        with self.lock:
+            self._purge(now)
+            if any(key in self.entries for key in keys):
+                return False
+            for key in keys:
+                self.entries[key] = now + self.ttl
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+from telegram.error import BadRequest, Unauthorized
+
+logger = logging.getLogger(__name__)
+
+# BadRequest messages meaning the chat will not accept messages until the user comes back
+PERMANENT_BAD_REQUESTS = ('chat not found', 'user is deactivated', 'bot was blocked', 'bot was kicked', 'peer_id_invalid')
+
+SENT, SKIPPED, FAILED = 'sent', 'skipped', 'failed'
+
+
+def is_permanent(error):
+    """True for errors that will repeat on every send to the chat, like a user blocking the bot."""
+    if isinstance(error, Unauthorized):
+        return True
+    if isinstance(error, BadRequest):
+        message = str(error).lower()
+        return any(reason in message for reason in PERMANENT_BAD_REQUESTS)
+    return False
+
+
+class ChatStatus:
+    __slots__ = ('failures', 'last_error', 'last_failure', 'dead')
+
+    def __init__(self, failures=0, last_error='', last_failure=0.0, dead=False):
+        self.failures = failures
+        self.last_error = last_error
+        self.last_failure = last_failure
+        self.dead = dead
+
+
+class DeliveryTracker:
+    """Per-chat delivery outcomes of bulk sends.
+
+    Chats that failed permanently are skipped by send() until revive() is called
+    because the user interacted with the bot again. Only chats that have failed
+    are tracked, so memory grows with problem chats rather than with all users.
+    """
+    def __init__(self):
+        self.chats = {}
+        self.lock = threading.Lock()
+        self.on_change = None  # Called with (chat_id, dead) when a chat is marked dead or revived
+
+    def is_dead(self, chat_id):
+        status = self.chats.get(str(chat_id))
+        return status is not None and status.dead
+
+    def record_success(self, chat_id):
+        if str(chat_id) in self.chats:
+            with self.lock:
+                self.chats.pop(str(chat_id), None)
+
+    def record_failure(self, chat_id, error):
+        """Records a failed send; returns True if the chat is now considered dead."""
+        with self.lock:
+            status = self.chats.setdefault(str(chat_id), ChatStatus())
+            status.failures += 1
+            status.last_error = str(error)[:200]
+            status.last_failure = time.time()
+            newly_dead = is_permanent(error) and not status.dead
+            status.dead = status.dead or newly_dead
+        if newly_dead:
+            logger.info(f"Chat {chat_id} stopped accepting messages ({error}); skipping it in bulk sends")
+            self._notify(chat_id, True)
+        return status.dead
+
+    def revive(self, chat_id):
+        """Forgets the failures of a chat whose user interacted with the bot again."""
+        if str(chat_id) not in self.chats:
+            return
+        with self.lock:
+            status = self.chats.pop(str(chat_id), None)
+        if status is not None and status.dead:
+            logger.info(f"Chat {chat_id} is active again; including it in bulk sends")
+            self._notify(chat_id, False)
+
+    def mark(self, chat_id, dead):
+        """Applies a dead/revived state decided elsewhere, e.g. by another worker process."""
+        with self.lock:
+            if dead:
+                self.chats.setdefault(str(chat_id), ChatStatus()).dead = True
+            else:
+                self.chats.pop(str(chat_id), None)
+
+    def _notify(self, chat_id, dead):
+        if self.on_change is not None:
+            try:
+                self.on_change(chat_id, dead)
+            except Exception as e:
+                logger.error(f"Error publishing delivery state of chat {chat_id}: {e}")
+
+    def send(self, bot, chat_id, text, **kwargs):
+        """Sends a bulk message unless the chat is dead; returns SENT, SKIPPED or FAILED."""
+        if self.is_dead(chat_id):
+            return SKIPPED
+        try:
+            bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except Exception as e:
+            self.record_failure(chat_id, e)
+            logger.warning(f"Error sending to chat {chat_id}: {e}")
+            return FAILED
+        self.record_success(chat_id)
+        return SENT
+
+    def dead_count(self):
+        return sum(1 for status in list(self.chats.values()) if status.dead)
+
+    def state(self):
+        with self.lock:
+            return {
+                chat_id: [status.failures, status.last_error, status.last_failure, status.dead]
+                for chat_id, status in self.chats.items()
+            }
+
+    def restore(self, state):
+        with self.lock:
+            for chat_id, values in state.items():
+                self.chats[chat_id] = ChatStatus(*values)
@@ -1,14 +1,88 @@
 import gspread
+from gspread.utils import numericise_all, rowcol_to_a1
 from google.oauth2.service_account import Credentials
-import pandas as pd
 import logging
+import threading
+import time
+from contextlib import contextmanager
+from itertools import zip_longest
 import telegram
+from metrics import metrics
+from sheet_cache import SheetCache, row_key
+from tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+# Sheets API allows 60 requests per minute per user; the cache absorbs repeated reads
+SHEETS_QUOTA_PER_MINUTE = 60
+ROW_LOCK_TIMEOUT = 60  # Seconds to wait for the row lock before failing a write
+WRITE_REQUESTS = 2  # Requests a positional write makes under the row lock: the row lookup and the write
+
+class QuotaBucket:
+    """Token bucket mirroring the Sheets per-minute request quota.
+
+    Each HTTP request takes a token; when the bucket is empty the caller waits
+    for the next refill instead of getting a 429 from Google. Tokens taken
+    ahead with reserved() are spent first by the same thread's requests.
+    """
+    def __init__(self, capacity=SHEETS_QUOTA_PER_MINUTE, period=60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+        self.prepaid = threading.local()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def remaining(self):
+        with self.lock:
+            self._refill()
+            return self.tokens
+
+    def _take(self, count):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                wait = (count - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def acquire(self):
+        prepaid = getattr(self.prepaid, 'value', 0)
+        if prepaid > 0:
+            self.prepaid.value = prepaid - 1
+            return
+        self._take(1)
+
+    @contextmanager
+    def reserved(self, count):
+        """Takes `count` tokens up front for the requests this thread makes in the block.
+
+        Used to wait for quota before taking the row lock rather than while
+        holding it. Tokens left unused are returned on exit.
+        """
+        count = min(count, self.capacity)
+        self._take(count)
+        before = getattr(self.prepaid, 'value', 0)
+        self.prepaid.value = before + count
+        try:
+            yield
+        finally:
+            unused = min(count, max(0, self.prepaid.value - before))
+            self.prepaid.value -= unused
+            with self.lock:
+                self._refill()
+                self.tokens = min(self.capacity, self.tokens + unused)
+
 class GoogleSheets:
-    def __init__(self, credentials_dict, spreadsheet_id, config):
-        """Initializes the Google Sheets connection."""
+    def __init__(self, credentials_dict, spreadsheet_id, config, bot=None):
+        """Initializes the Google Sheets connection, reusing `bot` for messages when given."""
         try:
             # Load credentials from the provided dictionary
             self.credentials = Credentials.from_service_account_info(
@@ -20,106 +94,408 @@ class GoogleSheets:
             )
             
             self.client = gspread.authorize(self.credentials)
+            self.client.session.hooks['response'].append(metrics.response_hook)
+            self.quota = QuotaBucket()
+            self._wrap_session_requests()
+            self.cache = SheetCache()  # Records of sheet1, kept in sync with our own writes
+            # Cleared while the cache holds rows restored from a local snapshot that Sheets has not confirmed yet
+            self.revalidated = threading.Event()
+            self.revalidated.set()
+            self.on_write = None  # Called with (op, data) after each write; used to keep other workers' caches in sync
+            # Held from locating rows to writing them; replaced by a lock shared between processes in multi-worker mode
+            self.row_lock = threading.RLock()
+            self.row_lock_depth = threading.local()
             self.spreadsheet = self.client.open_by_key(spreadsheet_id)
             self.sheet = self.spreadsheet.sheet1  # Or use a specific sheet name
             self.headers = self.get_headers()
             self.config = config  # Store the config
-            self.bot = telegram.Bot(token=config['telegram_bot_token'])  # Initialize the bot
-            print("Google Sheets connection initialized successfully.")
+            self.bot = bot or telegram.Bot(token=config['telegram_bot_token'])
+            logger.info("Google Sheets connection initialized successfully.")
         
         except Exception as e:
-            print(f"Error initializing Google Sheets: {e}")
+            logger.error("Error initializing Google Sheets: %s", e)
             raise
 
 
+    def _wrap_session_requests(self):
+        """Makes every HTTP request to Google take a quota token first."""
+        session = self.client.session
+        request = session.request
+
+        def request_with_quota(method, url, *args, **kwargs):
+            span = tracer.begin(f"sheets.http.{method}")
+            error = True
+            try:
+                self.quota.acquire()
+                response = request(method, url, *args, **kwargs)
+                error = False
+                return response
+            finally:
+                tracer.end(span, error)
+        session.request = request_with_quota
+
+    @property
+    def is_warm(self):
+        """True once the cache has been filled, from Sheets or a local snapshot; never cleared afterwards."""
+        return self.cache.warmed.is_set()
+
+    def restore_cache(self, headers, rows):
+        """Serves rows from a local snapshot until revalidate() replaces them with live data."""
+        if headers != self.headers:
+            logger.warning("Snapshot headers differ from the sheet; not restoring it")
+            return False
+        self.cache.install(rows, self.cache.begin_load())
+        self.revalidated.clear()
+        return True
+
+    @metrics.sheets_call
+    def revalidate(self):
+        """Replaces the cache with a fresh copy of the sheet, reporting rows that changed."""
+        version = self.cache.begin_load()
+        try:
+            records = self.sheet.get_all_records()
+        except Exception as e:
+            logger.error("Error revalidating snapshot: %s", e)
+            self.invalidate_cache()
+            self.revalidated.set()
+            return
+        previous = self.cache.snapshot() or []
+        if not self.cache.install(records, version):
+            # A write was mirrored into the snapshot rows meanwhile; let the next read fetch again
+            self.invalidate_cache()
+        self.revalidated.set()
+        changed = sum(1 for old, new in zip(previous, records) if old != new) + abs(len(previous) - len(records))
+        logger.info("Snapshot revalidated against Sheets: %d of %d rows changed", changed, len(records))
+
+    def invalidate_cache(self):
+        self.cache.invalidate()
+
+    @contextmanager
+    def locked(self):
+        """Holds the row lock, which every write addressing rows by position must hold.
+
+        The lock is shared by all worker processes in multi-worker mode and is
+        reentrant within a thread. Raises TimeoutError if it can't be taken.
+        """
+        depth = getattr(self.row_lock_depth, 'value', 0)
+        if depth == 0 and not self.row_lock.acquire(timeout=ROW_LOCK_TIMEOUT):
+            raise TimeoutError("Timed out waiting for the sheet row lock")
+        self.row_lock_depth.value = depth + 1
+        try:
+            yield
+        finally:
+            self.row_lock_depth.value = depth
+            if depth == 0:
+                self.row_lock.release()
+
+    @contextmanager
+    def rows_for_write(self, user_ids=None, course_code=None, requests=WRITE_REQUESTS):
+        """Holds the row lock and yields {row index: row} for the rows being written.
+
+        The rows are those of the given users and/or course, looked up in the
+        sheet under the lock with find_rows(). Rows can't move while the lock is
+        held, so the yielded positions stay valid for writes made inside the
+        block. Quota for `requests` requests is taken before the lock, so a
+        worker waiting for its share of the quota doesn't hold up the others.
+
+        Writes that address rows by position are still serialized across all
+        workers. Each holds the lock for about two small requests, so the
+        ceiling is the Sheets quota: 60 requests per minute shared by all
+        workers, i.e. about 30 positional writes per minute in total.
+        """
+        with self.quota.reserved(requests), self.locked():
+            yield self.find_rows(user_ids, course_code)
+
+    def _column_letter(self, column_index):
+        return rowcol_to_a1(1, column_index)[:-1]
+
+    def _row_range(self, row_index):
+        return f"A{row_index}:{self._column_letter(len(self.headers))}{row_index}"
+
+    def _record(self, values):
+        values = (list(values) + [''] * len(self.headers))[:len(self.headers)]
+        return dict(zip(self.headers, numericise_all(values)))
+
+    @metrics.sheets_call
+    def find_rows(self, user_ids=None, course_code=None):
+        """Returns {row index: row} for the rows of the given users and/or course.
+
+        Reads only the User ID and Course Code columns, together with the rows
+        the cache places at the matching positions, in one request. The rows
+        are read again only if the cache had them elsewhere. Rows are parsed
+        as get_all_records() does. Callers hold the row lock.
+        """
+        if user_ids is not None:
+            user_ids = {str(user_id).strip() for user_id in user_ids}
+        if course_code is not None:
+            course_code = str(course_code).strip()
+
+        def wanted(key):
+            return (user_ids is None or key[0] in user_ids) and (course_code is None or key[1] == course_code)
+
+        guess = [i + 2 for i, row in enumerate(self.cache.snapshot() or []) if wanted(row_key(row))]
+        key_ranges = []
+        for name in ('User ID', 'Course Code'):
+            column = self._column_letter(self.headers.index(name) + 1)
+            key_ranges.append(f"{column}2:{column}")
+        try:
+            results = self.sheet.batch_get(key_ranges + [self._row_range(i) for i in guess])
+            # Trailing empty cells and rows are left out of the response
+            user_column, course_column = ([cells[0] if cells else '' for cells in result] for result in results[:2])
+            positions = [
+                i + 2 for i, key in enumerate(zip_longest(user_column, course_column, fillvalue=''))
+                if wanted(row_key(dict(zip(('User ID', 'Course Code'), numericise_all(list(key))))))
+            ]
+            if positions == guess:
+                values = [result[0] if result else [] for result in results[2:]]
+            elif positions:
+                values = [result[0] if result else [] for result in self.sheet.batch_get([self._row_range(i) for i in positions])]
+            else:
+                values = []
+            return {row_index: self._record(row_values) for row_index, row_values in zip(positions, values)}
+        except Exception as e:
+            logger.error("Error finding rows: %s", e)
+            raise
+
+    def apply_write(self, op, data):
+        """Mirrors a write into the cache; see SheetCache.apply() for the ops."""
+        self.cache.apply(op, data, self.headers)
+
+    def _record_write(self, op, data):
+        self.apply_write(op, data)
+        if self.on_write is not None:
+            try:
+                self.on_write(op, data)
+            except Exception as e:
+                logger.error("Error publishing %s write: %s", op, e)
+
+    @metrics.sheets_call
     def get_headers(self):
         """Retrieves the headers from the Google Sheet."""
         try:
             headers = self.sheet.row_values(1)
             return headers
         except Exception as e:
-            print(f"Error getting headers: {e}")
+            logger.error("Error getting headers: %s", e)
             raise
 
+    @metrics.sheets_call
+    def ensure_column(self, column_name):
+        """Adds a header column to the Google Sheet if it does not exist yet."""
+        if column_name in self.headers:
+            return
+        try:
+            col_index = len(self.headers) + 1
+            if col_index > self.sheet.col_count:
+                self.sheet.add_cols(col_index - self.sheet.col_count)
+            self.sheet.update_cell(1, col_index, column_name)
+            self.headers.append(column_name)
+            self.cache.add_column(column_name)
+            logger.info("Column '%s' added to headers.", column_name)
+        except Exception as e:
+            logger.error("Error adding column '%s': %s", column_name, e)
+
+    @metrics.sheets_call
+    def get_or_create_worksheet(self, title, headers):
+        """Returns the worksheet with the given title, creating it with headers if missing."""
+        try:
+            return self.spreadsheet.worksheet(title)
+        except gspread.exceptions.WorksheetNotFound:
+            worksheet = self.spreadsheet.add_worksheet(title=title, rows=1000, cols=len(headers))
+            worksheet.append_row(headers)
+            logger.info("Worksheet '%s' created.", title)
+            return worksheet
+
+    @metrics.sheets_call
     def get_attendance_data(self):
         try:
             return self.sheet.get_all_records()
         except Exception as e:
-            logger.error(f"Error getting attendance data: {e}")
+            logger.error("Error getting attendance data: %s", e)
             return []
 
+    @metrics.sheets_call
     def read_data(self):
+        import pandas as pd  # Only this method needs pandas; keep it out of start-up
         try:
             values = self.sheet.get_all_values()
             return pd.DataFrame(values[1:], columns=values[0]) if values else pd.DataFrame()
         except Exception as e:
-            logger.error(f"Error reading data: {e}")
+            logger.error("Error reading data: %s", e)
             return pd.DataFrame()
 
+    @metrics.sheets_call
     def write_data(self, data):
         try:
             self.sheet.clear()
             self.sheet.update([data.columns.values.tolist()] + data.values.tolist())
+            self.invalidate_cache()
         except Exception as e:
-            logger.error(f"Error writing data: {e}")
+            logger.error("Error writing data: %s", e)
 
+    @metrics.sheets_call
     def append_row(self, data):
         """Appends a row to the Google Sheet."""
         try:
-            # Get the next available row
-            next_row = len(self.sheet.get_all_values()) + 1
             # Prepare the values to be written
             values = [data.get(col) for col in self.headers]  # Use self.headers
 
             # Write the values to the next row
             self.sheet.append_row(values)
-            print(f"Row appended successfully: {values}")
+            self._record_write('append', values)
+            logger.debug("Row appended successfully (%d values)", len(values))
         except Exception as e:
-            print(f"Error appending row: {e}")
+            logger.error("Error appending row: %s", e)
+
+    @metrics.sheets_call
+    def get_all_data(self, fresh=False):
+        """Retrieves all data from the Google Sheet.
 
-    def get_all_data(self):
-        """Retrieves all data from the Google Sheet."""
+        Served from the in-memory snapshot while it is younger than the cache TTL.
+        The returned row dicts are shared with the cache and must not be modified.
+        fresh=True always reads the sheet and raises if it can't. Writes that
+        address rows by position find them with rows_for_write() instead.
+        """
+        if not fresh:
+            rows = self.cache.get()
+            if rows is not None:
+                metrics.incr('cache_hits')
+                return rows
+            metrics.incr('cache_misses')
         try:
+            version = self.cache.begin_load()
             list_of_dicts = self.sheet.get_all_records()
-            return list_of_dicts
+            # Not cached if a write was mirrored during the read; the next read fetches again
+            if self.cache.install(list_of_dicts, version):
+                self.revalidated.set()
+            return list(list_of_dicts)
         except Exception as e:
-            print(f"Error getting all data: {e}")
+            logger.error("Error getting all data: %s", e)
             raise
 
-    def update_cell(self, row_index, column_name, value):
-        """Updates a single cell in the Google Sheet."""
+    @metrics.sheets_call
+    def update_cell(self, row_index, column_name, value, row=None):
+        """Updates a single cell in the Google Sheet; `row` is the row being written, for the cache."""
         try:
             col_index = self.headers.index(column_name) + 1  # Column index is 1-based
             self.sheet.update_cell(row_index, col_index, value)
-            print(f"Cell updated at row {row_index}, column {column_name} with value {value}")
+            if row is None:
+                self.invalidate_cache()
+            else:
+                self._record_write('set', [[row_key(row), {column_name: value}]])
+            logger.debug("Cell updated at row %d, column %s", row_index, column_name)
         except ValueError as e:
-            print(f"Column name '{column_name}' not found in headers.")
+            logger.error("Column name '%s' not found in headers.", column_name)
             raise e
         except Exception as e:
-            print(f"Error updating cell: {e}")
+            logger.error("Error updating cell: %s", e)
+
+    @metrics.sheets_call
+    def update_rows(self, rows, column_names):
+        """Writes the given columns of several rows with a single batched request.
+
+        `rows` maps 1-based row index -> row dict. Each row is written as one range
+        spanning the first to the last of the columns, taking values from the dict.
+        """
+        try:
+            col_indexes = [self.headers.index(name) + 1 for name in column_names]
+        except ValueError:
+            logger.error("Column names %s not all found in headers.", column_names)
+            raise
+        first_col, last_col = min(col_indexes), max(col_indexes)
+        span = self.headers[first_col - 1:last_col]
+        data = [
+            {
+                'range': f"{rowcol_to_a1(row_index, first_col)}:{rowcol_to_a1(row_index, last_col)}",
+                'values': [[row.get(name, '') for name in span]],
+            }
+            for row_index, row in rows.items()
+        ]
+        try:
+            self.sheet.batch_update(data, value_input_option='USER_ENTERED')
+            self._record_write('set', [
+                [row_key(row), {name: row.get(name, '') for name in span}] for row in rows.values()
+            ])
+            logger.debug("Updated %d rows, columns %s", len(data), span)
+        except Exception as e:
+            logger.error("Error updating rows: %s", e)
+            raise
+
+    def update_row(self, row_index, row, column_names):
+        """Writes the given columns of one row with a single request."""
+        self.update_rows({row_index: row}, column_names)
 
     def send_message(self, user_id, text, parse_mode=None):
         """Sends a message to a Telegram user."""
         try:
             self.bot.send_message(user_id, text=text, parse_mode=parse_mode)
-            print(f"Message sent to chat ID {user_id}: {text}")
+            logger.debug("Message sent to chat ID %s", user_id)
         except Exception as e:
-            print(f"Error sending message to chat ID {chat_id}: {e}")
+            logger.error("Error sending message to chat ID %s: %s", user_id, e)
 
+    @metrics.sheets_call
     def add_row(self, row_data):
         """Adds a new row to the Google Sheet."""
         try:
             self.sheet.append_row(row_data)
-            print(f"New row added: {row_data}")
+            self._record_write('append', list(row_data))
+            logger.debug("New row added (%d values)", len(row_data))
+        except Exception as e:
+            logger.error("Error adding row: %s", e)
+            raise
+
+    @metrics.sheets_call
+    def add_rows(self, rows_data):
+        """Appends several rows with a single request."""
+        try:
+            self.sheet.append_rows(rows_data)
+            for row_data in rows_data:
+                self._record_write('append', list(row_data))
+            logger.debug("%d rows added", len(rows_data))
+        except Exception as e:
+            logger.error("Error adding rows: %s", e)
+            raise
+
+    @metrics.sheets_call
+    def delete_rows(self, rows):
+        """Deletes several rows with a single batched request.
+
+        `rows` maps 1-based row index -> row dict. Runs of adjacent rows become one
+        range each, sent bottom-up so earlier deletions don't shift the rows of
+        later ones.
+        """
+        ranges = []
+        for row_index in sorted(rows, reverse=True):
+            if ranges and ranges[-1][0] == row_index + 1:
+                ranges[-1][0] = row_index
+            else:
+                ranges.append([row_index, row_index])
+        requests = [
+            {'deleteDimension': {'range': {
+                'sheetId': self.sheet.id, 'dimension': 'ROWS', 'startIndex': first - 1, 'endIndex': last,
+            }}}
+            for first, last in ranges
+        ]
+        if not requests:
+            return
+        try:
+            self.spreadsheet.batch_update({'requests': requests})
+            self._record_write('delete_rows', [row_key(row) for row in rows.values()])
+            logger.debug("%d rows deleted in %d ranges", len(rows), len(ranges))
         except Exception as e:
-            print(f"Error adding row: {e}")
+            logger.error("Error deleting rows: %s", e)
             raise
 
-    def delete_row(self, row_index):
-        """Deletes a row from the Google Sheet."""
+    @metrics.sheets_call
+    def delete_row(self, row_index, row=None):
+        """Deletes a row from the Google Sheet; `row` is the row being deleted, for the cache."""
         try:
             self.sheet.delete_rows(row_index)
-            print(f"Row deleted at index {row_index}")
+            if row is None:
+                self.invalidate_cache()
+            else:
+                self._record_write('delete', row_key(row))
+            logger.debug("Row deleted at index %d", row_index)
         except Exception as e:
-            print(f"Error deleting row: {e}")
+            logger.error("Error deleting row: %s", e)
             raise
@@ -0,0 +1,50 @@
+import logging
+import tornado.web
+from metrics import render_prometheus
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, gauges):
+        self.gauges = gauges
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(render_prometheus(self.gauges()))
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write({'status': 'ok'})
+
+
+class ReadyHandler(tornado.web.RequestHandler):
+    def initialize(self, ready_check):
+        self.ready_check = ready_check
+
+    def get(self):
+        if self.ready_check():
+            self.write({'status': 'ready'})
+        else:
+            self.set_status(503)
+            self.write({'status': 'warming up'})
+
+
+def attach_health_endpoints(updater, ready_check, gauges):
+    """Serves /metrics, /healthz and /readyz from the webhook server started by `updater`.
+
+    `ready_check` returns True once the bot can answer correctly, and `gauges`
+    returns {name: (help, value)} sampled on every scrape.
+    """
+    if updater.httpd is None:
+        logger.warning("Webhook server not running; health endpoints not attached")
+        return False
+    app = updater.httpd.http_server.request_callback
+    app.add_handlers(r".*", [
+        (r"/metrics", MetricsHandler, {'gauges': gauges}),
+        (r"/healthz", HealthHandler),
+        (r"/readyz", ReadyHandler, {'ready_check': ready_check}),
+    ])
+    logger.info("Health endpoints available at /metrics, /healthz and /readyz")
+    return True
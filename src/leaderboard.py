@@ -0,0 +1,236 @@
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Attendance rankings only include users with at least this many classes held
+MIN_CLASSES_FOR_ATTENDANCE = 5
+RANKING_BLOCK_SIZE = 256  # Keys per block of a Ranking
+
+
+def as_int(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class Ranking:
+    """Scores kept in descending order so the top k is a slice and a rank is a binary search.
+
+    Keys are (-score, entry id) tuples held in sorted blocks of up to twice
+    `block_size` keys, with the last key of each block kept alongside for
+    bisecting. Changing a score bisects the block index and then one block, so
+    removing the old key and inserting the new one each shift at most one
+    block rather than the whole list. A rank also sums the sizes of the blocks
+    before the entry's block.
+    """
+    def __init__(self, block_size=RANKING_BLOCK_SIZE):
+        self.block_size = block_size
+        self.blocks = []
+        self.maxes = []
+        self.scores = {}
+
+    def __len__(self):
+        return len(self.scores)
+
+    def load(self, scores):
+        """Replaces all entries at once; cheaper than inserting them one by one."""
+        self.scores = dict(scores)
+        keys = sorted((-score, entry_id) for entry_id, score in self.scores.items())
+        self.blocks = [keys[i:i + self.block_size] for i in range(0, len(keys), self.block_size)]
+        self.maxes = [block[-1] for block in self.blocks]
+
+    def update(self, entry_id, score):
+        old = self.scores.get(entry_id)
+        if old == score:
+            return
+        if old is not None:
+            self._discard((-old, entry_id))
+        self.scores[entry_id] = score
+        self._insert((-score, entry_id))
+
+    def remove(self, entry_id):
+        old = self.scores.pop(entry_id, None)
+        if old is not None:
+            self._discard((-old, entry_id))
+
+    def _insert(self, key):
+        if not self.blocks:
+            self.blocks.append([key])
+            self.maxes.append(key)
+            return
+        index = min(bisect.bisect_left(self.maxes, key), len(self.blocks) - 1)
+        block = self.blocks[index]
+        bisect.insort(block, key)
+        self.maxes[index] = block[-1]
+        if len(block) > 2 * self.block_size:
+            half = len(block) // 2
+            self.blocks[index:index + 1] = [block[:half], block[half:]]
+            self.maxes[index:index + 1] = [block[half - 1], block[-1]]
+
+    def _discard(self, key):
+        index = bisect.bisect_left(self.maxes, key)
+        if index == len(self.blocks):
+            return
+        block = self.blocks[index]
+        position = bisect.bisect_left(block, key)
+        if position < len(block) and block[position] == key:
+            del block[position]
+            if block:
+                self.maxes[index] = block[-1]
+            else:
+                del self.blocks[index]
+                del self.maxes[index]
+
+    def top(self, k):
+        entries = []
+        for block in self.blocks:
+            if len(entries) >= k:
+                break
+            entries.extend((entry_id, -negative) for negative, entry_id in block[:k - len(entries)])
+        return entries
+
+    def rank(self, entry_id):
+        """1-based position of an entry, or None if it is not ranked."""
+        score = self.scores.get(entry_id)
+        if score is None:
+            return None
+        key = (-score, entry_id)
+        index = bisect.bisect_left(self.maxes, key)
+        before = sum(len(block) for block in self.blocks[:index])
+        return before + bisect.bisect_left(self.blocks[index], key) + 1
+
+
+class CourseRankings:
+    def __init__(self):
+        self.streak = Ranking()
+        self.attendance = Ranking()
+
+
+class Leaderboard:
+    """Streak and attendance rankings, overall and per shared course, kept current from tracker events.
+
+    Overall rankings score each user by their best streak and by their attendance
+    across all courses. Course rankings, kept only for courses accepted by
+    `track_course`, score each member's row in that course.
+    """
+    def __init__(self, track_course=lambda course_code: False):
+        self.track_course = track_course
+        self.lock = threading.Lock()
+        self.user_courses = {}  # user id -> {course code: (present, absent, streak)}
+        self.names = {}
+        self.streak = Ranking()
+        self.attendance = Ranking()
+        self.courses = {}  # course code -> CourseRankings
+
+    def seed(self, rows):
+        """Builds all rankings from a sheet snapshot."""
+        user_courses = {}
+        names = {}
+        for row in rows:
+            user_id = str(row.get('User ID', '')).strip()
+            course_code = str(row.get('Course Code', '')).strip()
+            if not user_id or not course_code:
+                continue
+            names[user_id] = str(row.get('User Name', '')).strip()
+            user_courses.setdefault(user_id, {})[course_code] = (
+                as_int(row.get('Present')), as_int(row.get('Absent')), as_int(row.get('Streak'))
+            )
+
+        streak, attendance, courses = {}, {}, {}
+        for user_id, entries in user_courses.items():
+            self._score_user(user_id, entries, streak, attendance)
+            for course_code, values in entries.items():
+                if self.track_course(course_code):
+                    course = courses.setdefault(course_code, ({}, {}))
+                    self._score_entry(user_id, values, course[0], course[1])
+
+        with self.lock:
+            self.user_courses = user_courses
+            self.names = names
+            self.streak.load(streak)
+            self.attendance.load(attendance)
+            self.courses = {}
+            for course_code, (course_streak, course_attendance) in courses.items():
+                rankings = self.courses[course_code] = CourseRankings()
+                rankings.streak.load(course_streak)
+                rankings.attendance.load(course_attendance)
+        logger.info(f"Leaderboard seeded with {len(user_courses)} users and {len(courses)} shared courses")
+
+    @staticmethod
+    def _score_entry(entry_id, values, streak, attendance):
+        present, absent, current_streak = values
+        if current_streak > 0:
+            streak[entry_id] = current_streak
+        if present + absent >= MIN_CLASSES_FOR_ATTENDANCE:
+            attendance[entry_id] = round(present / (present + absent) * 100, 2)
+
+    def _score_user(self, user_id, entries, streak, attendance):
+        present = sum(values[0] for values in entries.values())
+        absent = sum(values[1] for values in entries.values())
+        best_streak = max((values[2] for values in entries.values()), default=0)
+        self._score_entry(user_id, (present, absent, best_streak), streak, attendance)
+
+    @staticmethod
+    def _apply(ranking, entry_id, scores):
+        if entry_id in scores:
+            ranking.update(entry_id, scores[entry_id])
+        else:
+            ranking.remove(entry_id)
+
+    def on_attendance_event(self, event, row):
+        """Tracker listener; re-scores only the user and course the event is about."""
+        user_id = str(row.get('User ID', '')).strip()
+        course_code = str(row.get('Course Code', '')).strip()
+        if not user_id or not course_code:
+            return
+        with self.lock:
+            entries = self.user_courses.setdefault(user_id, {})
+            if event == 'delete':
+                entries.pop(course_code, None)
+                values = None
+            else:
+                values = (as_int(row.get('Present')), as_int(row.get('Absent')), as_int(row.get('Streak')))
+                entries[course_code] = values
+                if row.get('User Name'):
+                    self.names[user_id] = str(row['User Name']).strip()
+
+            streak, attendance = {}, {}
+            self._score_user(user_id, entries, streak, attendance)
+            self._apply(self.streak, user_id, streak)
+            self._apply(self.attendance, user_id, attendance)
+            if not entries:
+                self.user_courses.pop(user_id, None)
+
+            if self.track_course(course_code):
+                rankings = self.courses.setdefault(course_code, CourseRankings())
+                streak, attendance = {}, {}
+                if values is not None:
+                    self._score_entry(user_id, values, streak, attendance)
+                self._apply(rankings.streak, user_id, streak)
+                self._apply(rankings.attendance, user_id, attendance)
+
+    def rankings(self, course_code=None):
+        """Returns (streak ranking, attendance ranking) overall or for a shared course."""
+        if course_code is None:
+            return self.streak, self.attendance
+        rankings = self.courses.get(course_code) or CourseRankings()
+        return rankings.streak, rankings.attendance
+
+    def top(self, k=10, course_code=None):
+        """Returns (top streaks, top attendance) as lists of (user id, name, score)."""
+        with self.lock:
+            streak, attendance = self.rankings(course_code)
+            return (
+                [(user_id, self.names.get(user_id, ''), score) for user_id, score in streak.top(k)],
+                [(user_id, self.names.get(user_id, ''), score) for user_id, score in attendance.top(k)],
+            )
+
+    def position(self, user_id, course_code=None):
+        """Returns the user's (streak rank, attendance rank, ranked users) for display."""
+        user_id = str(user_id).strip()
+        with self.lock:
+            streak, attendance = self.rankings(course_code)
+            return streak.rank(user_id), attendance.rank(user_id), max(len(streak), len(attendance))
@@ -1,7 +1,12 @@
 import logging
+import logging.handlers
+import atexit
+import gzip
 import os
+import queue
 import time
-from datetime import datetime, timedelta
+from collections import deque
+from datetime import datetime
 import threading
 import io
 import pytz
@@ -9,45 +14,167 @@ from telegram import ParseMode
 
 # File to store logs
 LOG_FILE = "attendio_bot.log"
-log_buffer = io.StringIO()  # In-memory buffer for logs
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+LOG_BLOCK_SIZE = 1024  # Records per block of the in-memory log
+LOG_FLUSH_INTERVAL = 1.0  # Seconds
 
 IST_TIMEZONE = pytz.timezone('Asia/Kolkata')
 
 class TelegramLogHandler(logging.Handler):
-    """Custom log handler that collects logs to be sent via Telegram"""
-    def __init__(self):
+    """Custom log handler that collects logs to be sent via Telegram.
+
+    Records are stored as (created_ts, levelno, logger name, message) tuples in
+    arrival order, in fixed-size blocks that are only ever appended to. The
+    oldest block is dropped once `max_records` is exceeded, and time windows are
+    located by bisecting first over blocks, then within one.
+    """
+    def __init__(self, max_records=100000, block_size=LOG_BLOCK_SIZE):
         super().__init__()
-        self.log_records = []
-        self.max_records = 10000
-    
+        self.block_size = block_size
+        self.max_blocks = max(1, -(-max_records // block_size))
+        self.blocks = deque([[]])
+
     def emit(self, record):
-        log_entry = self.format(record)
-        self.log_records.append(log_entry)
-        
-        # Keep only the last N records to avoid memory issues
-        if len(self.log_records) > self.max_records:
-            self.log_records = self.log_records[-self.max_records:]
-        
-        # Also write to file
-        with open(LOG_FILE, 'a') as f:
-            f.write(log_entry + '\n')
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text and record.exc_text not in message:
+            message = f"{message}\n{record.exc_text}"
+        block = self.blocks[-1]
+        if len(block) >= self.block_size:
+            block = []
+            self.blocks.append(block)
+            if len(self.blocks) > self.max_blocks:
+                self.blocks.popleft()
+        block.append((record.created, record.levelno, record.name, message))
+
+    def formatException(self, exc_info):
+        return (self.formatter or logging.Formatter()).formatException(exc_info)
+
+    def records_since(self, cutoff_ts):
+        """Returns the records created at or after `cutoff_ts`, oldest first.
+
+        Only the block references and the newest, still growing block are copied
+        under the handler lock; full blocks never change, so the search and the
+        copy of the matching records happen outside it.
+        """
+        with self.lock:
+            blocks = list(self.blocks)
+            blocks[-1] = blocks[-1][:]
+        if not blocks[-1]:
+            blocks.pop()
+
+        # First block whose newest record is at or after the cutoff
+        low, high = 0, len(blocks)
+        while low < high:
+            mid = (low + high) // 2
+            if blocks[mid][-1][0] < cutoff_ts:
+                low = mid + 1
+            else:
+                high = mid
+        if low == len(blocks):
+            return []
+
+        block = blocks[low]
+        start, high = 0, len(block)
+        while start < high:
+            mid = (start + high) // 2
+            if block[mid][0] < cutoff_ts:
+                start = mid + 1
+            else:
+                high = mid
+        records = block[start:]
+        for block in blocks[low + 1:]:
+            records.extend(block)
+        return records
+
+def format_log_record(record):
+    """Formats a stored (created_ts, levelno, name, message) tuple as a log line in IST."""
+    created, levelno, name, message = record
+    timestamp = datetime.fromtimestamp(created, IST_TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+    return f"{timestamp} - {name} - {logging.getLevelName(levelno)} - {message}"
+
+def filter_log_records(records, level=None, contains=None):
+    """Keeps records at or above `level` whose logger name or message contain `contains`."""
+    if level is not None:
+        records = [record for record in records if record[1] >= level]
+    if contains:
+        needle = contains.lower()
+        records = [record for record in records if needle in record[3].lower() or needle in record[2].lower()]
+    return records
+
+class BufferedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Size-rotated log file that stays open and flushes at most once per interval.
+
+    Records that arrive inside the interval are written out by the listener's
+    idle flush (see FlushingQueueListener) rather than waiting for the next record.
+    """
+    def __init__(self, filename, flush_interval=LOG_FLUSH_INTERVAL, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            super().flush()
+            self.last_flush = now
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    """Queue listener that flushes its handlers whenever the queue stays empty for `flush_interval`."""
+    def __init__(self, log_queue, *handlers, flush_interval=LOG_FLUSH_INTERVAL, **kwargs):
+        super().__init__(log_queue, *handlers, **kwargs)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while block:
+            try:
+                return self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                for handler in self.handlers:
+                    handler.flush()
+        return self.queue.get(block=False)
+
+# Set by setup_logging; the handlers live on the queue listener, not on the root logger
+log_listener = None
+telegram_log_handler = None
+
+def get_telegram_handler():
+    """Returns the TelegramLogHandler installed by setup_logging, if any."""
+    if telegram_log_handler is not None:
+        return telegram_log_handler
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, TelegramLogHandler):
+            return handler
+    return None
 
 # Configure logging
-def setup_logging():
+def setup_logging(log_file=LOG_FILE):
+    global log_listener, telegram_log_handler
+
     # Create a logger
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
 
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
+    if log_listener is not None:
+        log_listener.stop()
             
     # Create our custom handler
     telegram_handler = TelegramLogHandler()
-    telegram_handler.setLevel(logging.INFO)
+    telegram_handler.setLevel(logging.DEBUG)
     
-    # Create a console handler with higher log level
+    # Handlers accept everything; logger levels decide what is emitted so /loglevel can change them at runtime
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
+    console_handler.setLevel(logging.DEBUG)
+
+    # Log file kept open and rotated by size
+    file_handler = BufferedRotatingFileHandler(
+        log_file, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding='utf-8'
+    )
+    file_handler.setLevel(logging.DEBUG)
 
     class ISTFormatter(logging.Formatter):
         def formatTime(self, record, datefmt=None):
@@ -62,56 +189,102 @@ def setup_logging():
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     telegram_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
+    file_handler.setFormatter(formatter)
     
-    # Add the handlers to the logger
-    logger.addHandler(telegram_handler)
-    logger.addHandler(console_handler)
+    # Log calls only enqueue the record; a listener thread does the formatting and I/O
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener = FlushingQueueListener(
+        log_queue, telegram_handler, console_handler, file_handler, respect_handler_level=True
+    )
+    log_listener.start()
+    telegram_log_handler = telegram_handler
 
     logger.info("========== LOGGING SYSTEM STARTED ==========")
     logger.info(f"Current time in IST: {datetime.now(IST_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')}")
     
     return logger, telegram_handler
 
+# Loggers whose level can be changed at runtime with /loglevel
+RUNTIME_LOGGERS = ('root', 'google_sheets', 'attendance_tracker', 'reports', 'timetable', 'outbox', 'telegram', 'apscheduler')
+
+def set_log_level(name, level):
+    """Sets the level of a logger by name ('root' for the root logger) and returns its effective level."""
+    logger = logging.getLogger(None if name == 'root' else name)
+    logger.setLevel(level)
+    return logger.getEffectiveLevel()
+
+def get_log_levels(names=RUNTIME_LOGGERS):
+    """Returns {name: effective level name} for the given loggers."""
+    return {
+        name: logging.getLevelName(logging.getLogger(None if name == 'root' else name).getEffectiveLevel())
+        for name in names
+    }
+
+def stop_logging():
+    """Drains the log queue and closes the handlers."""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        for handler in log_listener.handlers:
+            handler.close()
+        log_listener = None
+
+atexit.register(stop_logging)
+
+def send_logs_document(bot, admin_id, records, hours):
+    """Sends records as a single gzip-compressed document with per-level counts in the caption."""
+    level_counts = {}
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as gz:
+        for record in records:
+            level_name = logging.getLevelName(record[1])
+            level_counts[level_name] = level_counts.get(level_name, 0) + 1
+            gz.write((format_log_record(record) + '\n').encode('utf-8'))
+    buffer.seek(0)
+
+    counts = ", ".join(f"{name}: {count}" for name, count in sorted(level_counts.items()))
+    filename = f"attendio_logs_{datetime.now(IST_TIMEZONE).strftime('%Y%m%d_%H%M')}.log.gz"
+    bot.send_document(
+        chat_id=admin_id,
+        document=buffer,
+        filename=filename,
+        caption=f"📋 Logs - Last {hours}h: {len(records)} lines\n{counts}"
+    )
+    logging.info(f"Sent {len(records)} log lines to admin as {filename}")
+
 # Function to send logs via Telegram
-def send_logs_to_admin(bot, admin_id, hours=24):
-    import pytz
+def send_logs_to_admin(bot, admin_id, hours=24, level=None, contains=None, as_document=False):
+    """Sends the logs of the last `hours` hours, optionally filtered by minimum level and substring.
+
+    With `as_document` the whole window is sent as one gzip file instead of message chunks.
+    """
     try:
         logging.info(f"Collecting logs from the last {hours} hours for admin")
         
         # Get handler
-        for handler in logging.getLogger().handlers:
-            if isinstance(handler, TelegramLogHandler):
-                telegram_handler = handler
-                break
-        else:
+        telegram_handler = get_telegram_handler()
+        if telegram_handler is None:
             logging.error("TelegramLogHandler not found")
             return
         
         # Get logs from the last N hours
-        cutoff_time = datetime.now(pytz.timezone('Asia/Kolkata')) - timedelta(hours=hours)
-        cutoff_str = cutoff_time.strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Filter logs based on timestamp
-        recent_logs = []
-        for log in telegram_handler.log_records:
-            # Extract timestamp from log (first part before the first dash)
-            try:
-                log_time_str = log.split(' - ')[0]
-                log_time = datetime.strptime(log_time_str, "%Y-%m-%d %H:%M:%S,%f")
-                log_time = IST_TIMEZONE.localize(log_time)
-                if log_time >= cutoff_time:
-                    recent_logs.append(log)
-            except (ValueError, IndexError):
-                # If parsing fails, include the log anyway
-                recent_logs.append(log)
+        cutoff_ts = time.time() - hours * 3600
+        records = filter_log_records(telegram_handler.records_since(cutoff_ts), level, contains)
         
-        if not recent_logs:
+        if not records:
             bot.send_message(
                 chat_id=admin_id, 
                 text=f"No logs found from the last {hours} hours."
             )
             logging.info("No logs to send")
             return
+
+        if as_document:
+            send_logs_document(bot, admin_id, records, hours)
+            return
+
+        recent_logs = [format_log_record(record) for record in records]
         
         # Split logs into chunks (Telegram has a message limit)
         MAX_MESSAGE_LENGTH = 4000
@@ -145,32 +318,3 @@ def send_logs_to_admin(bot, admin_id, hours=24):
         
     except Exception as e:
         logging.error(f"Failed to send logs via Telegram: {str(e)}")
-
-# Set up daily log sending
-def schedule_daily_logs(bot, admin_id):
-    """Schedule daily logs to be sent to admin at 5:30 PM IST."""
-    from apscheduler.schedulers.background import BackgroundScheduler
-    import pytz
-    
-    try:
-        # Create scheduler with explicit timezone
-        asia_tz = pytz.timezone('Asia/Kolkata')
-        scheduler = BackgroundScheduler()
-        
-        # Schedule log delivery at 5:30 PM IST daily
-        job = scheduler.add_job(
-            send_logs_to_admin, 
-            'cron', 
-            hour=17,  # 5 PM in 24-hour format
-            minute=30,  # 30 minutes past the hour
-            args=[bot, admin_id, 24],  # Send last 24 hours of logs
-            timezone=asia_tz
-        )
-        
-        scheduler.start()
-        logging.info(f"Daily log delivery scheduled for 5:30 PM IST (job id: {job.id})")
-        
-        return scheduler
-    except Exception as e:
-        logging.error(f"Failed to schedule daily logs: {str(e)}")
-        return None
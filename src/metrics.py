@@ -0,0 +1,333 @@
+import bisect
+import functools
+import threading
+import time
+from collections import deque
+from tracing import tracer
+
+# Latency bucket upper bounds in seconds: 0.5ms growing by 1.5x up to ~2 minutes
+BUCKET_BOUNDS = [0.0005 * 1.5 ** i for i in range(32)]
+WINDOW_MINUTES = 60
+
+
+class MinuteStats:
+    """Count, error count and latency histogram of one operation within one minute."""
+    __slots__ = ('count', 'errors', 'total', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def add(self, seconds, error):
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.total += other.total
+        for i, value in enumerate(other.buckets):
+            self.buckets[i] += value
+
+    def percentile(self, fraction):
+        """Returns the bucket upper bound below which `fraction` of the samples fall."""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for i, value in enumerate(self.buckets):
+            seen += value
+            if seen >= target:
+                return BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else BUCKET_BOUNDS[-1]
+        return BUCKET_BOUNDS[-1]
+
+
+class SheetsStats:
+    """Request counters of one GoogleSheets method within one minute."""
+    __slots__ = ('calls', 'reads', 'writes', 'bytes_in', 'bytes_out')
+
+    def __init__(self):
+        self.calls = 0
+        self.reads = 0
+        self.writes = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def merge(self, other):
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+class Metrics:
+    """In-memory latency histograms and counters bucketed per minute for the last hour."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.windows = deque(maxlen=WINDOW_MINUTES)
+        self.local = threading.local()
+        # Cumulative values since start, for Prometheus scraping
+        self.totals = {}
+        self.sheets_totals = {}
+        self.counters = {}
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def _window(self):
+        minute = int(time.time() // 60)
+        if not self.windows or self.windows[-1][0] != minute:
+            self.windows.append((minute, {}, {}))
+        return self.windows[-1]
+
+    def observe(self, name, seconds, error=False):
+        with self.lock:
+            latencies = self._window()[1]
+            stats = latencies.get(name)
+            if stats is None:
+                stats = latencies[name] = MinuteStats()
+            stats.add(seconds, error)
+            total = self.totals.get(name)
+            if total is None:
+                total = self.totals[name] = MinuteStats()
+            total.add(seconds, error)
+
+    def record_sheets_request(self, method, bytes_in, bytes_out):
+        """Counts one HTTP request to the Sheets API, attributed to the running GoogleSheets call."""
+        name = getattr(self.local, 'sheets_call', None) or 'other'
+        with self.lock:
+            for table in (self._window()[2], self.sheets_totals):
+                stats = table.get(name)
+                if stats is None:
+                    stats = table[name] = SheetsStats()
+                if method == 'GET':
+                    stats.reads += 1
+                else:
+                    stats.writes += 1
+                stats.bytes_in += bytes_in
+                stats.bytes_out += bytes_out
+
+    def count_sheets_call(self, name):
+        with self.lock:
+            for table in (self._window()[2], self.sheets_totals):
+                stats = table.get(name)
+                if stats is None:
+                    stats = table[name] = SheetsStats()
+                stats.calls += 1
+
+    def summary(self, minutes=15):
+        """Merges the last `minutes` minutes into ({name: MinuteStats}, {name: SheetsStats})."""
+        since = int(time.time() // 60) - minutes + 1
+        latencies = {}
+        sheets = {}
+        with self.lock:
+            for minute, window_latencies, window_sheets in self.windows:
+                if minute < since:
+                    continue
+                for name, stats in window_latencies.items():
+                    latencies.setdefault(name, MinuteStats()).merge(stats)
+                for name, stats in window_sheets.items():
+                    sheets.setdefault(name, SheetsStats()).merge(stats)
+        return latencies, sheets
+
+    def timed(self, name, expected=()):
+        """Decorator recording the latency and errors of every call under `name`.
+
+        Exceptions listed in `expected` are used for control flow and not counted as errors.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                span = tracer.begin(name)
+                start = time.perf_counter()
+                error = True
+                try:
+                    result = func(*args, **kwargs)
+                    error = False
+                    return result
+                except expected:
+                    error = False
+                    raise
+                finally:
+                    self.observe(name, time.perf_counter() - start, error)
+                    tracer.end(span, error)
+            return wrapper
+        return decorator
+
+    def sheets_call(self, func):
+        """Decorator for GoogleSheets methods: times the call and attributes its HTTP requests to it."""
+        name = f"sheets.{func.__name__}"
+        timed = self.timed(name)(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            outer = getattr(self.local, 'sheets_call', None)
+            if outer is not None:
+                # Nested call: let the outermost method own the requests
+                return timed(*args, **kwargs)
+            self.local.sheets_call = name
+            self.count_sheets_call(name)
+            try:
+                return timed(*args, **kwargs)
+            finally:
+                self.local.sheets_call = None
+        return wrapper
+
+    def response_hook(self, response, *args, **kwargs):
+        """requests response hook counting Sheets API traffic."""
+        body = response.request.body or b''
+        self.record_sheets_request(response.request.method, len(response.content or b''), len(body))
+        return response
+
+
+metrics = Metrics()
+
+
+def instrument_handlers(handlers, expected=()):
+    """Wraps the callbacks of dispatcher handlers, including ConversationHandler states, with timing."""
+    for handler in handlers:
+        nested = []
+        for attribute in ('entry_points', 'fallbacks'):
+            nested.extend(getattr(handler, attribute, None) or [])
+        for state_handlers in (getattr(handler, 'states', None) or {}).values():
+            nested.extend(state_handlers)
+        if nested:
+            instrument_handlers(nested, expected)
+        callback = getattr(handler, 'callback', None)
+        if callback is not None and not getattr(callback, '_timed', False):
+            wrapped = metrics.timed(f"handler.{callback.__name__}", expected)(callback)
+            wrapped._timed = True
+            handler.callback = wrapped
+
+
+def render_prometheus(gauges=None):
+    """Renders cumulative metrics in the Prometheus text exposition format.
+
+    `gauges` maps metric name -> (help text, value) for values sampled at scrape time.
+    """
+    with metrics.lock:
+        totals = {name: (stats.count, stats.errors, stats.total, list(stats.buckets)) for name, stats in metrics.totals.items()}
+        sheets = {name: (stats.calls, stats.reads, stats.writes, stats.bytes_in, stats.bytes_out)
+                  for name, stats in metrics.sheets_totals.items()}
+        counters = dict(metrics.counters)
+
+    lines = [
+        "# HELP attendio_updates_total Telegram updates received.",
+        "# TYPE attendio_updates_total counter",
+        f"attendio_updates_total {counters.get('updates', 0)}",
+        "# HELP attendio_cache_requests_total Sheet snapshot lookups by result.",
+        "# TYPE attendio_cache_requests_total counter",
+        f'attendio_cache_requests_total{{result="hit"}} {counters.get("cache_hits", 0)}',
+        f'attendio_cache_requests_total{{result="miss"}} {counters.get("cache_misses", 0)}',
+        "# HELP attendio_duplicate_callbacks_total Repeated button taps answered without running the handler.",
+        "# TYPE attendio_duplicate_callbacks_total counter",
+        f"attendio_duplicate_callbacks_total {counters.get('duplicate_callbacks', 0)}",
+        "# HELP attendio_latency_seconds Latency of handlers, tracker methods and Sheets calls.",
+        "# TYPE attendio_latency_seconds histogram",
+    ]
+    errors = []
+    for name in sorted(totals):
+        count, error_count, total, buckets = totals[name]
+        kind, _, operation = name.partition('.')
+        labels = f'kind="{kind}",name="{operation}"'
+        cumulative = 0
+        for bound, value in zip(BUCKET_BOUNDS, buckets):
+            cumulative += value
+            lines.append(f'attendio_latency_seconds_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+        lines.append(f'attendio_latency_seconds_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f'attendio_latency_seconds_sum{{{labels}}} {total:.6f}')
+        lines.append(f'attendio_latency_seconds_count{{{labels}}} {count}')
+        errors.append(f'attendio_errors_total{{{labels}}} {error_count}')
+    lines += ["# HELP attendio_errors_total Calls that raised an exception.", "# TYPE attendio_errors_total counter"] + errors
+
+    lines += ["# HELP attendio_sheets_requests_total HTTP requests to the Sheets API.", "# TYPE attendio_sheets_requests_total counter"]
+    for name in sorted(sheets):
+        calls, reads, writes, bytes_in, bytes_out = sheets[name]
+        method = name.partition('.')[2] or name
+        lines.append(f'attendio_sheets_requests_total{{method="{method}",type="read"}} {reads}')
+        lines.append(f'attendio_sheets_requests_total{{method="{method}",type="write"}} {writes}')
+    lines += ["# HELP attendio_sheets_bytes_total Bytes exchanged with the Sheets API.", "# TYPE attendio_sheets_bytes_total counter"]
+    for name in sorted(sheets):
+        calls, reads, writes, bytes_in, bytes_out = sheets[name]
+        method = name.partition('.')[2] or name
+        lines.append(f'attendio_sheets_bytes_total{{method="{method}",direction="in"}} {bytes_in}')
+        lines.append(f'attendio_sheets_bytes_total{{method="{method}",direction="out"}} {bytes_out}')
+
+    return "\n".join(lines) + "\n" + render_gauges(gauges)
+
+
+def render_gauges(gauges):
+    """Renders {name: (help text, value)} as Prometheus gauges; names may carry labels, e.g. 'x{worker="0"}'."""
+    families = {}
+    for name, (help_text, value) in (gauges or {}).items():
+        family = name.partition('{')[0]
+        if family not in families:
+            families[family] = [f"# HELP {family} {help_text}", f"# TYPE {family} gauge"]
+        families[family].append(f"{name} {value}")
+    return "".join("\n".join(lines) + "\n" for lines in families.values())
+
+
+def merge_worker_metrics(texts):
+    """Merges the render_prometheus() output of several workers, {index: text}, into one exposition.
+
+    Every sample gets a worker="<index>" label and the samples of one metric
+    family are grouped under a single HELP/TYPE header, as Prometheus requires.
+    """
+    families = {}
+    for index in sorted(texts):
+        family = None
+        for line in texts[index].splitlines():
+            if not line:
+                continue
+            if line.startswith('#'):
+                parts = line.split(' ', 3)
+                if len(parts) >= 3 and parts[1] in ('HELP', 'TYPE'):
+                    family = parts[2]
+                    headers, _ = families.setdefault(family, ([], []))
+                    if line not in headers:
+                        headers.append(line)
+                continue
+            name, brace, rest = line.partition('{')
+            if brace:
+                sample = f'{name}{{worker="{index}",{rest}'
+            else:
+                name, _, value = line.partition(' ')
+                sample = f'{name}{{worker="{index}"}} {value}'
+            families.setdefault(family or name, ([], []))[1].append(sample)
+    return "".join("\n".join(headers + samples) + "\n" for headers, samples in families.values())
+
+
+def format_stats(minutes=15):
+    """Renders the last `minutes` minutes of metrics as HTML for Telegram."""
+    latencies, sheets = metrics.summary(minutes)
+    if not latencies and not sheets:
+        return f"No metrics recorded in the last {minutes} minutes."
+
+    def latency_lines(prefix):
+        lines = []
+        for name in sorted(name for name in latencies if name.startswith(prefix)):
+            stats = latencies[name]
+            lines.append(
+                f"<code>{name[len(prefix):]}</code> n={stats.count} err={stats.errors} "
+                f"p50={stats.percentile(0.5) * 1000:.1f} p95={stats.percentile(0.95) * 1000:.1f} "
+                f"p99={stats.percentile(0.99) * 1000:.1f}ms"
+            )
+        return lines
+
+    text = f"<b>📈 Stats – last {minutes} min</b>\n"
+    for title, prefix in (("Handlers", "handler."), ("Tracker", "tracker."), ("Sheets calls", "sheets.")):
+        lines = latency_lines(prefix)
+        if lines:
+            text += f"\n<b>{title}:</b>\n" + "\n".join(lines) + "\n"
+    if sheets:
+        text += "\n<b>Sheets requests:</b>\n"
+        for name in sorted(sheets):
+            stats = sheets[name]
+            text += (f"<code>{name[len('sheets.'):] if name.startswith('sheets.') else name}</code> calls={stats.calls} "
+                     f"reads={stats.reads} writes={stats.writes} "
+                     f"in={stats.bytes_in / 1024:.1f}KB out={stats.bytes_out / 1024:.1f}KB\n")
+    return text
@@ -0,0 +1,142 @@
+import html
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import pytz
+from telegram import ParseMode
+
+logger = logging.getLogger(__name__)
+
+DIGEST_INTERVAL_SECONDS = int(os.getenv("ADMIN_DIGEST_SECONDS") or 600)
+MAX_ITEMS_PER_KIND = 40  # Further items of a kind are only counted in the digest
+MESSAGE_LIMIT = 4000  # Telegram allows 4096 characters; leave room for the HTML tags
+
+# Digest section titles; kinds not listed here use their own name
+DIGEST_TITLES = {
+    'verified': "✅ New users verified",
+    'auto_block': "🚫 Users auto-blocked",
+    'feedback': "📬 Feedback received",
+    'archived': "🗄 Inactive users archived",
+}
+
+
+class AdminNotifier:
+    """Collects admin notifications and sends them from a background thread.
+
+    Urgent notifications are sent as soon as the thread picks them up. Routine
+    ones are grouped by kind and sent as one digest message every `interval`
+    seconds, so a wave of sign-ups costs the admin chat a few messages instead
+    of hundreds. Handlers only enqueue and never wait on a send.
+
+    In multi-worker mode only worker 0 sends; the other workers set `forward`
+    and hand their notifications to it, so the admin gets one digest per interval.
+    """
+    def __init__(self, bot, admin_id, interval=DIGEST_INTERVAL_SECONDS):
+        self.bot = bot
+        self.admin_id = admin_id
+        self.interval = interval
+        self.urgent = queue.Queue()
+        self.pending = OrderedDict()  # kind -> [items, total count]
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.sent = 0
+        self.failed = 0
+        self.forward = None  # Called with (kind, text, urgent) instead of queueing, when another process sends
+
+    def notify(self, kind, text, urgent=False):
+        """Queues `text` (HTML) for the admin; routine items are shown as one line each in the digest."""
+        if not self.admin_id:
+            return
+        if self.forward is not None:
+            self.forward(kind, text, urgent)
+            return
+        if urgent:
+            self.urgent.put(text)
+            self.wakeup.set()
+            return
+        with self.lock:
+            entry = self.pending.setdefault(kind, [[], 0])
+            if len(entry[0]) < MAX_ITEMS_PER_KIND:
+                entry[0].append(text)
+            entry[1] += 1
+
+    def pending_count(self):
+        with self.lock:
+            return sum(total for _, total in self.pending.values()) + self.urgent.qsize()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='admin-notifier', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stops the thread and sends whatever is still pending."""
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+        self._send_urgent()
+        self.flush()
+
+    def flush(self):
+        """Sends the routine items collected so far as a digest."""
+        with self.lock:
+            pending, self.pending = self.pending, OrderedDict()
+        if not pending:
+            return
+        for text in self._format_digest(pending):
+            self._send(text)
+
+    def _format_digest(self, pending):
+        now = datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M')
+        lines = [f"🗂 <b>Admin digest</b> ({now})"]
+        for kind, (items, total) in pending.items():
+            title = DIGEST_TITLES.get(kind, html.escape(kind))
+            lines.append("")
+            lines.append(f"<b>{title}: {total}</b>")
+            lines.extend(f"• {item}" for item in items)
+            if total > len(items):
+                lines.append(f"<i>…and {total - len(items)} more</i>")
+
+        # Split on line boundaries so no message exceeds Telegram's length limit
+        messages, current = [], ""
+        for line in lines:
+            if current and len(current) + len(line) + 1 > MESSAGE_LIMIT:
+                messages.append(current)
+                current = ""
+            current = f"{current}\n{line}" if current else line
+        if current:
+            messages.append(current)
+        return messages
+
+    def _send(self, text):
+        try:
+            self.bot.send_message(chat_id=self.admin_id, text=text, parse_mode=ParseMode.HTML)
+            self.sent += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error sending admin notification: {e}")
+
+    def _send_urgent(self):
+        while True:
+            try:
+                text = self.urgent.get_nowait()
+            except queue.Empty:
+                return
+            self._send(text)
+
+    def _run(self):
+        next_digest = time.monotonic() + self.interval
+        while not self.stop_event.is_set():
+            self.wakeup.wait(max(0.0, next_digest - time.monotonic()))
+            self.wakeup.clear()
+            self._send_urgent()
+            if time.monotonic() >= next_digest:
+                self.flush()
+                next_digest = time.monotonic() + self.interval
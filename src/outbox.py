@@ -0,0 +1,66 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """Background sender that drains queued Telegram messages at a steady rate.
+
+    Telegram allows roughly 30 messages per second across all chats, so bulk
+    sends are queued here and released by a token bucket instead of bursting.
+    """
+    def __init__(self, bot, rate=25, burst=5, delivery=None):
+        self.bot = bot
+        self.delivery = delivery  # Optional DeliveryTracker; dead chats are dropped before using a token
+        self.rate = rate
+        self.burst = burst
+        self.queue = queue.Queue()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def send_message(self, chat_id, text, **kwargs):
+        """Queues a message for sending."""
+        self.queue.put((chat_id, text, kwargs))
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def _run(self):
+        tokens = float(self.burst)
+        last = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                chat_id, text, kwargs = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if self.delivery is not None and self.delivery.is_dead(chat_id):
+                continue
+            now = time.monotonic()
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            last = now
+            if tokens < 1:
+                time.sleep((1 - tokens) / self.rate)
+                tokens = 1
+                last = time.monotonic()
+            tokens -= 1
+            try:
+                self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                if self.delivery is not None:
+                    self.delivery.record_failure(chat_id, e)
+                logger.error(f"Error sending queued message to chat {chat_id}: {e}")
@@ -0,0 +1,114 @@
+import cProfile
+import functools
+import io
+import logging
+import marshal
+import pstats
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class OnDemandProfiler:
+    """cProfile session armed by an admin for the next N updates or the next run of a job.
+
+    While disarmed the only cost is reading `armed` once per update or job run.
+    """
+    def __init__(self, top=25):
+        self.top = top
+        self.lock = threading.Lock()
+        self.armed = False
+        self.profile = None
+        self.remaining_updates = 0
+        self.job_name = None
+        self.bot = None
+        self.chat_id = None
+        self.started = None
+
+    def arm(self, bot, chat_id, updates=0, job_name=None):
+        with self.lock:
+            self.profile = cProfile.Profile()
+            self.remaining_updates = updates
+            self.job_name = job_name
+            self.bot = bot
+            self.chat_id = chat_id
+            self.started = time.time()
+            self.armed = True
+
+    def disarm(self):
+        with self.lock:
+            self.armed = False
+            self.profile = None
+
+    def profile_update(self, func, *args, **kwargs):
+        """Runs one update under the profiler and reports once the last one is done."""
+        with self.lock:
+            if not self.armed or self.remaining_updates <= 0:
+                profile = None
+            else:
+                profile = self.profile
+                self.remaining_updates -= 1
+                finished = self.remaining_updates == 0
+        if profile is None:
+            return func(*args, **kwargs)
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            if finished:
+                self._report(profile, "updates")
+
+    def profiled_job(self, name):
+        """Decorator for job functions that can be profiled with /profile job <name>."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.armed or self.job_name != name:
+                    return func(*args, **kwargs)
+                with self.lock:
+                    profile = self.profile if self.armed and self.job_name == name else None
+                    self.job_name = None
+                if profile is None:
+                    return func(*args, **kwargs)
+                try:
+                    return profile.runcall(func, *args, **kwargs)
+                finally:
+                    self._report(profile, f"job {name}")
+            return wrapper
+        return decorator
+
+    def _report(self, profile, description):
+        with self.lock:
+            self.armed = False
+            self.profile = None
+            bot, chat_id, started = self.bot, self.chat_id, self.started
+        try:
+            stream = io.StringIO()
+            stats = pstats.Stats(profile, stream=stream)
+            stats.strip_dirs().sort_stats('cumulative').print_stats(self.top)
+            summary = stream.getvalue()
+            # Keep the header and the table, which is what fits in a message
+            summary = summary[summary.find('ncalls') - 1:] if 'ncalls' in summary else summary
+            summary = summary[:3500]
+
+            raw = io.BytesIO()
+            profile.create_stats()
+            raw.write(marshal.dumps(profile.stats))
+            raw.seek(0)
+
+            bot.send_message(
+                chat_id=chat_id,
+                text=f"🔬 Profile of {description} ({time.time() - started:.0f}s):\n\n{summary}"
+            )
+            bot.send_document(
+                chat_id=chat_id,
+                document=raw,
+                filename=f"attendio_{description.replace(' ', '_')}_{int(started)}.prof",
+                caption="Open with pstats or snakeviz."
+            )
+            logger.info(f"Profile of {description} sent to admin")
+        except Exception as e:
+            logger.error(f"Error sending profile report: {e}")
+
+
+profiler = OnDemandProfiler()
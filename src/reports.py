@@ -0,0 +1,207 @@
+import html
+import logging
+import threading
+from datetime import timedelta
+from telegram import ParseMode
+from attendance_history import AttendanceHistory, today_ist
+from thresholds import course_threshold
+
+logger = logging.getLogger(__name__)
+
+
+def week_start(day):
+    """Returns the Monday of the week containing the given day."""
+    return day - timedelta(days=day.weekday())
+
+
+def percentage(present, absent):
+    total = present + absent
+    return (present / total) * 100 if total > 0 else 100.0
+
+
+class CourseAggregate:
+    """Running counters for one course, rolled over at day and week boundaries.
+
+    Today's and this week's counts are class days taken from the row's per-day
+    history, which is all the sheet keeps, so the numbers are the same whether
+    they were seeded after a restart or followed from live events.
+    """
+    def __init__(self, nickname, present=0, absent=0, threshold=None):
+        self.nickname = nickname
+        self.threshold = threshold
+        self.present = present
+        self.absent = absent
+        self.day = None
+        self.attended_today = 0
+        self.held_today = 0
+        self.week = None
+        self.attended_week = 0
+        self.held_week = 0
+        self.week_start_present = present
+        self.week_start_absent = absent
+
+    def roll_over(self, today):
+        if self.day != today:
+            self.day = today
+            self.attended_today = 0
+            self.held_today = 0
+        monday = week_start(today)
+        if self.week != monday:
+            self.week = monday
+            self.attended_week = 0
+            self.held_week = 0
+            self.week_start_present = self.present
+            self.week_start_absent = self.absent
+
+    def update(self, row, today):
+        """Takes the totals from a course row and today's and this week's counts from its history."""
+        self.present = int(row.get('Present', 0) or 0)
+        self.absent = int(row.get('Absent', 0) or 0)
+        monday = week_start(today)
+        semester = AttendanceHistory.from_cell(row.get('History', '')).semester(today)
+        present_days, absent_days, held_days = semester.day_counts((today - monday).days + 1, today)
+        self.attended_week, self.held_week = present_days, held_days
+        self.attended_today, _, self.held_today = semester.day_counts(1, today)
+        self.week_start_present = max(0, self.present - present_days)
+        self.week_start_absent = max(0, self.absent - absent_days)
+        self.day = today
+        self.week = monday
+
+    @property
+    def week_change(self):
+        return percentage(self.present, self.absent) - percentage(self.week_start_present, self.week_start_absent)
+
+
+class UserAggregate:
+    def __init__(self, user_id, chat_id, user_name):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.user_name = user_name
+        self.courses = {}
+
+
+class ReportGenerator:
+    """Keeps per-user report aggregates up to date from attendance events.
+
+    Aggregates are seeded once from a sheet snapshot and then maintained from the
+    tracker's listener events, so building a report never touches storage.
+    """
+    def __init__(self, attendance_threshold, danger_margin=5.0):
+        self.attendance_threshold = attendance_threshold
+        self.danger_margin = danger_margin
+        self.users = {}
+        self.lock = threading.Lock()
+
+    def seed(self, rows, today=None):
+        """Builds aggregates from a full sheet snapshot."""
+        today = today or today_ist()
+        with self.lock:
+            self.users = {}
+            for row in rows:
+                user = self._get_user(row)
+                if not user or not str(row.get('Course Code', '')).strip():
+                    continue
+                course = self._course_from_row(row)
+                course.update(row, today)
+                user.courses[str(row['Course Code']).strip()] = course
+        logger.info(f"Report aggregates seeded for {len(self.users)} users")
+
+    def on_attendance_event(self, event, row):
+        """Tracker listener that updates the aggregates incrementally."""
+        with self.lock:
+            user = self._get_user(row)
+            if not user:
+                return
+            course_code = str(row.get('Course Code', '')).strip()
+            if not course_code:
+                return
+            if event == 'delete':
+                user.courses.pop(course_code, None)
+                return
+            course = user.courses.get(course_code) or self._course_from_row(row)
+            course.update(row, today_ist())
+            course.nickname = row.get('Course Nickname', course.nickname)
+            course.threshold = course_threshold(row, self.attendance_threshold)
+            user.courses[course_code] = course
+
+    def build_daily_report(self, user, today=None):
+        """Returns the daily summary text, or None if no classes were marked today."""
+        today = today or today_ist()
+        lines = []
+        for course in user.courses.values():
+            course.roll_over(today)
+            if course.held_today:
+                status = "attended" if course.attended_today else "missed"
+                lines.append(f"• {html.escape(str(course.nickname))}: {status} ({percentage(course.present, course.absent):.1f}% overall)")
+        if not lines:
+            return None
+        return f"<b>📅 Daily Summary – {today.strftime('%d %B')}</b>\n\n" + "\n".join(lines)
+
+    def build_weekly_report(self, user, today=None):
+        """Returns the weekly summary text, or None if the user has no courses."""
+        today = today or today_ist()
+        if not user.courses:
+            return None
+        attended = held = 0
+        lines = []
+        danger = []
+        for course in user.courses.values():
+            course.roll_over(today)
+            attended += course.attended_week
+            held += course.held_week
+            current = percentage(course.present, course.absent)
+            change = course.week_change
+            arrow = "▲" if change > 0 else "▼" if change < 0 else "•"
+            lines.append(f"• {html.escape(str(course.nickname))}: {current:.1f}% ({arrow} {abs(change):.1f})")
+            if change < 0 and current < (course.threshold or self.attendance_threshold) + self.danger_margin:
+                danger.append(html.escape(str(course.nickname)))
+        report = f"<b>📊 Weekly Summary – week of {week_start(today).strftime('%d %B')}</b>\n\n"
+        report += f"Class days attended this week: <b>{attended}/{held}</b>\n\n"
+        report += "\n".join(lines)
+        if danger:
+            report += f"\n\n⚠️ <b>Trending toward danger:</b> {', '.join(danger)}"
+        return report
+
+    def send_reports(self, bot, weekly=False, delivery=None):
+        """Sends the daily or weekly report to every user with something to report.
+
+        With a DeliveryTracker, chats that no longer accept messages are skipped.
+        """
+        kind = "weekly" if weekly else "daily"
+        logger.info(f"Sending {kind} reports")
+        sent = failed = skipped = 0
+        with self.lock:
+            reports = []
+            for user in self.users.values():
+                text = self.build_weekly_report(user) if weekly else self.build_daily_report(user)
+                if text and user.chat_id:
+                    reports.append((user.chat_id, text))
+        for chat_id, text in reports:
+            if delivery is not None:
+                outcome = delivery.send(bot, chat_id, text, parse_mode=ParseMode.HTML)
+                sent += outcome == 'sent'
+                skipped += outcome == 'skipped'
+                failed += outcome == 'failed'
+                continue
+            try:
+                bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML)
+                sent += 1
+            except Exception as e:
+                failed += 1
+                logger.error(f"Error sending {kind} report to chat {chat_id}: {e}")
+        logger.info(f"{kind.capitalize()} reports completed: {sent} sent, {failed} failed, {skipped} skipped")
+
+    def _get_user(self, row):
+        user_id = str(row.get('User ID', '')).strip()
+        if not user_id:
+            return None
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = UserAggregate(user_id, row.get('Chat ID'), row.get('User Name'))
+        if row.get('Chat ID'):
+            user.chat_id = row['Chat ID']
+        return user
+
+    def _course_from_row(self, row):
+        return CourseAggregate(row.get('Course Nickname', ''), int(row.get('Present', 0) or 0), int(row.get('Absent', 0) or 0),
+                               course_threshold(row, self.attendance_threshold))
@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+import pytz
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+IST = pytz.timezone('Asia/Kolkata')
+SCHEDULER_DB_URL = os.getenv("SCHEDULER_DB_URL") or "sqlite:///attendio_jobs.sqlite"
+
+JOB_DEFAULTS = {
+    'coalesce': True,  # Runs missed while the bot was down collapse into one
+    'max_instances': 1,
+    'misfire_grace_time': 3 * 60 * 60,
+}
+
+
+class JobSpec:
+    """A named job: what it runs, when, and how it may overlap with other jobs."""
+    def __init__(self, name, func, cron, jitter=0, exclusive=False, min_interval=0, description=''):
+        self.name = name
+        self.func = func
+        self.cron = cron
+        self.jitter = jitter
+        self.exclusive = exclusive
+        self.min_interval = min_interval
+        self.description = description
+
+    def trigger(self):
+        return CronTrigger(timezone=IST, jitter=self.jitter or None, **self.cron)
+
+
+# Jobs are persisted as run_job(name) so the store never has to pickle a
+# function or a bot; the application registers the callables on every start.
+registry = {}
+# Held by exclusive jobs so bulk senders such as reminders and reports never overlap
+exclusive_lock = threading.Lock()
+app_scheduler = None
+
+
+def run_job(name, force=False):
+    spec = registry.get(name)
+    if spec is None:
+        logger.error(f"Job {name} is not registered; skipping")
+        return
+    if spec.exclusive:
+        with exclusive_lock:
+            _run_once(spec, force)
+    else:
+        _run_once(spec, force)
+
+
+def _run_once(spec, force):
+    if app_scheduler is not None and not app_scheduler.claim_run(spec, force):
+        return
+    start = time.perf_counter()
+    try:
+        spec.func()
+        logger.info(f"Job {spec.name} finished in {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        logger.error(f"Job {spec.name} failed: {e}")
+
+
+class AppScheduler:
+    """The application's only scheduler: APScheduler with a persistent SQL job store.
+
+    Besides APScheduler's own next-run bookkeeping, every start of a job is
+    recorded in a job_runs table, and a job that already started less than its
+    min_interval ago is skipped. That keeps a restart, or a job store that was
+    reset, from sending the same reminders or reports twice.
+    """
+    def __init__(self, db_url=SCHEDULER_DB_URL):
+        self.jobstore = SQLAlchemyJobStore(url=db_url)
+        self.scheduler = BackgroundScheduler(
+            jobstores={'default': self.jobstore}, job_defaults=JOB_DEFAULTS, timezone=IST
+        )
+        with self.jobstore.engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE IF NOT EXISTS job_runs (name VARCHAR(64) PRIMARY KEY, last_started FLOAT NOT NULL)"
+            ))
+
+    def claim_run(self, spec, force=False):
+        """Records the start of a run; returns False if the job already ran within its min_interval."""
+        now = time.time()
+        with self.jobstore.engine.begin() as connection:
+            last = connection.execute(
+                text("SELECT last_started FROM job_runs WHERE name = :name"), {'name': spec.name}
+            ).scalar()
+            if last is not None and now - last < spec.min_interval and not force:
+                logger.warning(f"Job {spec.name} already ran at {datetime.fromtimestamp(last, IST):%Y-%m-%d %H:%M:%S}; skipping")
+                return False
+            if last is None:
+                connection.execute(text("INSERT INTO job_runs (name, last_started) VALUES (:name, :now)"), {'name': spec.name, 'now': now})
+            else:
+                connection.execute(text("UPDATE job_runs SET last_started = :now WHERE name = :name"), {'name': spec.name, 'now': now})
+        return True
+
+    def last_runs(self):
+        with self.jobstore.engine.begin() as connection:
+            return dict(connection.execute(text("SELECT name, last_started FROM job_runs")).fetchall())
+
+    def start(self, specs):
+        """Registers the job callables and starts the scheduler.
+
+        Stored jobs whose schedule is unchanged keep their next run time, so a run
+        missed during downtime is caught up once; changed ones are replaced.
+        """
+        global app_scheduler
+        app_scheduler = self
+        registry.clear()
+        registry.update((spec.name, spec) for spec in specs)
+
+        self.scheduler.start(paused=True)
+        for spec in specs:
+            trigger = spec.trigger()
+            existing = self.scheduler.get_job(spec.name)
+            if existing is not None and str(existing.trigger) == str(trigger) and existing.trigger.jitter == trigger.jitter:
+                continue
+            self.scheduler.add_job(
+                run_job, trigger, args=[spec.name], id=spec.name, name=spec.description or spec.name,
+                replace_existing=True
+            )
+        for job in self.scheduler.get_jobs():
+            if job.id not in registry:
+                logger.info(f"Removing stale job {job.id}")
+                job.remove()
+        self.scheduler.resume()
+        for job in self.scheduler.get_jobs():
+            next_run = f"{job.next_run_time:%Y-%m-%d %H:%M %Z}" if job.next_run_time else "paused"
+            logger.info(f"Job {job.id} scheduled ({job.trigger}); next run {next_run}")
+
+    def shutdown(self):
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+
+    def jobs(self):
+        return self.scheduler.get_jobs()
+
+    def pause(self, name):
+        self.scheduler.pause_job(name)
+
+    def resume(self, name):
+        self.scheduler.resume_job(name)
+
+    def run_now(self, name):
+        """Runs a job immediately in the background, waiting for any exclusive job in progress."""
+        if name not in registry:
+            raise KeyError(name)
+        threading.Thread(target=run_job, args=(name, True), name=f"job-{name}", daemon=True).start()
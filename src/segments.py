@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from thresholds import course_threshold
+
+logger = logging.getLogger(__name__)
+
+IST = timezone(timedelta(hours=5, minutes=30))  # Fixed offset; India has no DST and this is much cheaper than pytz
+DAY_SECONDS = 24 * 60 * 60
+
+
+def parse_timestamp(value):
+    """Returns the unix time of a sheet timestamp, or 0 if the cell is empty or malformed."""
+    # fromisoformat() parses the sheet's '%Y-%m-%d %H:%M:%S' many times faster than strptime()
+    try:
+        return datetime.fromisoformat(str(value).strip()).replace(tzinfo=IST).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def percentage(present, absent):
+    total = present + absent
+    return (present / total) * 100 if total > 0 else 100.0
+
+
+class AudienceIndex:
+    """Users indexed by announcement segment, kept current from tracker events.
+
+    - chat_ids: every user with a chat id, for 'all'
+    - below: user id -> course codes currently under the attendance threshold
+    - activity and registered: user ids ordered by their last activity and by
+      registration time, oldest first, so 'inactive' reads from the front and
+      'new' from the back and both stop at the cutoff
+    """
+    def __init__(self, attendance_threshold):
+        self.attendance_threshold = attendance_threshold
+        self.lock = threading.Lock()
+        self.chat_ids = {}
+        self.below = {}
+        self.activity = OrderedDict()
+        self.registered = OrderedDict()
+
+    def is_below(self, row):
+        try:
+            present = int(row.get('Present', 0) or 0)
+            absent = int(row.get('Absent', 0) or 0)
+        except (TypeError, ValueError):
+            return False
+        return present + absent > 0 and percentage(present, absent) < course_threshold(row, self.attendance_threshold)
+
+    def seed(self, rows):
+        """Builds every index from a sheet snapshot.
+
+        The sheet has no registration date, so a user's earliest 'Last Updated'
+        stands in for it; that is the sign-up time for rows made at registration.
+        """
+        chat_ids, below, activity, registered = {}, {}, {}, {}
+        for row in rows:
+            user_id = str(row.get('User ID', '')).strip()
+            if not user_id:
+                continue
+            chat_id = str(row.get('Chat ID', '')).strip()
+            if chat_id and user_id not in chat_ids:
+                chat_ids[user_id] = chat_id
+            course_code = str(row.get('Course Code', '')).strip()
+            if course_code and self.is_below(row):
+                below.setdefault(user_id, set()).add(course_code)
+            updated = parse_timestamp(row.get('Last Updated', ''))
+            activity[user_id] = max(activity.get(user_id, 0.0), updated)
+            registered[user_id] = min(registered.get(user_id, updated), updated)
+
+        with self.lock:
+            self.chat_ids = chat_ids
+            self.below = below
+            self.activity = OrderedDict(sorted(activity.items(), key=lambda item: item[1]))
+            self.registered = OrderedDict(sorted(registered.items(), key=lambda item: item[1]))
+        logger.info(f"Audience index seeded with {len(chat_ids)} users, {len(below)} below threshold")
+
+    def on_attendance_event(self, event, row):
+        """Tracker listener; every event is activity of its user."""
+        user_id = str(row.get('User ID', '')).strip()
+        if not user_id:
+            return
+        now = time.time()
+        course_code = str(row.get('Course Code', '')).strip()
+        with self.lock:
+            chat_id = str(row.get('Chat ID', '')).strip()
+            if chat_id:
+                self.chat_ids[user_id] = chat_id
+            if event == 'register' or user_id not in self.registered:
+                self.registered[user_id] = now
+                self.registered.move_to_end(user_id)
+            self.activity[user_id] = now
+            self.activity.move_to_end(user_id)
+
+            if course_code:
+                courses = self.below.setdefault(user_id, set())
+                if event != 'delete' and self.is_below(row):
+                    courses.add(course_code)
+                else:
+                    courses.discard(course_code)
+                if not courses:
+                    del self.below[user_id]
+
+    def remove_user(self, user_id):
+        user_id = str(user_id).strip()
+        with self.lock:
+            self.chat_ids.pop(user_id, None)
+            self.below.pop(user_id, None)
+            self.activity.pop(user_id, None)
+            self.registered.pop(user_id, None)
+
+    def _with_chats(self, user_ids):
+        return {user_id: self.chat_ids[user_id] for user_id in user_ids if user_id in self.chat_ids}
+
+    def everyone(self):
+        with self.lock:
+            return dict(self.chat_ids)
+
+    def below_threshold(self):
+        with self.lock:
+            return self._with_chats(self.below)
+
+    def inactive_ids(self, days, now=None):
+        """Users with no activity for `days` days, least recently active first."""
+        cutoff = (now or time.time()) - days * DAY_SECONDS
+        user_ids = []
+        with self.lock:
+            for user_id, last_active in self.activity.items():
+                if last_active >= cutoff:
+                    break
+                user_ids.append(user_id)
+        return user_ids
+
+    def inactive(self, days, now=None):
+        user_ids = self.inactive_ids(days, now)
+        with self.lock:
+            return self._with_chats(user_ids)
+
+    def new_users(self, days, now=None):
+        cutoff = (now or time.time()) - days * DAY_SECONDS
+        user_ids = []
+        with self.lock:
+            for user_id in reversed(self.registered):
+                if self.registered[user_id] < cutoff:
+                    break
+                user_ids.append(user_id)
+            return self._with_chats(user_ids)
+
+    def members(self, user_ids):
+        with self.lock:
+            return self._with_chats(user_ids)
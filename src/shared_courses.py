@@ -0,0 +1,128 @@
+import logging
+import secrets
+import threading
+from collections import defaultdict
+from datetime import datetime
+import pytz
+
+logger = logging.getLogger(__name__)
+
+SHARED_COURSE_HEADERS = ['Course Code', 'Course Nickname', 'Join Code', 'Owner ID', 'Created']
+JOIN_CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'  # No 0/O or 1/I to misread
+JOIN_CODE_LENGTH = 6
+COURSE_CODE_PREFIX = 'class-'
+
+
+def normalize_join_code(text):
+    return str(text).strip().upper()
+
+
+class SharedCourseStore:
+    """Class courses shared by a representative and the students who joined them.
+
+    Courses live in the 'Shared Courses' worksheet. Every member has an ordinary
+    course row in the main sheet under the shared course code, so marking,
+    reminders and reports work on it unchanged. The member index (course code ->
+    user ids) is seeded from the sheet once and then kept current from tracker
+    events, so membership checks and member counts never scan the sheet.
+    """
+    def __init__(self, google_sheets):
+        self.worksheet = google_sheets.get_or_create_worksheet('Shared Courses', SHARED_COURSE_HEADERS)
+        self.lock = threading.Lock()
+        self.courses = {}  # course code -> course dict
+        self.join_codes = {}  # join code -> course code
+        self.members = defaultdict(set)  # course code -> member user ids
+
+    def load(self, rows):
+        """Loads the shared courses from their worksheet and indexes members from the main sheet rows."""
+        courses = {}
+        for record in self.worksheet.get_all_records():
+            try:
+                course = {
+                    'Course Code': str(record['Course Code']).strip(),
+                    'Course Nickname': str(record['Course Nickname']).strip(),
+                    'Join Code': normalize_join_code(record['Join Code']),
+                    'Owner ID': str(record['Owner ID']).strip(),
+                }
+            except KeyError as e:
+                logger.warning(f"Skipping invalid shared course row {record}: {e}")
+                continue
+            courses[course['Course Code']] = course
+
+        members = defaultdict(set)
+        for row in rows:
+            course_code = str(row.get('Course Code', '')).strip()
+            if course_code in courses:
+                members[course_code].add(str(row['User ID']).strip())
+
+        with self.lock:
+            self.courses = courses
+            self.join_codes = {course['Join Code']: code for code, course in courses.items()}
+            self.members = members
+        logger.info(f"Loaded {len(courses)} shared courses with {sum(len(ids) for ids in members.values())} members")
+
+    def _new_join_code(self):
+        while True:
+            join_code = ''.join(secrets.choice(JOIN_CODE_ALPHABET) for _ in range(JOIN_CODE_LENGTH))
+            if join_code not in self.join_codes:
+                return join_code
+
+    def create(self, owner_id, nickname):
+        """Creates a shared course owned by `owner_id` and returns it."""
+        with self.lock:
+            join_code = self._new_join_code()
+        course = {
+            'Course Code': f"{COURSE_CODE_PREFIX}{join_code}",
+            'Course Nickname': nickname,
+            'Join Code': join_code,
+            'Owner ID': str(owner_id).strip(),
+        }
+        created = datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S')
+        self.worksheet.append_row([course['Course Code'], nickname, join_code, course['Owner ID'], created])
+        self.add(course)
+        logger.info(f"Shared course {course['Course Code']} created by user {owner_id}")
+        return course
+
+    def add(self, course):
+        """Registers a course created here or by another worker."""
+        with self.lock:
+            self.courses[course['Course Code']] = course
+            self.join_codes[course['Join Code']] = course['Course Code']
+
+    def by_join_code(self, join_code):
+        with self.lock:
+            course_code = self.join_codes.get(normalize_join_code(join_code))
+            return self.courses.get(course_code)
+
+    def get(self, course_code):
+        return self.courses.get(str(course_code).strip())
+
+    def is_shared(self, course_code):
+        return str(course_code).strip() in self.courses
+
+    def owned_by(self, user_id):
+        user_id = str(user_id).strip()
+        with self.lock:
+            return [course for course in self.courses.values() if course['Owner ID'] == user_id]
+
+    def member_ids(self, course_code):
+        with self.lock:
+            return set(self.members.get(str(course_code).strip(), ()))
+
+    def member_count(self, course_code):
+        return len(self.members.get(str(course_code).strip(), ()))
+
+    def is_member(self, course_code, user_id):
+        return str(user_id).strip() in self.members.get(str(course_code).strip(), ())
+
+    def on_attendance_event(self, event, row):
+        """Tracker listener that keeps the member index current as member rows are added and deleted."""
+        course_code = str(row.get('Course Code', '')).strip()
+        if course_code not in self.courses:
+            return
+        user_id = str(row.get('User ID', '')).strip()
+        with self.lock:
+            if event == 'add':
+                self.members[course_code].add(user_id)
+            elif event == 'delete':
+                self.members[course_code].discard(user_id)
@@ -0,0 +1,107 @@
+import threading
+import time
+
+CACHE_TTL_SECONDS = 60
+
+
+def row_key(row):
+    """The (User ID, Course Code) pair that identifies a row of sheet1."""
+    return str(row.get('User ID', '')).strip(), str(row.get('Course Code', '')).strip()
+
+
+class SheetCache:
+    """In-memory copy of sheet1's records, kept in step with the writes made through GoogleSheets.
+
+    Every mirrored write bumps `version`. A full read takes the version before it
+    starts and only replaces the rows if it is unchanged when the read returns,
+    so a write mirrored while the read was in flight is never overwritten by the
+    older copy. `warmed` is set the first time rows are installed and stays set
+    when the rows are dropped later to force a re-read.
+    """
+    def __init__(self, ttl=CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.rows = None
+        self.loaded_at = 0.0
+        self.version = 0
+        self.warmed = threading.Event()
+
+    def get(self):
+        """Returns a copy of the rows while they are younger than the TTL, else None."""
+        with self.lock:
+            if self.rows is not None and time.monotonic() - self.loaded_at < self.ttl:
+                return list(self.rows)
+            return None
+
+    def snapshot(self):
+        """Returns a copy of the rows regardless of their age, or None if there are none."""
+        with self.lock:
+            return list(self.rows) if self.rows is not None else None
+
+    def begin_load(self):
+        """Returns the version to pass to install() once the read started now has returned."""
+        with self.lock:
+            return self.version
+
+    def install(self, rows, version):
+        """Replaces the rows with a full read begun at `version`; returns False if a write was mirrored since."""
+        with self.lock:
+            if version != self.version:
+                return False
+            self.rows = rows
+            self.loaded_at = time.monotonic()
+            self.version += 1
+            self.warmed.set()
+            return True
+
+    def invalidate(self):
+        """Drops the rows so the next read goes to Sheets; reads already in flight are not installed."""
+        with self.lock:
+            self.rows = None
+            self.version += 1
+
+    def add_column(self, column_name):
+        with self.lock:
+            for row in self.rows or []:
+                row.setdefault(column_name, '')
+
+    def _find(self, key):
+        for i, row in enumerate(self.rows):
+            if row_key(row) == key:
+                return i
+        return None
+
+    def apply(self, op, data, headers):
+        """Mirrors a write into the rows.
+
+        Rows are addressed by their (User ID, Course Code) key rather than their
+        position, so a write applied twice or after a re-read that already holds
+        it leaves the rows unchanged. Ops are 'set' [[key, values], ...],
+        'append' values (replacing a row with the same key), 'delete' key and
+        'delete_rows' [key, ...].
+        """
+        with self.lock:
+            self.version += 1
+            if self.rows is None:
+                return
+            rows = self.rows
+            if op == 'set':
+                for key, values in data:
+                    i = self._find(tuple(key))
+                    if i is not None:
+                        rows[i] = dict(rows[i], **values)
+            elif op == 'append':
+                values = list(data) + [''] * (len(headers) - len(data))
+                row = dict(zip(headers, values))
+                i = self._find(row_key(row))
+                if i is None:
+                    rows.append(row)
+                else:
+                    rows[i] = row
+            elif op == 'delete':
+                i = self._find(tuple(data))
+                if i is not None:
+                    del rows[i]
+            elif op == 'delete_rows':
+                keys = {tuple(key) for key in data}
+                self.rows = [row for row in rows if row_key(row) not in keys]
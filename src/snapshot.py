@@ -0,0 +1,191 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "attendio_snapshot.bin"
+SNAPSHOT_INTERVAL_SECONDS = 300
+
+# File layout (little endian):
+#   header:   magic, format version, section count, created (unix time), crc32 of everything after the header
+#   sections: tag, payload length, payload
+# Readers skip sections with unknown tags, so new sections can be added without a version bump.
+MAGIC = b'ATSN'
+VERSION = 1
+HEADER = struct.Struct('<4sHHdI')
+SECTION = struct.Struct('<4sI')
+
+# Cell encodings in the ROWS section
+CELL_EMPTY, CELL_STR, CELL_INT, CELL_FLOAT = 0, 1, 2, 3
+INT64 = struct.Struct('<q')
+FLOAT64 = struct.Struct('<d')
+UINT32 = struct.Struct('<I')
+ROWS_HEADER = struct.Struct('<IH')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def encode_rows(headers, rows):
+    """Encodes sheet records as row count, column count and typed cells in header order."""
+    parts = [ROWS_HEADER.pack(len(rows), len(headers))]
+    for row in rows:
+        for name in headers:
+            value = row.get(name, '')
+            if value == '' or value is None:
+                parts.append(bytes((CELL_EMPTY,)))
+            elif isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63:
+                parts.append(bytes((CELL_INT,)) + INT64.pack(value))
+            elif isinstance(value, float):
+                parts.append(bytes((CELL_FLOAT,)) + FLOAT64.pack(value))
+            else:
+                data = str(value).encode('utf-8')
+                parts.append(bytes((CELL_STR,)) + UINT32.pack(len(data)) + data)
+    return b''.join(parts)
+
+
+def decode_rows(buffer, offset, headers):
+    """Decodes a ROWS payload starting at `offset` of `buffer` into record dicts."""
+    count, columns = ROWS_HEADER.unpack_from(buffer, offset)
+    if columns != len(headers):
+        raise SnapshotError(f"Snapshot has {columns} columns but {len(headers)} headers")
+    offset += ROWS_HEADER.size
+    rows = []
+    for _ in range(count):
+        row = {}
+        for name in headers:
+            kind = buffer[offset]
+            offset += 1
+            if kind == CELL_EMPTY:
+                row[name] = ''
+            elif kind == CELL_INT:
+                row[name] = INT64.unpack_from(buffer, offset)[0]
+                offset += INT64.size
+            elif kind == CELL_FLOAT:
+                row[name] = FLOAT64.unpack_from(buffer, offset)[0]
+                offset += FLOAT64.size
+            elif kind == CELL_STR:
+                length = UINT32.unpack_from(buffer, offset)[0]
+                offset += UINT32.size
+                row[name] = bytes(buffer[offset:offset + length]).decode('utf-8')
+                offset += length
+            else:
+                raise SnapshotError(f"Unknown cell type {kind}")
+        rows.append(row)
+    return rows
+
+
+def write_snapshot(path, headers, rows, state):
+    """Writes the snapshot atomically and returns its size in bytes."""
+    sections = [
+        (b'HDRS', json.dumps(headers).encode('utf-8')),
+        (b'ROWS', encode_rows(headers, rows)),
+        (b'STAT', json.dumps(state).encode('utf-8')),
+    ]
+    body = b''.join(SECTION.pack(tag, len(payload)) + payload for tag, payload in sections)
+    data = HEADER.pack(MAGIC, VERSION, len(sections), time.time(), zlib.crc32(body)) + body
+
+    temp_path = f"{path}.tmp"
+    # The rows include phone numbers and user ids, so only the bot's user may read the file
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)  # A temp file left by an earlier run keeps its old mode otherwise
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return len(data)
+
+
+def read_snapshot(path):
+    """Memory-maps a snapshot file and returns (created, headers, rows, state).
+
+    Raises SnapshotError if the file is from another format version or is damaged.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        if len(buffer) < HEADER.size:
+            raise SnapshotError("Snapshot is truncated")
+        magic, version, section_count, created, checksum = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise SnapshotError("Not a snapshot file")
+        if version != VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {version}")
+        if zlib.crc32(memoryview(buffer)[HEADER.size:]) != checksum:
+            raise SnapshotError("Snapshot checksum mismatch")
+
+        sections = {}
+        offset = HEADER.size
+        for _ in range(section_count):
+            tag, length = SECTION.unpack_from(buffer, offset)
+            offset += SECTION.size
+            sections[tag] = (offset, length)
+            offset += length
+
+        def payload(tag):
+            start, length = sections[tag]
+            return buffer[start:start + length]
+
+        headers = json.loads(payload(b'HDRS'))
+        rows = decode_rows(buffer, sections[b'ROWS'][0], headers)
+        state = json.loads(payload(b'STAT')) if b'STAT' in sections else {}
+    return created, headers, rows, state
+
+
+class SnapshotKeeper:
+    """Periodically persists the sheet snapshot and operational state for warm restarts."""
+    def __init__(self, google_sheets, get_state, path=SNAPSHOT_FILE, interval=SNAPSHOT_INTERVAL_SECONDS):
+        self.google_sheets = google_sheets
+        self.get_state = get_state
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def save(self):
+        rows = self.google_sheets.cache.snapshot()
+        headers = list(self.google_sheets.headers)
+        if rows is None:
+            return False
+        try:
+            start = time.perf_counter()
+            size = write_snapshot(self.path, headers, rows, self.get_state())
+            logger.info(f"Snapshot of {len(rows)} rows saved ({size / 1024:.1f}KB in {(time.perf_counter() - start) * 1000:.1f}ms)")
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Error saving snapshot to {self.path}: {e}")
+            return False
+
+    def load(self):
+        """Returns (created, headers, rows, state) from the snapshot file, or None if unusable."""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            start = time.perf_counter()
+            snapshot = read_snapshot(self.path)
+            logger.info(f"Snapshot of {len(snapshot[2])} rows loaded in {(time.perf_counter() - start) * 1000:.1f}ms")
+            return snapshot
+        except (OSError, ValueError, KeyError, struct.error, SnapshotError) as e:
+            logger.warning(f"Ignoring snapshot {self.path}: {e}")
+            return None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='snapshot', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the periodic saves and writes a final snapshot."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+        self.save()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.save()
@@ -0,0 +1,68 @@
+import math
+
+THRESHOLD_COLUMN = 'Threshold'
+MIN_THRESHOLD = 1.0
+MAX_THRESHOLD = 99.0  # 100% would make every absence unrecoverable
+
+
+def as_int(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_threshold(value):
+    """Parses a threshold like '85' or '85%'; raises ValueError if it is out of range."""
+    threshold = float(str(value).strip().rstrip('%'))
+    if not MIN_THRESHOLD <= threshold <= MAX_THRESHOLD:
+        raise ValueError(f"The threshold must be between {MIN_THRESHOLD:.0f}% and {MAX_THRESHOLD:.0f}%")
+    return threshold
+
+
+def course_threshold(row, default):
+    """The threshold of a course row, falling back to `default` when it has none."""
+    value = row.get(THRESHOLD_COLUMN, '')
+    if value == '' or value is None:
+        return default
+    try:
+        return parse_threshold(value)
+    except ValueError:
+        return default
+
+
+def format_threshold(threshold):
+    return f"{threshold:g}%"
+
+
+class Verdicts:
+    """Attendance verdicts of many course rows, computed at once.
+
+    Each attribute is a list aligned with `rows`: the percentage, the threshold
+    in effect, whether the course is below it, the classes needed to get back
+    above it and the classes that can still be missed.
+    """
+    def __init__(self, rows, default_threshold):
+        self.percentage = []
+        self.threshold = []
+        self.below = []
+        self.needed = []
+        self.left = []
+        for row in rows:
+            present = as_int(row.get('Present'))
+            absent = as_int(row.get('Absent'))
+            threshold = course_threshold(row, default_threshold)
+            total = present + absent
+            percentage = present * 100 / total if total else 100.0
+            # Attending n more gives (p + n) / (p + a + n) >= t / 100; missing k keeps p / (p + a + k) >= t / 100
+            needed = math.ceil((threshold * total - 100 * present) / (100 - threshold) - 1e-9)
+            left = math.floor(100 * present / threshold - total + 1e-9)
+
+            self.percentage.append(percentage)
+            self.threshold.append(threshold)
+            self.below.append(percentage < threshold)
+            self.needed.append(max(0, needed))
+            self.left.append(max(0, left))
+
+    def __len__(self):
+        return len(self.percentage)
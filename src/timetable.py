@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+import pytz
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+IST_TIMEZONE = pytz.timezone('Asia/Kolkata')
+DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+TIMETABLE_HEADERS = ['User ID', 'Chat ID', 'Course Code', 'Course Nickname', 'Day', 'Start', 'End']
+MINUTES_PER_WEEK = 7 * 24 * 60
+WHEEL_STATE_FILE = "reminder_wheel.json"
+
+
+def parse_day(text):
+    """Returns the weekday index (Monday = 0) for a day name like 'mon' or 'Monday'."""
+    prefix = text.strip()[:3].capitalize()
+    if prefix not in DAYS:
+        raise ValueError(f"Unknown day '{text}'")
+    return DAYS.index(prefix)
+
+
+def parse_time(text):
+    """Returns minutes since midnight for an 'HH:MM' string."""
+    hours, minutes = text.strip().split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Invalid time '{text}'")
+    return hours * 60 + minutes
+
+
+def minute_of_week(moment):
+    """Returns the minute of the week (Monday 00:00 = 0) of an IST datetime."""
+    return moment.weekday() * 24 * 60 + moment.hour * 60 + moment.minute
+
+
+class TimetableStore:
+    """Weekly class slots kept in the 'Timetable' worksheet and mirrored in memory."""
+    def __init__(self, google_sheets):
+        self.google_sheets = google_sheets
+        self.worksheet = google_sheets.get_or_create_worksheet('Timetable', TIMETABLE_HEADERS)
+        self.lock = threading.Lock()
+        self.slots = []
+
+    def load(self):
+        """Loads every slot from the worksheet."""
+        slots = []
+        for row in self.worksheet.get_all_records():
+            try:
+                slots.append({
+                    'User ID': str(row['User ID']).strip(),
+                    'Chat ID': row.get('Chat ID') or row['User ID'],
+                    'Course Code': str(row['Course Code']).strip(),
+                    'Course Nickname': str(row['Course Nickname']).strip(),
+                    'Day': parse_day(str(row['Day'])),
+                    'Start': parse_time(str(row['Start'])),
+                    'End': parse_time(str(row['End'])),
+                })
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Skipping invalid timetable row {row}: {e}")
+        with self.lock:
+            self.slots = slots
+        logger.info(f"Loaded {len(slots)} timetable slots")
+        return slots
+
+    def user_slots(self, user_id):
+        user_id = str(user_id).strip()
+        with self.lock:
+            return sorted((slot for slot in self.slots if slot['User ID'] == user_id),
+                          key=lambda slot: (slot['Day'], slot['Start']))
+
+    def add_slot(self, user_id, chat_id, course_code, course_nickname, day, start, end):
+        slot = {
+            'User ID': str(user_id).strip(), 'Chat ID': chat_id, 'Course Code': course_code,
+            'Course Nickname': course_nickname, 'Day': day, 'Start': start, 'End': end,
+        }
+        self.worksheet.append_row([
+            slot['User ID'], chat_id, course_code, course_nickname, DAYS[day],
+            f"{start // 60:02d}:{start % 60:02d}", f"{end // 60:02d}:{end % 60:02d}",
+        ])
+        with self.lock:
+            self.slots.append(slot)
+        return slot
+
+    def remove_slot(self, user_id, course_nickname, day, start):
+        """Removes a slot and returns it, or None if no such slot exists."""
+        user_id = str(user_id).strip()
+        # Found and deleted under the row lock so another worker can't shift the row in between;
+        # the read and the delete are paid for before waiting for the lock
+        with self.google_sheets.quota.reserved(2), self.google_sheets.locked():
+            for i, row in enumerate(self.worksheet.get_all_records()):
+                try:
+                    matches = (str(row['User ID']).strip() == user_id
+                               and str(row['Course Nickname']).strip().lower() == course_nickname.lower()
+                               and parse_day(str(row['Day'])) == day
+                               and parse_time(str(row['Start'])) == start)
+                except (KeyError, ValueError):
+                    continue
+                if matches:
+                    self.worksheet.delete_rows(i + 2)
+                    with self.lock:
+                        for slot in self.slots:
+                            if (slot['User ID'] == user_id and slot['Course Nickname'].lower() == course_nickname.lower()
+                                    and slot['Day'] == day and slot['Start'] == start):
+                                self.slots.remove(slot)
+                                return slot
+                    return None
+        return None
+
+
+class ReminderWheel:
+    """Timing wheel with one slot per minute of the week for post-class prompts.
+
+    A weekly timetable repeats exactly, so every entry stays in its slot forever
+    and firing a minute is a single list lookup no matter how many timers exist.
+    The last processed minute is persisted so prompts missed during a short
+    restart are caught up, and prompts are handed to the rate-limited outbox.
+    """
+    def __init__(self, outbox, state_file=WHEEL_STATE_FILE, catch_up_minutes=60):
+        self.outbox = outbox
+        self.state_file = state_file
+        self.catch_up_minutes = catch_up_minutes
+        self.slots = defaultdict(list)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_tick = None
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(entries) for entries in self.slots.values())
+
+    def add(self, slot):
+        """Schedules the prompt for a timetable slot right after the class ends."""
+        tick = (slot['Day'] * 24 * 60 + slot['End']) % MINUTES_PER_WEEK
+        with self.lock:
+            if slot not in self.slots[tick]:
+                self.slots[tick].append(slot)
+
+    def remove(self, slot):
+        tick = (slot['Day'] * 24 * 60 + slot['End']) % MINUTES_PER_WEEK
+        with self.lock:
+            if slot in self.slots.get(tick, []):
+                self.slots[tick].remove(slot)
+
+    def load(self, slots):
+        with self.lock:
+            self.slots = defaultdict(list)
+        for slot in slots:
+            self.add(slot)
+
+    def start(self):
+        self.last_tick = self._load_last_tick()
+        self.thread = threading.Thread(target=self._run, name='reminder-wheel', daemon=True)
+        self.thread.start()
+        logger.info(f"Reminder wheel started with {len(self)} timers")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                now = datetime.now(IST_TIMEZONE)
+                self.advance(int(now.timestamp() // 60))
+            except Exception as e:
+                logger.error(f"Error advancing reminder wheel: {e}")
+            # Sleep until just after the next minute boundary
+            self.stop_event.wait(60 - time.time() % 60 + 0.5)
+
+    def advance(self, epoch_minute):
+        """Fires every slot between the last processed minute and `epoch_minute`."""
+        if self.last_tick is None or epoch_minute - self.last_tick > self.catch_up_minutes:
+            self.last_tick = epoch_minute - 1
+        for minute in range(self.last_tick + 1, epoch_minute + 1):
+            moment = datetime.fromtimestamp(minute * 60, IST_TIMEZONE)
+            with self.lock:
+                due = list(self.slots.get(minute_of_week(moment), ()))
+            for slot in due:
+                self._prompt(slot)
+        if epoch_minute != self.last_tick:
+            self.last_tick = epoch_minute
+            self._save_last_tick()
+
+    def _prompt(self, slot):
+        course_code = slot['Course Code']
+        keyboard = [[
+            InlineKeyboardButton("Present ✅", callback_data=f"rm:{course_code}:1"),
+            InlineKeyboardButton("Absent ❌", callback_data=f"rm:{course_code}:0"),
+        ]]
+        self.outbox.send_message(
+            slot['Chat ID'],
+            f"🔔 Your {slot['Course Nickname']} class just ended. Mark attendance for {slot['Course Nickname']}?",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+
+    def _load_last_tick(self):
+        try:
+            with open(self.state_file) as f:
+                return int(json.load(f)['last_tick'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_last_tick(self):
+        try:
+            tmp_file = self.state_file + ".tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump({'last_tick': self.last_tick}, f)
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            logger.error(f"Error saving reminder wheel state: {e}")
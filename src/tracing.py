@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from queue import Queue
+from telegram import Bot, Update
+from telegram.ext import Dispatcher, JobQueue, Updater
+from telegram.utils.request import Request
+from profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ('name', 'start', 'duration', 'depth', 'error')
+
+    def __init__(self, name, start, depth):
+        self.name = name
+        self.start = start
+        self.duration = None
+        self.depth = depth
+        self.error = False
+
+
+class Trace:
+    __slots__ = ('trace_id', 'update_id', 'description', 'start', 'wall_start', 'duration', 'spans', 'depth')
+
+    def __init__(self, update_id, description):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.update_id = update_id
+        self.description = description
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.duration = None
+        self.spans = []
+        self.depth = 0
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id, 'update_id': self.update_id, 'description': self.description,
+            'start': self.wall_start, 'duration': self.duration,
+            'spans': [
+                {'name': span.name, 'offset': span.start - self.start, 'duration': span.duration,
+                 'depth': span.depth, 'error': span.error}
+                for span in self.spans
+            ],
+        }
+
+
+class Tracer:
+    """Per-update tracing with nested spans kept in an in-memory ring buffer.
+
+    Only sampled updates get a Trace; for everything else begin() is a single
+    thread-local lookup that returns None, so tracing costs almost nothing when off.
+    """
+    def __init__(self, sample_rate=0.0, max_traces=500, jsonl_path=None):
+        self.sample_rate = sample_rate
+        self.max_traces = max_traces
+        self.jsonl_path = jsonl_path
+        self.traces = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start_trace(self, update_id, description=''):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        trace = Trace(update_id, description)
+        self.local.trace = trace
+        return trace
+
+    def finish_trace(self, trace):
+        if trace is None:
+            return
+        self.local.trace = None
+        trace.duration = time.perf_counter() - trace.start
+        with self.lock:
+            self.traces[trace.update_id] = trace
+            while len(self.traces) > self.max_traces:
+                self.traces.popitem(last=False)
+        if self.jsonl_path:
+            try:
+                with open(self.jsonl_path, 'a') as f:
+                    f.write(json.dumps(trace.to_dict()) + '\n')
+            except OSError as e:
+                logger.error(f"Error writing trace to {self.jsonl_path}: {e}")
+
+    def begin(self, name):
+        """Opens a span in the current trace; returns None when the update is not sampled."""
+        trace = getattr(self.local, 'trace', None)
+        if trace is None:
+            return None
+        span = Span(name, time.perf_counter(), trace.depth)
+        trace.depth += 1
+        trace.spans.append(span)
+        return span
+
+    def end(self, span, error=False):
+        if span is None:
+            return
+        span.duration = time.perf_counter() - span.start
+        span.error = error
+        trace = getattr(self.local, 'trace', None)
+        if trace is not None:
+            trace.depth -= 1
+
+    def get(self, update_id):
+        with self.lock:
+            return self.traces.get(update_id)
+
+    def recent(self, count=10):
+        with self.lock:
+            return list(self.traces.values())[-count:]
+
+
+tracer = Tracer(
+    sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0") or 0),
+    jsonl_path=os.getenv("TRACE_JSONL_PATH") or None,
+)
+
+
+def describe_update(update):
+    if update.callback_query:
+        return f"callback {update.callback_query.data}"
+    if update.message:
+        if update.message.text:
+            return f"message {update.message.text.split()[0][:32]}"
+        if update.message.contact:
+            return "contact"
+    return "update"
+
+
+def format_waterfall(trace, width=20):
+    """Renders a trace as a text waterfall of its spans."""
+    total = trace.duration or 1e-9
+    lines = [f"Trace {trace.trace_id} – update {trace.update_id} ({trace.description}) {total * 1000:.1f}ms"]
+    for span in trace.spans:
+        offset = span.start - trace.start
+        duration = span.duration or 0.0
+        begin = int(offset / total * width)
+        length = max(1, int(duration / total * width))
+        bar = ' ' * begin + '█' * min(length, width - begin)
+        flag = ' ✗' if span.error else ''
+        lines.append(f"|{bar:<{width}}| {'  ' * span.depth}{span.name} {duration * 1000:.1f}ms{flag}")
+    return "\n".join(lines)
+
+
+class TracingRequest(Request):
+    """Telegram HTTP client that records each Bot API call as a span."""
+    def post(self, url, data, timeout=None):
+        span = tracer.begin(f"telegram.{url.rsplit('/', 1)[-1]}")
+        error = True
+        try:
+            result = super().post(url, data, timeout=timeout)
+            error = False
+            return result
+        finally:
+            tracer.end(span, error)
+
+
+class TracingDispatcher(Dispatcher):
+    """Dispatcher that opens a trace around the processing of every sampled update.
+
+    Also runs updates under the on-demand profiler while an admin has armed it.
+    """
+    def process_update(self, update):
+        if profiler.armed:
+            return profiler.profile_update(self._process_traced, update)
+        return self._process_traced(update)
+
+    def _process_traced(self, update):
+        if not isinstance(update, Update):
+            return super().process_update(update)
+        trace = tracer.start_trace(update.update_id, describe_update(update))
+        try:
+            return super().process_update(update)
+        finally:
+            tracer.finish_trace(trace)
+
+
+def create_updater(token, workers=4):
+    """Builds an Updater whose dispatcher and Telegram requests are traced."""
+    bot = Bot(token, request=TracingRequest(con_pool_size=workers + 4))
+    job_queue = JobQueue()
+    dispatcher = TracingDispatcher(bot, Queue(), workers=workers, job_queue=job_queue)
+    job_queue.set_dispatcher(dispatcher)
+    return Updater(dispatcher=dispatcher, workers=None)
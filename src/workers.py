@@ -0,0 +1,384 @@
+"""Multi-process mode: a front process routes updates to N worker processes by user.
+
+The front receives updates (webhook or polling) and, without building Update
+objects, hashes the sender's user id to a worker, so every user is always
+served by the same process. That process holds that user's rate-limit state,
+conversation state and hot cache rows. Workers are full copies of the bot
+built with create_app() and differ only in their shard index; worker 0 also
+runs the scheduler, the reminder wheel and the snapshot keeper.
+
+State that must be the same everywhere (blocks, sheet writes, attendance and
+timetable events) is published as small JSON-able events. By default they
+travel over multiprocessing queues through a hub thread in the front; with
+REDIS_URL set they use Redis pub/sub instead (needs the optional `redis`
+package), which also works for workers on other hosts.
+
+Events arrive late, so they only keep caches warm. Writes that address sheet
+rows by position take a row lock shared by all workers (a process lock from
+the front, or a Redis lock with REDIS_URL) and look their rows up under it by
+reading only the key columns (see GoogleSheets.rows_for_write()). Each worker
+gets an equal share of the Sheets quota and takes the tokens for a write
+before the lock. Such writes are still serialized: together the workers make
+at most about 30 of them per minute, half the quota of 60 requests.
+Workers report their readiness and metrics to the front through the hub, and
+the front serves them at /readyz and /metrics.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import tornado.ioloop
+import tornado.web
+from metrics import merge_worker_metrics, render_gauges
+
+logger = logging.getLogger(__name__)
+
+EVENT_CHANNEL = 'attendio:events'
+ROW_LOCK_NAME = 'attendio:row-lock'
+ROW_LOCK_EXPIRY = 120  # Seconds before Redis frees the row lock of a worker that died holding it
+STATUS_INTERVAL = 15  # Seconds between worker status reports to the front
+
+# Update fields that carry the user who caused the update, in lookup order
+UPDATE_KINDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+    'chat_join_request', 'channel_post', 'edited_channel_post',
+)
+
+
+def user_id_of(data):
+    """Returns the id of the user behind a raw update dict, or None."""
+    for kind in UPDATE_KINDS:
+        item = data.get(kind)
+        if item:
+            user = item.get('from') or item.get('user')
+            if user:
+                return user.get('id')
+            return None
+    return None
+
+
+def shard_for(user_id, workers):
+    """Worker index serving `user_id`; updates without a user go to worker 0."""
+    if user_id is None:
+        return 0
+    return int(user_id) % workers
+
+
+class SharedRowLock:
+    """Row lock shared by the worker processes of one front.
+
+    Remembers the pid of its holder so the front can free it when that worker
+    dies while holding it.
+    """
+    def __init__(self, context):
+        self.lock = context.Lock()
+        self.holder = context.Value('i', 0)
+
+    def acquire(self, timeout=None):
+        if not self.lock.acquire(timeout=timeout):
+            return False
+        self.holder.value = os.getpid()
+        return True
+
+    def release(self):
+        self.holder.value = 0
+        self.lock.release()
+
+    def release_if_held_by(self, pid):
+        """Frees the lock if the (dead) process `pid` holds it; returns True if it did."""
+        if pid and self.holder.value == pid:
+            self.holder.value = 0
+            self.lock.release()
+            return True
+        return False
+
+
+class RedisRowLock:
+    """Row lock shared through Redis by workers on any host; it expires if its holder dies."""
+    def __init__(self, client):
+        self.lock = client.lock(ROW_LOCK_NAME, timeout=ROW_LOCK_EXPIRY)
+
+    def acquire(self, timeout=None):
+        return self.lock.acquire(blocking_timeout=timeout)
+
+    def release(self):
+        self.lock.release()
+
+
+class QueueBus:
+    """Publishes events to the front's hub, which forwards them to every other worker."""
+    def __init__(self, index, hub, row_lock):
+        self.index = index
+        self.hub = hub
+        self.row_lock = row_lock
+        self.handler = None
+
+    def start(self, handler):
+        # Events from other workers arrive through this worker's inbox; see serve_inbox()
+        self.handler = handler
+
+    def publish(self, event):
+        self.hub.put((self.index, event))
+
+    def deliver(self, event):
+        if self.handler is not None:
+            self.handler(event)
+
+
+class RedisBus:
+    """Publishes events on a Redis channel and delivers the ones from other workers."""
+    def __init__(self, index, url):
+        import redis  # Optional dependency, only needed when REDIS_URL is set
+
+        self.index = index
+        self.client = redis.Redis.from_url(url)
+        self.row_lock = RedisRowLock(self.client)
+        self.handler = None
+        self.thread = None
+
+    def start(self, handler):
+        self.handler = handler
+        self.thread = threading.Thread(target=self._listen, name='event-bus', daemon=True)
+        self.thread.start()
+
+    def publish(self, event):
+        self.client.publish(EVENT_CHANNEL, json.dumps({'origin': self.index, 'event': event}))
+
+    def deliver(self, event):
+        if self.handler is not None:
+            self.handler(event)
+
+    def _listen(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(EVENT_CHANNEL)
+        for message in pubsub.listen():
+            try:
+                envelope = json.loads(message['data'])
+                if envelope['origin'] != self.index:
+                    self.deliver(envelope['event'])
+            except Exception as e:
+                logger.error(f"Error handling bus event: {e}")
+
+
+def worker_entry(index, workers, config, inbox, hub, row_lock):
+    """Process target of a worker; imports the bot inside the child process."""
+    import bot
+
+    bot.run_worker(index, workers, config, inbox, hub, row_lock)
+
+
+def create_bus(index, hub, row_lock):
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        return RedisBus(index, redis_url)
+    return QueueBus(index, hub, row_lock)
+
+
+def report_status(index, hub, status, stop_event, interval=STATUS_INTERVAL):
+    """Worker thread that sends status() (readiness and metrics) to the front until `stop_event` is set."""
+    while True:
+        try:
+            hub.put((index, dict(status(), type='worker_status')))
+        except Exception as e:
+            logger.error(f"Error reporting worker status: {e}")
+        if stop_event.wait(interval):
+            return
+
+
+def serve_inbox(inbox, bus, dispatcher, bot):
+    """Worker main loop: feeds routed updates to the dispatcher and events to the bus handler."""
+    from telegram import Update
+
+    while True:
+        kind, payload = inbox.get()
+        if kind == 'update':
+            try:
+                dispatcher.update_queue.put(Update.de_json(json.loads(payload), bot))
+            except Exception as e:
+                logger.error(f"Error decoding routed update: {e}")
+        elif kind == 'event':
+            try:
+                bus.deliver(payload)
+            except Exception as e:
+                logger.error(f"Error applying event {payload.get('type')}: {e}")
+        elif kind == 'stop':
+            return
+
+
+class Router:
+    """Front-side routing of raw updates to worker inboxes and of events between workers.
+
+    Status reports from the workers are kept here instead of being forwarded.
+    """
+    def __init__(self, inboxes):
+        self.inboxes = inboxes
+        self.routed = [0] * len(inboxes)
+        self.status = [None] * len(inboxes)
+
+    def route(self, body):
+        data = json.loads(body)
+        index = shard_for(user_id_of(data), len(self.inboxes))
+        self.inboxes[index].put(('update', body if isinstance(body, str) else body.decode('utf-8')))
+        self.routed[index] += 1
+
+    def run_hub(self, hub):
+        while True:
+            origin, event = hub.get()
+            if event is None:
+                return
+            if event.get('type') == 'worker_status':
+                self.status[origin] = event
+                continue
+            for index, inbox in enumerate(self.inboxes):
+                if index != origin:
+                    inbox.put(('event', event))
+
+
+class UpdateHandler(tornado.web.RequestHandler):
+    def initialize(self, router):
+        self.router = router
+
+    def post(self):
+        try:
+            self.router.route(self.request.body)
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Rejected malformed update: {e}")
+            self.set_status(400)
+
+
+class FrontHealthHandler(tornado.web.RequestHandler):
+    def initialize(self, front):
+        self.front = front
+
+    def get(self):
+        alive = [process.is_alive() for process in self.front.processes]
+        if not all(alive):
+            self.set_status(503)
+        self.write({'workers': len(alive), 'alive': sum(alive), 'routed': self.front.router.routed})
+
+
+class FrontReadyHandler(tornado.web.RequestHandler):
+    def initialize(self, front):
+        self.front = front
+
+    def get(self):
+        ready = self.front.ready()
+        if not all(ready):
+            self.set_status(503)
+        self.write({'workers': len(ready), 'ready': sum(ready)})
+
+
+class FrontMetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, front):
+        self.front = front
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.front.render_metrics())
+
+
+class Front:
+    """Starts the workers, supervises them and routes updates to them."""
+    def __init__(self, config, workers, target=worker_entry):
+        self.config = config
+        self.workers = workers
+        self.target = target
+        self.context = multiprocessing.get_context('spawn')
+        self.inboxes = [self.context.Queue() for _ in range(workers)]
+        self.hub = self.context.Queue()
+        self.router = Router(self.inboxes)
+        self.row_lock = SharedRowLock(self.context)
+        self.processes = [None] * workers
+        self.stopping = threading.Event()
+
+    def _spawn(self, index):
+        process = self.context.Process(
+            target=self.target, args=(index, self.workers, self.config, self.inboxes[index], self.hub, self.row_lock),
+            name=f"worker-{index}", daemon=True
+        )
+        self.router.status[index] = None
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def _supervise(self):
+        while not self.stopping.wait(5):
+            for index, process in enumerate(self.processes):
+                if not process.is_alive() and not self.stopping.is_set():
+                    logger.error(f"Worker {index} exited with code {process.exitcode}; restarting it")
+                    if self.row_lock.release_if_held_by(process.pid):
+                        logger.warning(f"Freed the row lock held by worker {index}")
+                    self._spawn(index)
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        threading.Thread(target=self.router.run_hub, args=(self.hub,), name='event-hub', daemon=True).start()
+        threading.Thread(target=self._supervise, name='supervisor', daemon=True).start()
+
+    def stop(self):
+        self.stopping.set()
+        for inbox in self.inboxes:
+            inbox.put(('stop', None))
+        self.hub.put((None, None))
+        for process in self.processes:
+            process.join(timeout=15)
+            if process.is_alive():
+                process.terminate()
+        logger.info("All workers stopped")
+
+    def ready(self):
+        """Per worker, True if its process is alive and its last status report said it was ready."""
+        return [
+            process is not None and process.is_alive() and bool(status and status.get('ready'))
+            for process, status in zip(self.processes, self.router.status)
+        ]
+
+    def render_metrics(self):
+        """The front's own gauges followed by every worker's last reported metrics, labelled by worker."""
+        alive = [process is not None and process.is_alive() for process in self.processes]
+        gauges = {
+            'attendio_workers_alive': ("Worker processes running.", sum(alive)),
+            'attendio_workers_ready': ("Worker processes that reported ready.", sum(self.ready())),
+        }
+        for index, routed in enumerate(self.router.routed):
+            gauges[f'attendio_routed_updates{{worker="{index}"}}'] = ("Updates routed to each worker.", routed)
+        texts = {index: status['metrics'] for index, status in enumerate(self.router.status) if status}
+        return render_gauges(gauges) + merge_worker_metrics(texts)
+
+    def serve_webhook(self, bot, port, url_path, webhook_url):
+        app = tornado.web.Application([
+            (rf"/{url_path}/?", UpdateHandler, {'router': self.router}),
+            (r"/healthz", FrontHealthHandler, {'front': self}),
+            (r"/readyz", FrontReadyHandler, {'front': self}),
+            (r"/metrics", FrontMetricsHandler, {'front': self}),
+        ])
+        app.listen(port, address="0.0.0.0")
+        bot.delete_webhook()
+        bot.set_webhook(url=webhook_url)
+        loop = tornado.ioloop.IOLoop.current()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: loop.add_callback_from_signal(loop.stop))
+        logger.info(f"Front routing webhook updates to {self.workers} workers on port {port}")
+        loop.start()
+
+    def serve_polling(self, bot):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: self.stopping.set())
+        bot.delete_webhook(drop_pending_updates=True)
+        logger.info(f"Front polling updates for {self.workers} workers")
+        offset = None
+        while not self.stopping.is_set():
+            try:
+                updates = bot.get_updates(offset=offset, timeout=10)
+            except Exception as e:
+                logger.error(f"Error polling updates: {e}")
+                time.sleep(1)
+                continue
+            for update in updates:
+                self.router.route(update.to_json())
+                offset = update.update_id + 1